@@ -0,0 +1,1152 @@
+"""Load tests and benchmarks for bot.py.
+
+Runs against the database in DATABASE_URL (use a throwaway one, --seed writes into it).
+Telegram is replaced by an in-process fake session, so no token or network is needed.
+
+    python bench.py webhook --seed 100000 --updates 2000 --concurrency 50 --mode executor
+    python bench.py webhook --updates 2000 --concurrency 50 --mode inline
+    python bench.py sampling --sizes 10000,100000,1000000   # TRUNCATEs questions
+    python bench.py explain --rows 200000   # exits 1 if a hot query plans a seq scan
+    python bench.py render --renders 100000   # no database needed
+    python bench.py scaling --workers 1,2,4 --updates 20000   # real bot.py processes over HTTP
+    python bench.py index --filters 50   # taxonomy tree vs columnar index (needs numpy)
+    python bench.py prefetch --users 2000 --rounds 5   # quiz taps with and without prefetch
+    python bench.py dedupe --sizes 10000,100000   # near-duplicate lookups, no database needed
+    python bench.py e2e --banks 10000,1000000 --updates 20000 --save base.json   # reseeds questions
+    python bench.py e2e --banks 10000,1000000 --updates 20000 --compare base.json   # exits 1 on regression
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import re
+import signal
+import statistics
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from datetime import datetime
+from types import SimpleNamespace
+
+from aiohttp import ClientSession, TCPConnector, web
+from psycopg2.extras import execute_values
+
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import SendPoll
+from aiogram.types import Chat, Message, Poll, PollOption
+
+import bot as botmod
+
+FIELDS = ["board", "year", "exam", "subject", "topic", "subtopic"]
+
+# ========================
+# FAKE TELEGRAM
+# ========================
+
+
+class FakeSession(BaseSession):
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls: dict[str, int] = defaultdict(int)
+        self._ids = itertools.count(1)
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls[type(method).__name__] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return True
+        msg_id = next(self._ids)
+        poll = None
+        if isinstance(method, SendPoll):
+            poll = Poll(
+                id=str(msg_id),
+                question=method.question,
+                options=[PollOption(text=str(o), voter_count=0) for o in method.options],
+                total_voter_count=0,
+                is_closed=False,
+                is_anonymous=False,
+                type="quiz",
+                allows_multiple_answers=False,
+                correct_option_id=method.correct_option_id,
+            )
+        return Message(
+            message_id=msg_id,
+            date=datetime.now(),
+            chat=Chat(id=chat_id, type="private"),
+            poll=poll,
+        )
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+
+class FakeBotAPI:
+    """Bot API over HTTP for bot.py processes started with TELEGRAM_API_URL pointing here.
+
+    Every method succeeds with a plausible result after `latency` seconds; calls are counted
+    per method and per chat."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: dict[str, int] = defaultdict(int)
+        self.chat_calls: dict[int, int] = defaultdict(int)
+        self._ids = itertools.count(1)
+
+    def _message(self, form) -> dict:
+        msg = {
+            "message_id": next(self._ids),
+            "date": int(time.time()),
+            "chat": {"id": int(form["chat_id"]), "type": "private"},
+        }
+        if "text" in form:
+            msg["text"] = form["text"]
+        if "question" in form:
+            options = json.loads(form["options"])
+            msg["poll"] = {
+                "id": str(msg["message_id"]),
+                "question": form["question"],
+                "options": [
+                    {"text": o["text"] if isinstance(o, dict) else str(o), "voter_count": 0} for o in options
+                ],
+                "total_voter_count": 0,
+                "is_closed": False,
+                "is_anonymous": False,
+                "type": "quiz",
+                "allows_multiple_answers": False,
+            }
+        return msg
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        try:
+            form = await request.post()
+        except ConnectionResetError:  # the bot process was stopped mid-request
+            return web.Response(status=499)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if "chat_id" in form:
+            self.chat_calls[int(form["chat_id"])] += 1
+        result = self._message(form) if "chat_id" in form and method.startswith(("send", "edit")) else True
+        return web.json_response({"ok": True, "result": result})
+
+    async def start(self, port: int) -> web.AppRunner:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        return runner
+
+
+# ========================
+# DATA
+# ========================
+
+
+def seed_questions(n: int, batch: int = 5000):
+    """Insert n synthetic questions with a realistic board/exam/subject/topic fan-out."""
+    rnd = random.Random(42)
+    boards = ["GSEB", "CBSE", "GPSC", "GSSSB", "UPSC"]
+    exams = [f"Exam{i}" for i in range(20)]
+    subjects = [f"Subject{i}" for i in range(12)]
+    with botmod.db_connection() as conn, conn.cursor() as cur:
+        rows = []
+        for i in range(n):
+            subject = rnd.choice(subjects)
+            topic = f"{subject}-Topic{rnd.randrange(25)}"
+            rows.append((
+                rnd.choice(boards), rnd.randrange(2005, 2025), rnd.choice(exams), subject, topic,
+                f"{topic}-Sub{rnd.randrange(4)}" if rnd.random() < 0.7 else "",
+                f"Synthetic question {i}?", "A", "B", "C", "D", rnd.randint(1, 4), "",
+            ))
+            if len(rows) >= batch:
+                _insert_rows(cur, rows)
+                rows = []
+        if rows:
+            _insert_rows(cur, rows)
+        conn.commit()
+
+
+def _insert_rows(cur, rows):
+    execute_values(
+        cur,
+        "INSERT INTO questions (board, year, exam, subject, topic, subtopic, question_text, "
+        "option1, option2, option3, option4, correct_option, explanation) VALUES %s",
+        rows,
+    )
+
+
+def sample_filters(k: int) -> list[dict]:
+    with botmod.db_connection() as conn, conn.cursor() as cur:
+        cur.execute(
+            "SELECT board, year, exam, subject, topic FROM questions TABLESAMPLE SYSTEM (1) LIMIT %s", (k,)
+        )
+        rows = cur.fetchall()
+    return [dict(zip(FIELDS, r)) for r in rows]
+
+
+# ========================
+# SYNTHETIC UPDATES
+# ========================
+
+
+def _user(uid: int) -> dict:
+    return {"id": uid, "is_bot": False, "first_name": f"u{uid}"}
+
+
+def message_update(update_id: int, uid: int, text: str) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": uid, "type": "private"},
+            "from": _user(uid),
+            "text": text,
+        },
+    }
+
+
+def callback_update(update_id: int, uid: int, data: str) -> dict:
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": _user(uid),
+            "chat_instance": str(uid),
+            "data": data,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": uid, "type": "private"},
+                "text": "menu",
+            },
+        },
+    }
+
+
+def update_stream(n: int, users: int, quiz_share: float):
+    """Yield (kind, update) pairs: /start, menu taps, filter sets and quiz generation."""
+    rnd = random.Random(7)
+    ids = itertools.count(1)
+    for _ in range(n):
+        uid = 10_000 + rnd.randrange(users)
+        r = rnd.random()
+        if r < quiz_share:
+            yield "generate_quiz", callback_update(next(ids), uid, "generate_quiz")
+        elif r < quiz_share + 0.1:
+            yield "start", message_update(next(ids), uid, "/start")
+        elif r < quiz_share + 0.5:
+            field = rnd.choice(FIELDS)
+            yield f"choose_{field}", callback_update(next(ids), uid, f"choose_{field}")
+        else:
+            yield "back_to_main", callback_update(next(ids), uid, "back_to_main")
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def report(title: str, latencies: dict[str, list[float]], elapsed: float):
+    total = sum(len(v) for v in latencies.values())
+    print(f"\n{title}: {total} updates in {elapsed:.2f}s -> {total / elapsed:.1f} updates/s")
+    print(f"{'handler':<20}{'count':>8}{'p50 ms':>10}{'p99 ms':>10}{'mean ms':>10}")
+    for kind in sorted(latencies):
+        v = latencies[kind]
+        print(
+            f"{kind:<20}{len(v):>8}{percentile(v, 50) * 1000:>10.1f}"
+            f"{percentile(v, 99) * 1000:>10.1f}{statistics.fmean(v) * 1000:>10.1f}"
+        )
+
+
+# ========================
+# WEBHOOK LOAD TEST
+# ========================
+
+
+async def run_updates(updates, concurrency: int) -> tuple[dict[str, list[float]], float]:
+    latencies: dict[str, list[float]] = defaultdict(list)
+    it = iter(updates)
+
+    async def worker():
+        for kind, update in it:
+            started = time.perf_counter()
+            await botmod.dp.feed_webhook_update(botmod.bot, update)
+            latencies[kind].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, time.perf_counter() - started
+
+
+async def cmd_webhook(args):
+    botmod.init_db_pool()
+    botmod.init_db()
+    if args.seed:
+        seed_questions(args.seed)
+    botmod.taxonomy.load()
+    if args.mode == "inline":
+        # what the handlers did before: call blocking helpers directly on the event loop
+        async def run_inline(func, *a, **kw):
+            return func(*a, **kw)
+
+        botmod.run_db = run_inline
+    else:
+        botmod.init_db_executor()
+
+    botmod.bot.session = FakeSession(latency=args.api_latency / 1000)
+    botmod.outbound.start()
+    updates = list(update_stream(args.updates, args.users, args.quiz_share))
+    latencies, elapsed = await run_updates(updates, args.concurrency)
+    report(f"webhook mode={args.mode} concurrency={args.concurrency}", latencies, elapsed)
+    await botmod.outbound.close(timeout=args.drain)
+    print(f"outbound: {botmod.outbound.stats()} {botmod.send_stats}")
+
+    botmod.user_filter_store.flush()
+    botmod.close_db_executor()
+    botmod.close_db_pool()
+
+
+# ========================
+# MULTI-PROCESS SCALING
+# ========================
+
+
+METRICS_TOKEN = "bench"
+
+
+async def start_server(workers: int, port: int, api_port: int, **extra_env: str) -> asyncio.subprocess.Process:
+    env = dict(
+        os.environ,
+        TELEGRAM_API_URL=f"http://127.0.0.1:{api_port}",
+        METRICS_TOKEN=METRICS_TOKEN,
+        # flood limits are Telegram's problem, not what this measures
+        TG_GLOBAL_RATE="1000000000",
+        TG_CHAT_RATE="1000000000",
+        TG_CHAT_BURST="1000000000",
+        **extra_env,
+    )
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py"),
+        "--workers", str(workers), "--host", "127.0.0.1", "--port", str(port),
+        env=env, stderr=asyncio.subprocess.PIPE,
+    )
+    listening = 0
+    while listening < workers:
+        line = await asyncio.wait_for(proc.stderr.readline(), 120)
+        if not line:
+            raise RuntimeError("bot.py exited during startup")
+        listening += b" listening on " in line
+
+    async def drain():
+        while await proc.stderr.readline():
+            pass
+
+    asyncio.create_task(drain())
+    return proc
+
+
+async def post_updates(port: int, updates: list[dict], concurrency: int, api: FakeBotAPI, timeout: float) -> float:
+    """POST callback updates to /webhook; done once each has been answered (answerCallbackQuery)."""
+    target = api.calls["answerCallbackQuery"] + len(updates)
+    it = iter(updates)
+    url = f"http://127.0.0.1:{port}/webhook"
+    started = time.perf_counter()
+    async with ClientSession(connector=TCPConnector(limit=concurrency)) as http:
+
+        async def worker():
+            for update in it:
+                async with http.post(url, json=update) as resp:
+                    await resp.read()
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    deadline = time.perf_counter() + timeout
+    while api.calls["answerCallbackQuery"] < target:
+        if time.perf_counter() > deadline:
+            print(f"  timed out with {target - api.calls['answerCallbackQuery']} updates unanswered")
+            break
+        await asyncio.sleep(0.01)
+    return time.perf_counter() - started
+
+
+async def cmd_scaling(args):
+    botmod.init_db_pool()
+    botmod.init_db()
+    if args.seed:
+        seed_questions(args.seed)
+    botmod.close_db_pool()
+    api = FakeBotAPI()
+    api_runner = await api.start(args.api_port)
+    # callback updates only: every callback handler answers exactly once, which marks it done
+    stream = [
+        u for _, u in update_stream(args.warmup + args.updates, args.users, args.quiz_share)
+        if "callback_query" in u
+    ]
+    warmup, updates = stream[: args.warmup], stream[args.warmup :]
+
+    print(f"{'workers':>8}{'updates/s':>12}{'speedup':>10}   ({os.cpu_count()} cpus, {len(updates)} updates)")
+    base = None
+    for workers in (int(w) for w in args.workers.split(",")):
+        proc = await start_server(workers, args.port, args.api_port)
+        try:
+            await post_updates(args.port, warmup, args.concurrency, api, args.timeout)
+            elapsed = await post_updates(args.port, updates, args.concurrency, api, args.timeout)
+        finally:
+            proc.send_signal(signal.SIGTERM)
+            await proc.wait()
+        rate = len(updates) / elapsed
+        base = base or rate
+        print(f"{workers:>8}{rate:>12.0f}{rate / base:>10.2f}")
+    await api_runner.cleanup()
+
+
+# ========================
+# END-TO-END LOAD TEST
+# ========================
+
+ADMIN_BASE = 900_000  # admin user ids used by AddQuestion sessions
+
+
+def reset_bank(size: int):
+    if count_rows() == size:
+        return
+    with botmod.db_connection() as conn, conn.cursor() as cur:
+        cur.execute("TRUNCATE questions RESTART IDENTITY CASCADE")
+        conn.commit()
+    seed_questions(size)
+    with botmod.db_connection() as conn, conn.cursor() as cur:
+        cur.execute("ANALYZE questions")
+        conn.commit()
+
+
+def user_stream(n: int, users: int, quiz_share: float, values: dict[str, list[str]], ids):
+    """Updates from users browsing: /start, facet menus, value taps, back, and quizzes."""
+    rnd = random.Random(9)
+    for _ in range(n):
+        uid = 10_000 + rnd.randrange(users)
+        r = rnd.random()
+        if r < quiz_share:
+            yield callback_update(next(ids), uid, "generate_quiz")
+        elif r < quiz_share + 0.05:
+            yield message_update(next(ids), uid, "/start")
+        elif r < quiz_share + 0.35:
+            yield callback_update(next(ids), uid, f"choose_{rnd.choice(FIELDS)}")
+        elif r < quiz_share + 0.6:
+            field = rnd.choice(list(values))
+            vid = botmod.value_index.id_for(field, rnd.choice(values[field]))
+            yield callback_update(next(ids), uid, f"set_{field}:{vid}")
+        else:
+            yield callback_update(next(ids), uid, "back_to_main")
+
+
+ADDQUESTION_HANDLERS = [
+    "cmd_addquestion", "addq_board", "addq_year", "addq_exam", "addq_subject", "addq_topic", "addq_subtopic",
+    "addq_question_text", "addq_option1", "addq_option2", "addq_option3", "addq_option4", "addq_correct_option",
+    "addq_explanation", "addq_save",
+]
+
+
+def addquestion_steps(rnd: random.Random) -> list[str]:
+    q = synthetic_question(rnd)
+    return [
+        "/addquestion", "GSEB", "2024", "Exam1", "Subject1", "Subject1-Topic1", "-", q["question_text"],
+        q["option1"], q["option2"], q["option3"], q["option4"], str(rnd.randint(1, 4)), "-",
+    ]
+
+
+async def scrape_metrics(port: int, workers: int, attempts: int = 200) -> list[str]:
+    # one scrape per worker: connections land on a random worker, the bot_worker pid says which
+    seen: dict[str, str] = {}
+    for _ in range(attempts):
+        async with ClientSession(connector=TCPConnector(force_close=True)) as http:
+            headers = {"Authorization": f"Bearer {METRICS_TOKEN}"}
+            async with http.get(f"http://127.0.0.1:{port}/metrics", headers=headers) as resp:
+                text = await resp.text()
+        seen[re.search(r'bot_worker\{pid="(\d+)"\}', text).group(1)] = text
+        if len(seen) >= workers:
+            break
+    return list(seen.values())
+
+
+def handler_histograms(texts: list[str]) -> dict[str, list[float]]:
+    """handler -> cumulative bucket counts (LATENCY_BUCKETS, then +Inf) and sum, over all workers."""
+    out: dict[str, list[float]] = {}
+    for text in texts:
+        counts: dict[str, list[float]] = defaultdict(list)
+        for line in text.splitlines():
+            if line.startswith(("bot_handler_seconds_bucket{", "bot_handler_seconds_sum{")):
+                labels, value = line.rsplit(" ", 1)
+                counts[re.search(r'handler="([^"]*)"', labels).group(1)].append(float(value))
+        for handler, values in counts.items():
+            total = out.setdefault(handler, [0.0] * len(values))
+            out[handler] = [a + b for a, b in zip(total, values)]
+    return out
+
+
+def bucket_quantile(cumulative: list[float], q: float) -> float:
+    # histogram_quantile(): linear within the bucket that holds the rank
+    total = cumulative[-1]
+    if not total:
+        return 0.0
+    rank = q * total
+    prev_bound, prev_count = 0.0, 0.0
+    for bound, count in zip(botmod.LATENCY_BUCKETS, cumulative):
+        if count >= rank:
+            return prev_bound + (bound - prev_bound) * (rank - prev_count) / max(count - prev_count, 1e-9)
+        prev_bound, prev_count = bound, count
+    return botmod.LATENCY_BUCKETS[-1]
+
+
+async def wait_near_duplicates(port: int, workers: int, timeout: float = 900):
+    # a new bank's MinHash signatures are computed after the workers start listening
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        texts = await scrape_metrics(port, workers)
+        if len(texts) >= workers and all('bot_near_duplicates{stat="loaded"} 1' in t for t in texts):
+            return
+        await asyncio.sleep(1)
+    raise RuntimeError("near-duplicate index not loaded")
+
+
+async def handled_updates(port: int, workers: int) -> dict[str, list[float]]:
+    return handler_histograms(await scrape_metrics(port, workers))
+
+
+async def drive(args, port: int, api: FakeBotAPI, updates: list[dict], admins: int, ids) -> dict:
+    """POST updates to /webhook while `admins` AddQuestion sessions run; waits until all are handled."""
+    url = f"http://127.0.0.1:{port}/webhook"
+    before = await handled_updates(port, args.workers)
+    ingest: list[float] = []
+    posted = 0
+    sessions = 0
+    it = iter(enumerate(updates))
+    done = asyncio.Event()
+    rnd = random.Random(13)
+
+    async with ClientSession(connector=TCPConnector(limit=args.concurrency + admins)) as http:
+
+        async def post(update: dict):
+            nonlocal posted
+            started = time.perf_counter()
+            async with http.post(url, json=update) as resp:
+                await resp.read()
+            ingest.append(time.perf_counter() - started)
+            posted += 1
+
+        async def user_worker():
+            # open loop at --rate: the 200 comes before handling, so unpaced posting only grows a backlog
+            for i, update in it:
+                if args.rate:
+                    await asyncio.sleep(max(0.0, started + i / args.rate - time.perf_counter()))
+                await post(update)
+
+        async def admin_worker(admin_id: int):
+            # each step waits for the bot's reply, then for the admin to type (--think); the reply
+            # must not go out before the state the next message depends on is stored
+            nonlocal sessions
+            while not done.is_set():
+                for update in [message_update(next(ids), admin_id, text) for text in addquestion_steps(rnd)] + [
+                    callback_update(next(ids), admin_id, "addq_save")
+                ]:
+                    replies = api.chat_calls[admin_id]
+                    await post(update)
+                    deadline = time.perf_counter() + args.timeout
+                    while api.chat_calls[admin_id] <= replies and time.perf_counter() < deadline:
+                        await asyncio.sleep(0.002)
+                    if args.think:
+                        await asyncio.sleep(args.think / 1000)
+                sessions += 1
+
+        started = time.perf_counter()
+        admin_tasks = [asyncio.create_task(admin_worker(ADMIN_BASE + i)) for i in range(admins)]
+        await asyncio.gather(*(user_worker() for _ in range(args.concurrency)))
+        done.set()
+        await asyncio.gather(*admin_tasks)
+
+    # handle_in_background: the 200 comes first, so count what the handlers have finished
+    deadline = time.perf_counter() + args.timeout
+    while True:
+        after = await handled_updates(port, args.workers)
+        handled = sum(v[-2] for v in after.values()) - sum(v[-2] for v in before.values())
+        if handled >= posted or time.perf_counter() > deadline:
+            break
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - started
+    if handled < posted:
+        print(f"  timed out with {posted - handled} updates unhandled")
+
+    handlers = {}
+    for name, values in after.items():
+        base = before.get(name, [0.0] * len(values))
+        cumulative = [a - b for a, b in zip(values[:-1], base[:-1])]
+        count = cumulative[-1]
+        if count:
+            handlers[name] = {
+                "count": int(count),
+                "p50_ms": bucket_quantile(cumulative, 0.5) * 1000,
+                "p99_ms": bucket_quantile(cumulative, 0.99) * 1000,
+                "mean_ms": (values[-1] - base[-1]) / count * 1000,
+            }
+    return {
+        "updates": posted,
+        "seconds": elapsed,
+        "updates_per_s": posted / elapsed,
+        "ingest_p50_ms": percentile(ingest, 50) * 1000,
+        "ingest_p99_ms": percentile(ingest, 99) * 1000,
+        "addquestion_sessions": sessions,
+        "handlers": handlers,
+    }
+
+
+def print_e2e(bank: int, result: dict):
+    print(
+        f"\nbank {bank}: {result['updates']} updates in {result['seconds']:.1f}s -> "
+        f"{result['updates_per_s']:.0f} updates/s, webhook p50 {result['ingest_p50_ms']:.1f}ms "
+        f"p99 {result['ingest_p99_ms']:.1f}ms, {result['addquestion_sessions']} AddQuestion sessions"
+    )
+    print(f"{'handler':<24}{'count':>8}{'p50 ms':>10}{'p99 ms':>10}{'mean ms':>10}   (p50/p99 from histogram buckets)")
+    for name, h in sorted(result["handlers"].items()):
+        print(f"{name:<24}{h['count']:>8}{h['p50_ms']:>10.1f}{h['p99_ms']:>10.1f}{h['mean_ms']:>10.1f}")
+
+
+def broken_sessions(bank: int, result: dict) -> list[str]:
+    # each AddQuestion step has its own handler: a step routed with a stale FSM state shows up
+    # as a count that differs from the number of sessions, or no addq_save at all
+    sessions = result["addquestion_sessions"]
+    return [
+        f"bank {bank} {name}: handled {result['handlers'].get(name, {}).get('count', 0)} of {sessions} sessions"
+        for name in ADDQUESTION_HANDLERS
+        if result["handlers"].get(name, {}).get("count", 0) != sessions
+    ]
+
+
+def regressions(baseline: dict, results: dict, tolerance: float) -> list[str]:
+    found = []
+    for bank, result in results.items():
+        base = baseline.get(bank)
+        if base is None:
+            continue
+        if result["updates_per_s"] < base["updates_per_s"] * (1 - tolerance):
+            found.append(f"bank {bank}: {result['updates_per_s']:.0f} updates/s, was {base['updates_per_s']:.0f}")
+        for name, h in result["handlers"].items():
+            old = base["handlers"].get(name)
+            if old is None:
+                continue
+            # a p99 needs a few samples above it, and buckets are too coarse for 1-2ms differences
+            for stat, min_count in (("p50_ms", 50), ("p99_ms", 500)):
+                if min(h["count"], old["count"]) < min_count:
+                    continue
+                if h[stat] > old[stat] * (1 + tolerance) and h[stat] - old[stat] > 2:
+                    found.append(f"bank {bank} {name}: {stat} {h[stat]:.1f}, was {old[stat]:.1f}")
+    return found
+
+
+async def cmd_e2e(args):
+    botmod.init_db_pool()
+    botmod.init_db()
+    api = FakeBotAPI(latency=args.api_latency / 1000)
+    api_runner = await api.start(args.api_port)
+    admin_ids = ",".join(str(ADMIN_BASE + i) for i in range(max(args.admins, 1)))
+    ids = itertools.count(1)
+    results = {}
+    broken = []
+    for bank in (int(b) for b in args.banks.split(",")):
+        reset_bank(bank)
+        values = {f: botmod.get_distinct_values(f) for f in ("board", "exam", "subject")}
+        stream = list(user_stream(args.warmup + args.updates, args.users, args.quiz_share, values, ids))
+        proc = await start_server(args.workers, args.port, args.api_port, ADMIN_IDS=admin_ids)
+        try:
+            await wait_near_duplicates(args.port, args.workers)
+            await drive(args, args.port, api, stream[: args.warmup], 0, ids)
+            results[str(bank)] = await drive(args, args.port, api, stream[args.warmup:], args.admins, ids)
+        finally:
+            proc.send_signal(signal.SIGTERM)
+            await proc.wait()
+        print_e2e(bank, results[str(bank)])
+        broken += broken_sessions(bank, results[str(bank)])
+    await api_runner.cleanup()
+    botmod.close_db_pool()
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            found = regressions(json.load(f), results, args.tolerance)
+        print(f"\n{len(found)} regressions against {args.compare} (tolerance {args.tolerance:.0%})")
+        for line in found:
+            print("  " + line)
+        if found:
+            sys.exit(1)
+    if broken:
+        print("\nAddQuestion sessions that did not go step by step to addq_save:")
+        for line in broken:
+            print("  " + line)
+        sys.exit(1)
+
+
+# ========================
+# QUESTION INDEX BENCHMARK
+# ========================
+
+
+async def cmd_index(args):
+    botmod.init_db_pool()
+    botmod.init_db()
+    for label, index in (("tree", botmod.taxonomy), ("columnar", botmod.question_index)):
+        started = time.perf_counter()
+        index.load()
+        print(f"{label} load: {time.perf_counter() - started:.2f}s")
+
+    # every facet for each sampled filter combination, with 0..5 levels set
+    keys = []
+    for f in sample_filters(args.filters):
+        for depth in range(len(FIELDS)):
+            partial = {k: (v if i < depth else None) for i, (k, v) in enumerate(f.items())}
+            keys += [(field, botmod.filter_key(partial, exclude=field)) for field in FIELDS]
+    timings = {}
+    for label, index in (("tree", botmod.taxonomy), ("columnar", botmod.question_index)):
+        started = time.perf_counter()
+        results = [index.facet_counts(field, key) for field, key in keys]
+        timings[label] = (time.perf_counter() - started) / len(keys)
+        timings[label + "_results"] = results
+    mismatches = sum(a != b for a, b in zip(timings["tree_results"], timings["columnar_results"]))
+    print(f"\n{len(keys)} facet lookups, {mismatches} mismatches")
+    print(f"tree      {timings['tree'] * 1e6:>10.0f} us/facet")
+    print(f"columnar  {timings['columnar'] * 1e6:>10.0f} us/facet")
+
+    sample_keys = [botmod.filter_key(f) for f in sample_filters(args.filters)]
+    started = time.perf_counter()
+    for key in sample_keys:
+        botmod.question_index.sample(key, 10)
+    print(f"columnar sample of 10: {(time.perf_counter() - started) / len(sample_keys) * 1e6:.0f} us")
+    botmod.close_db_pool()
+    if mismatches:
+        sys.exit(1)
+
+
+# ========================
+# QUIZ PREFETCH
+# ========================
+
+
+async def tap_rounds(uids: list[int], rounds: int, concurrency: int, ids) -> list[list[float]]:
+    """Every user taps "Generate quiz" once per round; returns send_quiz latencies per round."""
+    per_round = []
+    send_quiz = botmod.send_quiz
+    latencies: list[float] = []
+
+    async def timed_send_quiz(cb):
+        started = time.perf_counter()
+        await send_quiz(cb)
+        latencies.append(time.perf_counter() - started)
+
+    botmod.send_quiz = timed_send_quiz
+    for _ in range(rounds):
+        updates = [("generate_quiz", callback_update(next(ids), uid, "generate_quiz")) for uid in uids]
+        await run_updates(updates, concurrency)
+        per_round.append(latencies[:])
+        latencies.clear()
+        botmod.quiz_prefetch.rank()
+        while botmod.quiz_prefetch._queue is not None and not botmod.quiz_prefetch._queue.empty():
+            await asyncio.sleep(0.05)  # user think time: let the refill catch up
+        await asyncio.sleep(0.2)
+    botmod.send_quiz = send_quiz
+    return per_round
+
+
+async def cmd_prefetch(args):
+    botmod.init_db_pool()
+    botmod.init_db()
+    botmod.init_db_executor()
+    botmod.load_question_caches()
+    botmod.bot.session = FakeSession(latency=args.api_latency / 1000)
+    sent: dict[int, list[int]] = defaultdict(list)  # chat_id -> question ids
+    poll_ids = itertools.count(1)
+
+    # Delivery is paced by the per-chat limits and isn't what prefetch changes, so record
+    # the batch instead of queueing it
+    async def record(*methods, kind="message", on_sent=None):
+        for i, method in enumerate(methods):
+            poll = SimpleNamespace(id=f"bench-{next(poll_ids)}") if isinstance(method, SendPoll) else None
+            if on_sent is not None:
+                on_sent(i, SimpleNamespace(poll=poll))
+            if poll is not None:
+                sent[method.chat_id].append(botmod.poll_registry.get(poll.id)[0])
+
+    botmod.outbound.send = record
+
+    # board + exam combinations: wide enough that a user's cursor runs for many quizzes
+    hot = [{"board": f["board"], "exam": f["exam"]} for f in sample_filters(args.hot)]
+    rnd = random.Random(3)
+    ids = itertools.count(1)
+    print(f"{'prefetch':<10}{'round':>6}{'p50 ms':>10}{'p99 ms':>10}")
+    for label, hot_keys, base in (("off", 0, 50_000_000), ("on", args.hot, 60_000_000)):
+        botmod.quiz_prefetch.hot_keys = hot_keys
+        botmod.quiz_prefetch.start()
+        uids = list(range(base, base + args.users))
+        for uid in uids:
+            for field, value in rnd.choice(hot).items():
+                botmod.update_user_filter(uid, field, value)
+        for n, lat in enumerate(await tap_rounds(uids, args.rounds, args.concurrency, ids), 1):
+            print(f"{label:<10}{n:>6}{percentile(lat, 50) * 1000:>10.1f}{percentile(lat, 99) * 1000:>10.1f}")
+        await botmod.quiz_prefetch.close()
+
+    repeats = sum(len(questions) - len(set(questions)) for questions in sent.values())
+    print(f"\nprefetch: {botmod.quiz_prefetch.stats()}")
+    print(f"questions repeated to the same user: {repeats}")
+    botmod.quiz_session_store.flush()
+    botmod.user_filter_store.flush()
+    botmod.close_db_executor()
+    botmod.close_db_pool()
+    if repeats:
+        sys.exit(1)
+
+
+# ========================
+# NEAR-DUPLICATE INDEX
+# ========================
+
+_word_rnd = random.Random(5)
+WORDS = ["".join(_word_rnd.choices("abcdefghijklmnopqrstuvwxyz", k=_word_rnd.randint(3, 9))) for _ in range(5000)]
+
+
+def synthetic_question(rnd: random.Random) -> dict:
+    q = {"question_text": " ".join(rnd.choices(WORDS, k=rnd.randint(8, 20))) + "?"}
+    for i in range(1, 5):
+        q[f"option{i}"] = " ".join(rnd.choices(WORDS, k=rnd.randint(1, 4)))
+    return q
+
+
+def perturbed(q: dict, rnd: random.Random) -> dict:
+    # The same PYQ as another board prints it: options reordered, one word changed, punctuation
+    words = q["question_text"].rstrip("?").split()
+    words[rnd.randrange(len(words))] = rnd.choice(WORDS)
+    options = [q[f"option{i}"] for i in range(1, 5)]
+    rnd.shuffle(options)
+    return {"question_text": "Q. " + ", ".join(words) + " ?", **{f"option{i}": o for i, o in enumerate(options, 1)}}
+
+
+async def cmd_dedupe(args):
+    rnd = random.Random(11)
+    index = botmod.NearDuplicateIndex(merge_rows=1 << 62)
+    print(f"{'bank':>10}{'build s':>10}{'lookup us':>11}{'recall':>8}{'cands/dup':>11}{'cands/new':>11}")
+    for size in map(int, args.sizes.split(",")):
+        bank = [synthetic_question(rnd) for _ in range(size)]
+        started = time.perf_counter()
+        shingles = [botmod.question_shingles(q) for q in bank]
+        index.build((qid, botmod.minhash_bands(sh)) for qid, sh in enumerate(shingles))
+        build = time.perf_counter() - started
+
+        probes = rnd.sample(range(size), min(args.probes, size))
+        dups = [(qid, botmod.question_shingles(perturbed(bank[qid], rnd))) for qid in probes]
+        dup_bands = [botmod.minhash_bands(sh) for _, sh in dups]
+        new_bands = [botmod.minhash_bands(botmod.question_shingles(synthetic_question(rnd))) for _ in probes]
+        started = time.perf_counter()
+        dup_cands = [index.candidates(b, botmod.DEDUP_MAX_CANDIDATES) for b in dup_bands]
+        lookup = (time.perf_counter() - started) / len(dups)
+        new_cands = [index.candidates(b, botmod.DEDUP_MAX_CANDIDATES) for b in new_bands]
+        # a duplicate counts as found if it is a candidate and passes the exact similarity check
+        found = sum(
+            qid in cands and botmod.jaccard(sh, shingles[qid]) >= botmod.DEDUP_THRESHOLD
+            for (qid, sh), cands in zip(dups, dup_cands)
+        )
+        print(
+            f"{size:>10}{build:>10.1f}{lookup * 1e6:>11.1f}{found / len(dups):>8.1%}"
+            f"{statistics.fmean(map(len, dup_cands)):>11.2f}{statistics.fmean(map(len, new_cands)):>11.2f}"
+        )
+
+
+# ========================
+# SAMPLING BENCHMARK
+# ========================
+
+
+def old_random_sample(filters: dict, limit: int = 10) -> list:
+    # The query get_questions_for_filters used to run
+    clauses, params = [], []
+    for field in FIELDS:
+        if filters.get(field):
+            clauses.append(f"{field} = %s")
+            params.append(filters[field])
+    where_sql = "WHERE " + " AND ".join(clauses) if clauses else ""
+    with botmod.db_connection() as conn, conn.cursor() as cur:
+        cur.execute(f"SELECT * FROM questions {where_sql} ORDER BY RANDOM() LIMIT %s", params + [limit])
+        return cur.fetchall()
+
+
+def timed(func, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def count_rows() -> int:
+    with botmod.db_connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT COUNT(*) FROM questions")
+        return cur.fetchone()[0]
+
+
+async def cmd_sampling(args):
+    botmod.init_db_pool()
+    botmod.init_db()
+    with botmod.db_connection() as conn, conn.cursor() as cur:
+        cur.execute("TRUNCATE questions RESTART IDENTITY CASCADE")  # and question_minhash
+        conn.commit()
+
+    print(f"{'rows':>9}  {'scope':<28}{'matches':>9}{'old ms':>10}{'cold ms':>10}{'warm ms':>10}")
+    for size in sorted(int(x) for x in args.sizes.split(",")):
+        seed_questions(size - count_rows())
+        with botmod.db_connection() as conn, conn.cursor() as cur:
+            cur.execute("ANALYZE questions")
+            conn.commit()
+        probe = sample_filters(1)[0]
+        scopes = {
+            "all": {},
+            "board": {"board": probe["board"]},
+            "board+exam+subject": {k: probe[k] for k in ("board", "exam", "subject")},
+        }
+        for name, filters in scopes.items():
+            old = timed(lambda: old_random_sample(filters), args.repeat)
+
+            def cold():
+                botmod.question_id_cache.clear()
+                botmod.get_questions_for_filters(filters)
+
+            cold_ms = timed(cold, args.repeat)
+            warm = timed(lambda: botmod.get_questions_for_filters(filters), args.repeat * 10)
+            matches = len(botmod.get_question_ids(filters))
+            print(f"{size:>9}  {name:<28}{matches:>9}{old:>10.2f}{cold_ms:>10.2f}{warm:>10.2f}")
+
+    botmod.close_db_pool()
+
+
+# ========================
+# QUERY PLAN REGRESSION
+# ========================
+
+
+def hot_queries(probe: dict) -> list[tuple[str, str, list]]:
+    """The filtered queries the bot runs per tap, over a spread of filter combinations."""
+    combos = [
+        ("board",), ("board", "year"), ("board", "exam", "subject"), ("board", "exam", "subject", "topic"),
+        ("exam",), ("exam", "subject"), ("subject",), ("subject", "topic"), ("topic",), ("year",),
+        ("year", "subject"), ("subtopic",),
+    ]
+    queries = []
+    for combo in combos:
+        filters = {f: probe[f] for f in combo}
+        key = botmod.filter_key(filters)
+        where = " AND ".join(f"{f} = %s" for f, v in zip(FIELDS, key) if v is not None)
+        params = [v for v in key if v is not None]
+        queries.append(
+            (f"question ids {'+'.join(combo)}", f"SELECT id FROM questions WHERE {where} ORDER BY id", params)
+        )
+        for field in ("topic", "subtopic"):
+            if field in combo:
+                continue
+            facet_where = f"{where} AND {field} IS NOT NULL AND {field} != ''"
+            queries.append((
+                f"facet {field} | {'+'.join(combo)}",
+                f"SELECT {field}, COUNT(*) FROM questions WHERE {facet_where} GROUP BY {field}",
+                params,
+            ))
+    queries.append(("questions by id", "SELECT * FROM questions WHERE id = ANY(%s)", [[1, 2, 3, 4, 5]]))
+    return queries
+
+
+def seq_scans(plan: dict) -> list[str]:
+    found = []
+    if plan.get("Node Type") == "Seq Scan":
+        found.append(plan.get("Relation Name"))
+    for child in plan.get("Plans", []):
+        found.extend(seq_scans(child))
+    return found
+
+
+async def cmd_explain(args):
+    botmod.init_db_pool()
+    botmod.init_db()
+    missing = args.rows - count_rows()
+    if missing > 0:
+        seed_questions(missing)
+    with botmod.db_connection() as conn:
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("VACUUM ANALYZE questions")
+            cur.execute("VACUUM ANALYZE user_filters")
+        conn.autocommit = False
+
+    with botmod.db_connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT board, year, exam, subject, topic, subtopic FROM questions WHERE subtopic <> '' LIMIT 1")
+        probe = dict(zip(FIELDS, cur.fetchone()))
+        failures = []
+        for name, sql, params in hot_queries(probe):
+            cur.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+            plan = cur.fetchone()[0][0]["Plan"]
+            scans = [rel for rel in seq_scans(plan) if rel == "questions"]  # the only large table in the fixture
+            status = "SEQ SCAN on " + ", ".join(scans) if scans else "ok"
+            print(f"{name:<45}{plan['Total Cost']:>12.1f}  {status}")
+            if scans:
+                failures.append(name)
+
+    botmod.close_db_pool()
+    if failures:
+        print(f"\n{len(failures)} hot queries plan a sequential scan")
+        sys.exit(1)
+
+
+# ========================
+# MENU RENDER MICROBENCHMARK
+# ========================
+
+
+def render_keys(k: int) -> list[tuple]:
+    rnd = random.Random(3)
+    keys = []
+    for _ in range(k):
+        keys.append((
+            rnd.choice([None, "GSEB", "CBSE", "GPSC"]), rnd.choice([None, "2021", "2022", "2023"]),
+            rnd.choice([None, "Talati", "DYSO"]), rnd.choice([None, "Polity", "Science"]),
+            rnd.choice([None, "ભારતનું બંધારણ", "Constitution"]), None,
+        ))
+    return keys
+
+
+def measure_renders(keys: list[tuple], n: int, cached: bool) -> tuple[float, float]:
+    """(µs per render, peak bytes allocated per render)"""
+    render, cache = botmod.render_main_menu, botmod.main_menu_cache
+
+    cache.clear()
+    for key in keys:
+        render(key)  # warm imports/pydantic and, for the cached case, the cache
+    started = time.perf_counter()
+    for i in range(n):
+        if not cached:
+            cache.clear()
+        render(keys[i % len(keys)])
+    cpu = (time.perf_counter() - started) / n * 1e6
+
+    # peak traced memory above the baseline during one render ~ bytes it allocates
+    sample = min(n, 2000)
+    allocated = 0
+    tracemalloc.start()
+    for i in range(sample):
+        if not cached:
+            cache.clear()
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        render(keys[i % len(keys)])
+        allocated += tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    return cpu, allocated / sample
+
+
+async def cmd_render(args):
+    keys = render_keys(args.distinct)
+    print(f"{'':<10}{'µs/render':>12}{'bytes/render':>14}{'renders/s':>12}")
+    for label, cached in (("uncached", False), ("cached", True)):
+        cpu, alloc = measure_renders(keys, args.renders, cached)
+        print(f"{label:<10}{cpu:>12.2f}{alloc:>14.0f}{1e6 / cpu:>12.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("webhook", help="feed synthetic updates through the dispatcher")
+    p.add_argument("--seed", type=int, default=0, help="insert this many synthetic questions first")
+    p.add_argument("--updates", type=int, default=2000)
+    p.add_argument("--users", type=int, default=500)
+    p.add_argument("--concurrency", type=int, default=50)
+    p.add_argument("--quiz-share", type=float, default=0.2)
+    p.add_argument("--api-latency", type=float, default=20, help="simulated Telegram latency, ms")
+    p.add_argument("--mode", choices=["executor", "inline"], default="executor")
+    p.add_argument("--drain", type=float, default=0, help="wait up to this many seconds for queued sends")
+    p.set_defaults(func=cmd_webhook)
+
+    p = sub.add_parser("sampling", help="ORDER BY RANDOM() vs cached id-list sampling (truncates questions)")
+    p.add_argument("--sizes", default="10000,100000,1000000")
+    p.add_argument("--repeat", type=int, default=5)
+    p.set_defaults(func=cmd_sampling)
+
+    p = sub.add_parser("explain", help="fail if a hot query plans a seq scan on a large fixture")
+    p.add_argument("--rows", type=int, default=200000)
+    p.set_defaults(func=cmd_explain)
+
+    p = sub.add_parser("render", help="main menu render cost with and without the memo cache")
+    p.add_argument("--renders", type=int, default=100000)
+    p.add_argument("--distinct", type=int, default=200, help="distinct filter tuples rendered")
+    p.set_defaults(func=cmd_render)
+
+    p = sub.add_parser("scaling", help="updates/s of bot.py --workers N over HTTP against a fake Bot API")
+    p.add_argument("--workers", default="1,2,4", help="comma-separated worker counts to compare")
+    p.add_argument("--seed", type=int, default=0, help="insert this many synthetic questions first")
+    p.add_argument("--updates", type=int, default=20000)
+    p.add_argument("--warmup", type=int, default=1000)
+    p.add_argument("--users", type=int, default=5000)
+    p.add_argument("--concurrency", type=int, default=64)
+    p.add_argument("--quiz-share", type=float, default=0.1)
+    p.add_argument("--port", type=int, default=18080)
+    p.add_argument("--api-port", type=int, default=18081)
+    p.add_argument("--timeout", type=float, default=120, help="seconds to wait for queued updates")
+    p.set_defaults(func=cmd_scaling)
+
+    p = sub.add_parser("e2e", help="bot.py over HTTP against a fake Bot API: per-handler latency, updates/s")
+    p.add_argument("--banks", default="10000", help="question bank sizes to run at (reseeds questions)")
+    p.add_argument("--workers", type=int, default=1)
+    p.add_argument("--updates", type=int, default=20000)
+    p.add_argument("--warmup", type=int, default=1000)
+    p.add_argument("--users", type=int, default=5000)
+    p.add_argument("--concurrency", type=int, default=64)
+    p.add_argument("--admins", type=int, default=4, help="concurrent AddQuestion sessions")
+    p.add_argument("--think", type=float, default=0, help="admin pause between AddQuestion steps, ms")
+    p.add_argument("--quiz-share", type=float, default=0.1)
+    p.add_argument("--rate", type=float, default=50, help="offered updates/s, 0 for as fast as possible")
+    p.add_argument("--api-latency", type=float, default=0, help="simulated Telegram latency, ms")
+    p.add_argument("--port", type=int, default=18080)
+    p.add_argument("--api-port", type=int, default=18081)
+    p.add_argument("--timeout", type=float, default=120, help="seconds to wait for queued updates")
+    p.add_argument("--save", help="write the results as JSON, to compare later runs against")
+    p.add_argument("--compare", help="baseline JSON from --save; exit 1 on a regression")
+    p.add_argument("--tolerance", type=float, default=0.5, help="allowed slowdown before it counts")
+    p.set_defaults(func=cmd_e2e)
+
+    p = sub.add_parser("index", help="facet counts from the taxonomy tree vs the columnar index")
+    p.add_argument("--filters", type=int, default=50, help="sampled filter combinations")
+    p.set_defaults(func=cmd_index)
+
+    p = sub.add_parser("prefetch", help="quiz tap latency and hit rate with and without prefetch")
+    p.add_argument("--users", type=int, default=2000)
+    p.add_argument("--rounds", type=int, default=5)
+    p.add_argument("--hot", type=int, default=10, help="filter combinations the users share")
+    p.add_argument("--concurrency", type=int, default=50)
+    p.add_argument("--api-latency", type=float, default=20, help="simulated Telegram latency, ms")
+    p.set_defaults(func=cmd_prefetch)
+
+    p = sub.add_parser("dedupe", help="near-duplicate index lookup time and recall by bank size")
+    p.add_argument("--sizes", default="10000,100000")
+    p.add_argument("--probes", type=int, default=1000, help="perturbed copies looked up per size")
+    p.set_defaults(func=cmd_dedupe)
+
+    args = parser.parse_args()
+    asyncio.run(args.func(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,59 @@
 from aiohttp import web
 from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+import argparse
 import asyncio
+import contextvars
+import csv
+import functools
+import hashlib
+import heapq
+import hmac
+import html
+import io
+import json
 import logging
+import multiprocessing
 import os
+import random
+import signal
+import sys
+import threading
+import time
+import unicodedata
+import zlib
 import psycopg2
-from psycopg2.extras import RealDictCursor
-from contextlib import closing
+from psycopg2 import pool as pg_pool
+from psycopg2.extras import RealDictCursor, execute_values
+from abc import ABC, abstractmethod
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import numpy as np
+except ImportError:  # optional: QUESTION_INDEX=columnar, faster MinHash signatures
+    np = None
 
 from aiogram import Bot, Dispatcher, F, types
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramAPIError, TelegramRetryAfter
 from aiogram.filters import CommandStart, Command
+from aiogram.methods import SendPoll
 from aiogram.types import (
     Message,
     CallbackQuery,
+    PollAnswer,
     InlineKeyboardMarkup,
     InlineKeyboardButton,
 )
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.enums import ParseMode
 
 # ========================
@@ -25,8 +62,131 @@ from aiogram.enums import ParseMode
 
 BOT_TOKEN = os.getenv("BOT_TOKEN", "6582678746:AAFcuzidqLZ3gJqwjaEU1SrKNm8mGNwoBCM")
 
-# Replace with your Telegram user ID(s)
-ADMIN_IDS = {8226659957}  # set of ints
+# Replace with your Telegram user ID(s), or set ADMIN_IDS=id1,id2
+ADMIN_IDS = {int(i) for i in os.getenv("ADMIN_IDS", "8226659957").split(",")}  # set of ints
+
+# Point the bot at a local Bot API server (or a fake one in load tests) instead of api.telegram.org
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+
+# Worker processes sharing the webhook port; with more than one, per-process caches of mutable
+# per-user state are switched to read/write-through and question caches poll for other workers' inserts
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "1"))
+MULTI_WORKER = WEB_WORKERS > 1
+WORKER_START_TIMEOUT = float(os.getenv("WORKER_START_TIMEOUT", "120"))  # seconds for a worker to start listening
+WORKER_STOP_TIMEOUT = float(os.getenv("WORKER_STOP_TIMEOUT", "30"))  # seconds to drain before SIGKILL
+
+# Telegram flood limits: ~30 messages/s per bot, ~1 message/s per chat (short bursts tolerated)
+TG_GLOBAL_RATE = float(os.getenv("TG_GLOBAL_RATE", "30"))
+TG_CHAT_RATE = float(os.getenv("TG_CHAT_RATE", "1"))
+TG_CHAT_BURST = int(os.getenv("TG_CHAT_BURST", "5"))
+TG_MAX_RETRIES = int(os.getenv("TG_MAX_RETRIES", "3"))
+UPDATE_DEDUP_TTL = float(os.getenv("UPDATE_DEDUP_TTL", "900"))  # seconds an update_id is remembered
+UPDATE_DEDUP_SIZE = int(os.getenv("UPDATE_DEDUP_SIZE", "200000"))  # update_ids remembered at most
+OUTBOUND_WORKERS = int(os.getenv("OUTBOUND_WORKERS", "64"))  # concurrent sender tasks
+OUTBOUND_MAX_PENDING = int(os.getenv("OUTBOUND_MAX_PENDING", "10000"))  # queued batches before handlers wait
+# /broadcast: capped below TG_GLOBAL_RATE so interactive replies keep some headroom
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "20"))  # messages/s
+BROADCAST_SHARDS = int(os.getenv("BROADCAST_SHARDS", "8"))  # sender tasks, users split by user_id
+BROADCAST_CHUNK = int(os.getenv("BROADCAST_CHUNK", "500"))  # recipients between progress checkpoints
+BROADCAST_LEASE = float(os.getenv("BROADCAST_LEASE", "120"))  # seconds before another worker may take over
+
+# Where FSM state lives: "postgres" (shared by all workers, survives restarts), "redis", or "memory"
+FSM_STORAGE = os.getenv("FSM_STORAGE", "postgres")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+
+# ========================
+# METRICS
+# ========================
+
+# Served as Prometheus text on /metrics; each worker process reports its own numbers
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Bearer token scrapers must send; /metrics shares the public webhook port, so it is not
+# served at all without one
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+        metrics_registry.append(self)
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for values, v in sorted(self._values.items()):
+                lines.append(f"{self.name}{format_labels(self.labels, values)} {v}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> [per-bucket counts (last one is +Inf), sum]
+        self._values: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+        metrics_registry.append(self)
+
+    def observe(self, value: float, *label_values):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                entry = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][i] += 1
+            entry[1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, list(v[0]), v[1]) for k, v in self._values.items())
+        for values, counts, total in items:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                labels = format_labels((*self.labels, "le"), (*values, bound))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = format_labels(self.labels, values)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+def format_labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    pairs = (
+        f'{n}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for n, v in zip(names, values)
+    )
+    return "{" + ",".join(pairs) + "}"
+
+
+metrics_registry: list = []
+
+handler_seconds = Histogram("bot_handler_seconds", "Handler run time", ("handler",))
+handler_errors = Counter("bot_handler_errors_total", "Handlers that raised", ("handler", "error"))
+db_call_seconds = Histogram("bot_db_call_seconds", "DB helper run time in the executor", ("helper",))
+db_wait_seconds = Histogram("bot_db_wait_seconds", "Time DB helpers wait for a free executor thread")
+db_query_seconds = Histogram("bot_db_query_seconds", "Statement execution time", ("helper",))
+db_rows = Counter("bot_db_rows_total", "Rows returned or affected by statements", ("helper",))
+telegram_seconds = Histogram("bot_telegram_request_seconds", "Bot API request time", ("method",))
+telegram_errors = Counter("bot_telegram_errors_total", "Failed Bot API requests", ("method", "error"))
+quiz_prefetch_results = Counter("bot_quiz_prefetch_total", "Quiz taps by prefetch outcome", ("result",))
+broadcast_messages = Counter("bot_broadcast_messages_total", "Broadcast recipients by outcome", ("result",))
+broadcast_failures = Counter("bot_broadcast_failures_total", "Failed broadcast sends", ("error",))
+updates_suppressed = Counter("bot_updates_suppressed_total", "Updates or actions not processed again", ("reason",))
 
 
 # ========================
@@ -35,15 +195,260 @@ ADMIN_IDS = {8226659957}  # set of ints
 
 DB_URL = os.getenv("DATABASE_URL")  # from Render env
 
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))  # seconds to wait for a free connection
+DB_POOL_HEALTHCHECK_IDLE = float(os.getenv("DB_POOL_HEALTHCHECK_IDLE", "30"))  # ping if idle longer
+DB_WORKERS = int(os.getenv("DB_WORKERS", str(DB_POOL_MAX)))  # threads running blocking DB helpers
+QUESTION_ID_CACHE_SIZE = int(os.getenv("QUESTION_ID_CACHE_SIZE", "256"))  # filter combos kept in memory
+# ids kept across all cached combos (8 bytes each): the real memory bound
+QUESTION_ID_CACHE_IDS = int(os.getenv("QUESTION_ID_CACHE_IDS", "4000000"))
+FACET_CACHE_SIZE = int(os.getenv("FACET_CACHE_SIZE", "2048"))  # (field, filters) facet lists kept in memory
+FACET_PAGE_SIZE = int(os.getenv("FACET_PAGE_SIZE", "20"))  # value buttons per menu page
+FACET_PAGE_CACHE_SIZE = int(os.getenv("FACET_PAGE_CACHE_SIZE", "4096"))  # rendered menu pages kept in memory
+MAIN_MENU_CACHE_SIZE = int(os.getenv("MAIN_MENU_CACHE_SIZE", "4096"))  # rendered main menus kept in memory
+BULK_INVALIDATE_ROWS = 1000  # above this many new rows, drop caches instead of patching them
+USER_FILTER_CACHE_SIZE = int(os.getenv("USER_FILTER_CACHE_SIZE", "100000"))  # users kept in memory
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", "2"))  # seconds between batched upserts
+QUIZ_SESSION_CACHE_SIZE = int(os.getenv("QUIZ_SESSION_CACHE_SIZE", "100000"))  # (user, filters) cursors in memory
+POLL_TTL = float(os.getenv("POLL_TTL", str(3 * 24 * 3600)))  # how long a sent quiz poll accepts answers
+POLL_MAP_SIZE = int(os.getenv("POLL_MAP_SIZE", "2000000"))  # poll_id -> question entries kept in memory
+ANSWER_FLUSH_INTERVAL = float(os.getenv("ANSWER_FLUSH_INTERVAL", "1"))  # seconds between answer writes
+ANSWER_FLUSH_BATCH = int(os.getenv("ANSWER_FLUSH_BATCH", "5000"))  # flush early once this many are buffered
+STATS_MIN_ANSWERS = int(os.getenv("STATS_MIN_ANSWERS", "20"))  # answers before a question/topic is ranked
+QUESTION_SYNC_INTERVAL = float(os.getenv("QUESTION_SYNC_INTERVAL", "5"))  # poll for questions other processes added
+QUESTION_SYNC_LOOKBACK = 1000  # ids below the newest one re-checked for late commits
+QUESTION_RECOUNT_INTERVAL = float(os.getenv("QUESTION_RECOUNT_INTERVAL", "600"))  # full consistency check
+POLL_SYNC_INTERVAL = float(os.getenv("POLL_SYNC_INTERVAL", "0.5"))  # multi-worker: publish sent polls
+STATS_RELOAD_INTERVAL = float(os.getenv("STATS_RELOAD_INTERVAL", "60"))  # multi-worker: reload answer stats
+# "tree": facet counts from the taxonomy tree, id lists from Postgres; "columnar": both from an
+# in-memory NumPy index of the filter columns (needs numpy)
+QUESTION_INDEX = os.getenv("QUESTION_INDEX", "tree")
+BITMAP_CACHE_SIZE = int(os.getenv("BITMAP_CACHE_SIZE", "1024"))  # per-value bitmaps kept by the columnar index
+PREFETCH_HOT_KEYS = int(os.getenv("PREFETCH_HOT_KEYS", "20"))  # filter tuples with prebuilt quizzes, 0 = off
+PREFETCH_PER_KEY = int(os.getenv("PREFETCH_PER_KEY", "256"))  # prebuilt quizzes kept per hot tuple
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", "2"))  # background tasks building quizzes
+PREFETCH_RANK_INTERVAL = float(os.getenv("PREFETCH_RANK_INTERVAL", "30"))  # seconds between hot-set updates
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.8"))  # shingle Jaccard similarity of a near-duplicate
+DEDUP_MAX_CANDIDATES = int(os.getenv("DEDUP_MAX_CANDIDATES", "64"))  # LSH candidates verified per lookup
+DEDUP_MERGE_ROWS = int(os.getenv("DEDUP_MERGE_ROWS", "50000"))  # new signatures before the index is rebuilt
+DEDUP_MERGE_INTERVAL = 10  # seconds between checks for a due rebuild
+
+FILTER_FIELDS = ("board", "year", "exam", "subject", "topic", "subtopic")
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+# DB helper running on this executor thread, for labelling statement metrics
+db_call_context = threading.local()
+_timed_cursor_classes: dict[type, type] = {}
+
+
+def timed_cursor_class(base: type) -> type:
+    cls = _timed_cursor_classes.get(base)
+    if cls is None:
+
+        class TimedCursor(base):
+            def execute(self, query, vars=None):
+                started = time.perf_counter()
+                try:
+                    return super().execute(query, vars)
+                finally:
+                    helper = getattr(db_call_context, "helper", "other")
+                    db_query_seconds.observe(time.perf_counter() - started, helper)
+                    if self.rowcount > 0:
+                        db_rows.inc(helper, amount=self.rowcount)
+
+        cls = _timed_cursor_classes[base] = TimedCursor
+    return cls
+
+
+class TimedConnection(psycopg2.extensions.connection):
+    """Connection whose cursors, whatever their cursor_factory, record statement metrics."""
+
+    def cursor(self, *args, **kwargs):
+        base = kwargs.pop("cursor_factory", None) or self.cursor_factory or psycopg2.extensions.cursor
+        return super().cursor(*args, cursor_factory=timed_cursor_class(base), **kwargs)
+
+
+class DBPool:
+    """Bounded psycopg2 pool: callers block (up to a timeout) instead of failing when exhausted,
+    and connections idle for a while are pinged before being handed out."""
+
+    def __init__(self, dsn: str, minconn: int, maxconn: int, timeout: float, healthcheck_idle: float):
+        self._pool = pg_pool.ThreadedConnectionPool(minconn, maxconn, dsn, connection_factory=TimedConnection)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._last_used: dict[int, float] = {}
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.healthcheck_idle = healthcheck_idle
+        self.in_use = 0
+        self.waiting = 0
+        self.acquired = 0
+        self.timeouts = 0
+        self.discarded = 0
+        self.acquire_time_total = 0.0
+        self.acquire_time_max = 0.0
+
+    def _healthy(self, conn) -> bool:
+        if conn.closed:
+            return False
+        idle = time.monotonic() - self._last_used.get(id(conn), 0.0)
+        if idle < self.healthcheck_idle:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        started = time.monotonic()
+        with self._lock:
+            self.waiting += 1
+        try:
+            if not self._slots.acquire(timeout=self.timeout):
+                with self._lock:
+                    self.timeouts += 1
+                raise PoolTimeout(f"no database connection free within {self.timeout}s")
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        try:
+            conn = self._pool.getconn()
+            while not self._healthy(conn):
+                self._pool.putconn(conn, close=True)
+                with self._lock:
+                    self.discarded += 1
+                conn = self._pool.getconn()
+        except BaseException:
+            self._slots.release()
+            raise
+        elapsed = time.monotonic() - started
+        with self._lock:
+            self.in_use += 1
+            self.acquired += 1
+            self.acquire_time_total += elapsed
+            self.acquire_time_max = max(self.acquire_time_max, elapsed)
+        return conn
+
+    def putconn(self, conn, close: bool = False):
+        close = close or bool(conn.closed)
+        if not close:
+            try:
+                conn.rollback()  # never hand out a connection with an open transaction
+            except psycopg2.Error:
+                close = True
+        if close:
+            self._last_used.pop(id(conn), None)
+        else:
+            self._last_used[id(conn)] = time.monotonic()
+        self._pool.putconn(conn, close=close)
+        with self._lock:
+            self.in_use -= 1
+        self._slots.release()
+
+    def closeall(self):
+        self._pool.closeall()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size_max": self.maxconn,
+                "in_use": self.in_use,
+                "waiting": self.waiting,
+                "acquired": self.acquired,
+                "timeouts": self.timeouts,
+                "discarded": self.discarded,
+                "acquire_avg_ms": (self.acquire_time_total / self.acquired * 1000) if self.acquired else 0.0,
+                "acquire_max_ms": self.acquire_time_max * 1000,
+            }
+
+
+db_pool: DBPool | None = None
+
+
+def init_db_pool():
+    global db_pool
+    if db_pool is None:
+        db_pool = DBPool(DB_URL, DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT, DB_POOL_HEALTHCHECK_IDLE)
+    return db_pool
+
+
+def close_db_pool():
+    global db_pool
+    if db_pool is not None:
+        db_pool.closeall()
+        db_pool = None
+
+
+@contextmanager
+def db_connection():
+    pool = db_pool or init_db_pool()
+    conn = pool.getconn()
+    broken = False
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        pool.putconn(conn, close=broken)
 
-def get_db_connection():
-    conn = psycopg2.connect(DB_URL)
-    return conn
 
+db_executor: ThreadPoolExecutor | None = None
 
-def init_db():
-    with closing(get_db_connection()) as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute(
+
+def init_db_executor():
+    global db_executor
+    if db_executor is None:
+        db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="db")
+    return db_executor
+
+
+def close_db_executor():
+    global db_executor
+    if db_executor is not None:
+        db_executor.shutdown(wait=True)
+        db_executor = None
+
+
+def timed_db_call(submitted: float, func, *args, **kwargs):
+    started = time.perf_counter()
+    db_wait_seconds.observe(started - submitted)
+    helper = getattr(func, "__qualname__", "other")
+    db_call_context.helper = helper
+    try:
+        return func(*args, **kwargs)
+    finally:
+        db_call_context.helper = "other"
+        db_call_seconds.observe(time.perf_counter() - started, helper)
+
+
+async def run_db(func, *args, **kwargs):
+    # psycopg2 is blocking: keep it off the event loop so one slow query doesn't stall other updates
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        db_executor or init_db_executor(),
+        functools.partial(timed_db_call, time.perf_counter(), func, *args, **kwargs),
+    )
+
+
+# ========================
+# SCHEMA MIGRATIONS
+# ========================
+
+# (version, name, statements). Append only: never edit a migration that has shipped.
+MIGRATIONS: list[tuple[int, str, list[str]]] = [
+    (
+        1,
+        "initial schema",
+        [
             """
             CREATE TABLE IF NOT EXISTS questions (
                 id SERIAL PRIMARY KEY,
@@ -61,9 +466,7 @@ def init_db():
                 correct_option INTEGER NOT NULL,
                 explanation TEXT
             )
-            """
-        )
-        cur.execute(
+            """,
             """
             CREATE TABLE IF NOT EXISTS user_filters (
                 user_id BIGINT PRIMARY KEY,
@@ -74,71 +477,952 @@ def init_db():
                 topic TEXT,
                 subtopic TEXT
             )
+            """,
+        ],
+    ),
+    (
+        2,
+        "filter indexes",
+        [
+            # Every non-empty filter combination gets an index whose leading column is one of
+            # its equality filters; trailing id makes get_question_ids an index-only scan.
+            "CREATE INDEX IF NOT EXISTS questions_board_path_idx "
+            "ON questions (board, year, exam, subject, topic, subtopic, id)",
+            "CREATE INDEX IF NOT EXISTS questions_exam_path_idx ON questions (exam, subject, topic, id)",
+            "CREATE INDEX IF NOT EXISTS questions_subject_path_idx ON questions (subject, topic, subtopic, id)",
+            "CREATE INDEX IF NOT EXISTS questions_topic_idx ON questions (topic, id)",
+            "CREATE INDEX IF NOT EXISTS questions_year_idx ON questions (year, id)",
+            # Most questions have no subtopic ('' from the AddQuestion flow)
+            "CREATE INDEX IF NOT EXISTS questions_subtopic_idx ON questions (subtopic, id) "
+            "WHERE subtopic IS NOT NULL AND subtopic <> ''",
+        ],
+    ),
+    (
+        3,
+        "quiz sessions",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS quiz_sessions (
+                user_id BIGINT NOT NULL,
+                scope TEXT NOT NULL,
+                seed BIGINT NOT NULL,
+                size INTEGER NOT NULL,
+                position INTEGER NOT NULL,
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                PRIMARY KEY (user_id, scope)
+            )
+            """,
+        ],
+    ),
+    (
+        4,
+        "quiz answers and scores",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS quiz_answers (
+                id BIGSERIAL PRIMARY KEY,
+                user_id BIGINT NOT NULL,
+                question_id INTEGER NOT NULL,
+                poll_id TEXT NOT NULL,
+                option_id SMALLINT NOT NULL,
+                is_correct BOOLEAN NOT NULL,
+                answered_at TIMESTAMPTZ NOT NULL
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS user_scores (
+                user_id BIGINT PRIMARY KEY,
+                answered INTEGER NOT NULL DEFAULT 0,
+                correct INTEGER NOT NULL DEFAULT 0,
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS question_stats (
+                question_id INTEGER PRIMARY KEY,
+                answered INTEGER NOT NULL DEFAULT 0,
+                correct INTEGER NOT NULL DEFAULT 0,
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+            """,
+        ],
+    ),
+    (
+        5,
+        "topic stats",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS topic_stats (
+                board TEXT NOT NULL DEFAULT '',
+                exam TEXT NOT NULL DEFAULT '',
+                subject TEXT NOT NULL DEFAULT '',
+                topic TEXT NOT NULL DEFAULT '',
+                answered INTEGER NOT NULL DEFAULT 0,
+                correct INTEGER NOT NULL DEFAULT 0,
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                PRIMARY KEY (board, exam, subject, topic)
+            )
+            """,
+            # backfill from answers recorded before this migration
+            """
+            INSERT INTO topic_stats (board, exam, subject, topic, answered, correct)
+            SELECT COALESCE(q.board, ''), COALESCE(q.exam, ''), COALESCE(q.subject, ''),
+                   COALESCE(q.topic, ''), SUM(s.answered), SUM(s.correct)
+            FROM question_stats s JOIN questions q ON q.id = s.question_id
+            GROUP BY 1, 2, 3, 4
+            ON CONFLICT DO NOTHING
+            """,
+        ],
+    ),
+    (
+        6,
+        "fsm states",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS fsm_states (
+                key TEXT PRIMARY KEY,
+                state TEXT,
+                data JSONB NOT NULL DEFAULT '{}',
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+            """,
+        ],
+    ),
+    (
+        7,
+        "quiz polls",
+        [
+            # poll_id -> question for answers that reach a different worker than the one that sent it
+            """
+            CREATE TABLE IF NOT EXISTS quiz_polls (
+                poll_id TEXT PRIMARY KEY,
+                question_id INTEGER NOT NULL,
+                correct_option SMALLINT NOT NULL,
+                board TEXT NOT NULL DEFAULT '',
+                exam TEXT NOT NULL DEFAULT '',
+                subject TEXT NOT NULL DEFAULT '',
+                topic TEXT NOT NULL DEFAULT '',
+                created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_quiz_polls_created ON quiz_polls (created_at)",
+        ],
+    ),
+    (
+        8,
+        "broadcasts",
+        [
+            # last_user_id: every user_filters row up to it has been handled (checkpoint);
+            # picks: filter tuple (JSON array) -> question id sent to that group, null if none matched
+            """
+            CREATE TABLE IF NOT EXISTS broadcasts (
+                id SERIAL PRIMARY KEY,
+                created_by BIGINT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'running',
+                last_user_id BIGINT NOT NULL DEFAULT 0,
+                sent INTEGER NOT NULL DEFAULT 0,
+                failed INTEGER NOT NULL DEFAULT 0,
+                skipped INTEGER NOT NULL DEFAULT 0,
+                picks JSONB NOT NULL DEFAULT '{}',
+                lease_until TIMESTAMPTZ,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                finished_at TIMESTAMPTZ
+            )
+            """,
+            # at most one broadcast running or paused
+            "CREATE UNIQUE INDEX IF NOT EXISTS broadcasts_active_idx ON broadcasts ((true)) "
+            "WHERE status IN ('running', 'paused')",
+        ],
+    ),
+    (
+        9,
+        "question minhash",
+        [
+            # LSH band keys (band << 32 | band hash) of each question's MinHash signature
+            """
+            CREATE TABLE IF NOT EXISTS question_minhash (
+                question_id INTEGER PRIMARY KEY REFERENCES questions (id) ON DELETE CASCADE,
+                bands BIGINT[] NOT NULL
+            )
+            """,
+        ],
+    ),
+]
+
+MIGRATION_LOCK_ID = 0x5059_5142  # pg advisory lock key, serialises concurrent startups
+MINHASH_BACKFILL_LOCK_ID = 0x5059_5143  # one worker computes missing signatures, the others wait
+
+
+def init_db():
+    with db_connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_ID,))
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
             """
         )
+        cur.execute("SELECT version FROM schema_migrations")
+        applied = {row[0] for row in cur.fetchall()}
+        for version, name, statements in MIGRATIONS:
+            if version in applied:
+                continue
+            logging.info("Applying migration %s: %s", version, name)
+            for statement in statements:
+                cur.execute(statement)
+            cur.execute(
+                "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                (version, name),
+            )
+        conn.commit()
 
 
-def get_or_create_user_filters(user_id: int) -> dict:
-    with closing(get_db_connection()) as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute("SELECT * FROM user_filters WHERE user_id = %s", (user_id,))
-        row = cur.fetchone()
-        if row:
+# ========================
+# IN-MEMORY CACHES
+# ========================
+
+class LRUCache:
+    """Thread-safe size-bounded LRU map with hit/miss counters (helpers run on executor threads).
+
+    With `weigh`, the total weight of the values (e.g. their length) is bounded by max_weight
+    too; a value heavier than that on its own is not cached."""
+
+    def __init__(self, maxsize: int, max_weight: int | None = None, weigh=None):
+        self.maxsize = maxsize
+        self.max_weight = max_weight
+        self.weigh = weigh
+        self._data: OrderedDict = OrderedDict()
+        self._weights: dict = {}
+        self.weight = 0
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.pop(key)
+            if self.weigh is not None:
+                weight = self.weigh(value)
+                if weight > self.max_weight:
+                    return
+                self._weights[key] = weight
+                self.weight += weight
+            self._data[key] = value
+            self._evict()
+
+    def grow(self, key, amount: int):
+        # a cached value was extended in place
+        with self.lock:
+            if key in self._weights:
+                self._weights[key] += amount
+                self.weight += amount
+                self._evict()
+
+    def _evict(self):
+        while len(self._data) > self.maxsize or (
+            self.weigh is not None and self.weight > self.max_weight
+        ):
+            self.pop(next(iter(self._data)))
+
+    def pop(self, key, default=None):
+        with self.lock:
+            self.weight -= self._weights.pop(key, 0)
+            return self._data.pop(key, default)
+
+    def items(self) -> list:
+        with self.lock:
+            return list(self._data.items())
+
+    def clear(self):
+        with self.lock:
+            self._data.clear()
+            self._weights.clear()
+            self.weight = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        with self.lock:
+            stats = {"size": len(self._data), "max": self.maxsize, "hits": self.hits, "misses": self.misses}
+            if self.weigh is not None:
+                stats.update(weight=self.weight, max_weight=self.max_weight)
+            return stats
+
+
+def filter_key(filters: dict | None, exclude: str | None = None) -> tuple:
+    # Normalised (str or None) values in FILTER_FIELDS order; user_filters.year is TEXT, questions.year INTEGER
+    filters = filters or {}
+    return tuple(
+        str(filters[f]) if filters.get(f) and f != exclude else None
+        for f in FILTER_FIELDS
+    )
+
+
+def row_matches_key(row: dict, key: tuple) -> bool:
+    return all(v is None or str(row.get(f)) == v for f, v in zip(FILTER_FIELDS, key))
+
+
+class TaxonomyNode:
+    __slots__ = ("count", "children")
+
+    def __init__(self):
+        self.count = 0
+        self.children: dict[str | None, "TaxonomyNode"] = {}
+
+
+class TaxonomyTree:
+    """board → year → exam → subject → topic → subtopic with question counts per node.
+
+    Facet lookups walk this tree instead of running SELECT DISTINCT; levels without an
+    active filter fan out over all children."""
+
+    def __init__(self):
+        self.root = TaxonomyNode()
+        self.loaded = False
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _add(root: TaxonomyNode, values: tuple, count: int):
+        node = root
+        node.count += count
+        for v in values:
+            child = node.children.get(v)
+            if child is None:
+                child = node.children[v] = TaxonomyNode()
+            node = child
+            node.count += count
+
+    def load(self, cur=None):
+        if cur is None:
+            with db_connection() as conn, conn.cursor() as cur:
+                return self.load(cur)
+        cols = ", ".join(FILTER_FIELDS)
+        cur.execute(f"SELECT {cols}, COUNT(*) FROM questions GROUP BY {cols}")
+        rows = cur.fetchall()
+        root = TaxonomyNode()
+        for row in rows:
+            self._add(root, tuple(None if v is None else str(v) for v in row[:-1]), row[-1])
+        with self._lock:
+            self.root = root
+            self.loaded = True
+
+    def add_question(self, row: dict):
+        values = tuple(None if row.get(f) is None else str(row.get(f)) for f in FILTER_FIELDS)
+        with self._lock:
+            self._add(self.root, values, 1)
+
+    def _count(self, node: TaxonomyNode, level: int, key: tuple, last: int) -> int:
+        if level > last:
+            return node.count
+        v = key[level]
+        if v is not None:
+            child = node.children.get(v)
+            return self._count(child, level + 1, key, last) if child else 0
+        return sum(self._count(c, level + 1, key, last) for c in node.children.values())
+
+    def _facet(self, node: TaxonomyNode, level: int, key: tuple, target: int, last: int, out: dict):
+        if level == target:
+            for v, child in node.children.items():
+                if v:
+                    c = self._count(child, level + 1, key, last)
+                    if c:
+                        out[v] = out.get(v, 0) + c
+            return
+        v = key[level]
+        if v is not None:
+            child = node.children.get(v)
+            if child:
+                self._facet(child, level + 1, key, target, last, out)
+        else:
+            for child in node.children.values():
+                self._facet(child, level + 1, key, target, last, out)
+
+    def facet_counts(self, field: str, key: tuple) -> dict[str, int]:
+        # key: filter_key(..., exclude=field)
+        last = max((i for i, v in enumerate(key) if v is not None), default=-1)
+        out: dict[str, int] = {}
+        with self._lock:
+            self._facet(self.root, 0, key, FILTER_FIELDS.index(field), last, out)
+        return out
+
+
+taxonomy = TaxonomyTree()
+
+
+def _column_value(v) -> str | None:
+    return None if v is None else str(v)
+
+
+class ColumnarIndex:
+    """The six filter columns of every question, dictionary-encoded as NumPy int32 arrays.
+
+    A filter combination is an AND of packed per-value bitmaps (built on first use, kept
+    current on insert); facet counts are a bincount over the masked column and samples are
+    drawn from the mask, so Postgres is only asked for the rows finally chosen."""
+
+    def __init__(self, bitmap_cache_size: int):
+        self.bitmap_cache_size = bitmap_cache_size
+        self.loaded = False
+        self.n = 0
+        self._bitmaps: OrderedDict[tuple[int, int], "np.ndarray"] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _allocate(self, capacity: int):
+        self.capacity = -(-max(capacity, 1024) // 8) * 8  # whole bytes of bitmap
+        ids = np.zeros(self.capacity, dtype=np.int64)
+        codes = [np.zeros(self.capacity, dtype=np.int32) for _ in FILTER_FIELDS]
+        if self.n:
+            ids[: self.n] = self.ids[: self.n]
+            for new, old in zip(codes, self.codes):
+                new[: self.n] = old[: self.n]
+        self.ids, self.codes = ids, codes
+        self._bitmaps.clear()
+
+    def _code(self, i: int, value: str | None) -> int:
+        code = self.lookup[i].get(value)
+        if code is None:
+            code = self.lookup[i][value] = len(self.values[i])
+            self.values[i].append(value)
+        return code
+
+    def load(self, cur=None):
+        if cur is None:
+            with db_connection() as conn, conn.cursor() as cur:
+                return self.load(cur)
+        cur.execute(f"SELECT id, {', '.join(FILTER_FIELDS)} FROM questions ORDER BY id")
+        rows = cur.fetchall()
+        with self._lock:
+            self.n = 0
+            self.values = [[None] for _ in FILTER_FIELDS]  # code -> value, 0 is NULL
+            self.lookup = [{None: 0} for _ in FILTER_FIELDS]
+            self._allocate(len(rows) + len(rows) // 4)
+            self.ids[: len(rows)] = [r[0] for r in rows]
+            for i in range(len(FILTER_FIELDS)):
+                self.codes[i][: len(rows)] = [self._code(i, _column_value(r[i + 1])) for r in rows]
+            self.n = len(rows)
+            self.loaded = True
+
+    def add(self, rows: list[dict]):
+        # rows sorted by id; see on_questions_inserted
+        with self._lock:
+            in_order = not self.n or not rows or rows[0]["id"] > self.ids[self.n - 1]
+            for row in rows:
+                if self.n == self.capacity:
+                    self._allocate(self.capacity * 2)
+                n = self.n
+                self.ids[n] = row["id"]
+                for i, f in enumerate(FILTER_FIELDS):
+                    code = self._code(i, _column_value(row.get(f)))
+                    self.codes[i][n] = code
+                    bitmap = self._bitmaps.get((i, code))
+                    if bitmap is not None:
+                        bitmap[n >> 3] |= 0x80 >> (n & 7)
+                self.n = n + 1
+            if not in_order:
+                # a row committed after a higher id: re-sort so positions stay in id order
+                order = np.argsort(self.ids[: self.n], kind="stable")
+                self.ids[: self.n] = self.ids[: self.n][order]
+                for codes in self.codes:
+                    codes[: self.n] = codes[: self.n][order]
+                self._bitmaps.clear()
+
+    def _bitmap(self, i: int, code: int) -> "np.ndarray":
+        bitmap = self._bitmaps.get((i, code))
+        if bitmap is None:
+            bitmap = self._bitmaps[(i, code)] = np.packbits(self.codes[i] == code)
+            while len(self._bitmaps) > self.bitmap_cache_size:
+                self._bitmaps.popitem(last=False)
+        else:
+            self._bitmaps.move_to_end((i, code))
+        return bitmap
+
+    def _mask(self, key: tuple) -> "np.ndarray":
+        # key: a filter_key() tuple; call with the lock held
+        active = [(i, self.lookup[i].get(v)) for i, v in enumerate(key) if v is not None]
+        if any(code is None for _, code in active):
+            return np.zeros(self.n, dtype=bool)
+        if not active:
+            return np.ones(self.n, dtype=bool)
+        packed = self._bitmap(*active[0])
+        for i, code in active[1:]:
+            packed = packed & self._bitmap(i, code)
+        return np.unpackbits(packed, count=self.n).view(bool)
+
+    def facet_counts(self, field: str, key: tuple) -> dict[str, int]:
+        # key: filter_key(..., exclude=field)
+        i = FILTER_FIELDS.index(field)
+        with self._lock:
+            column = self.codes[i][: self.n][self._mask(key)]
+            counts = np.bincount(column, minlength=len(self.values[i]))
+            values = self.values[i]
+        return {values[c]: int(counts[c]) for c in np.flatnonzero(counts) if values[c]}
+
+    def ids_for(self, key: tuple) -> "np.ndarray":
+        with self._lock:
+            return self.ids[: self.n][self._mask(key)]
+
+    def sample(self, key: tuple, k: int) -> list[int]:
+        with self._lock:
+            matches = np.flatnonzero(self._mask(key))
+            picked = random.sample(range(len(matches)), min(k, len(matches)))
+            return [int(self.ids[matches[j]]) for j in picked]
+
+
+question_index = ColumnarIndex(BITMAP_CACHE_SIZE)
+
+
+def load_question_caches():
+    # One snapshot for the caches and question_sync's watermark: a row committed meanwhile is
+    # in both or in neither, and then the next sync applies it
+    with db_connection() as conn, conn.cursor() as cur:
+        cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        if QUESTION_INDEX == "columnar" and np is not None:
+            question_index.load(cur)
+        else:
+            if QUESTION_INDEX == "columnar":
+                logging.warning("QUESTION_INDEX=columnar needs numpy; using the taxonomy tree")
+            taxonomy.load(cur)
+        question_sync.reset(cur)
+        conn.commit()
+
+
+def cached_question_count() -> int:
+    return question_index.n if question_index.loaded else taxonomy.root.count
+
+
+class WriteBehindCache(ABC):
+    """Bounded write-behind cache of table rows.
+
+    Reads and updates stay in memory; changed rows are marked dirty and written by flush()
+    in one batched UPSERT (_write). Dirty rows are never evicted, so no update is lost.
+
+    With write_through (several worker processes, any of which may change a row) nothing is
+    served from memory: get() always misses and changed rows are written immediately."""
+
+    def __init__(self, maxsize: int, write_through: bool = False):
+        self.maxsize = maxsize
+        self.write_through = write_through
+        self._data: OrderedDict = OrderedDict()
+        self._dirty: set = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+        self.rows_flushed = 0
+
+    def __contains__(self, key) -> bool:
+        return not self.write_through and key in self._data
+
+    def get(self, key) -> dict | None:
+        with self._lock:
+            row = None if self.write_through else self._data.get(key)
+            if row is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
             return dict(row)
 
+    def put(self, key, row: dict, dirty: bool = False) -> dict:
+        """Cache a changed row (dirty), or one just read from the table; returns the cached row.
+
+        A row read from the table only fills a gap: an entry already cached may hold a change
+        made while the read was in flight, which the stale row must not overwrite."""
+        if self.write_through:
+            if dirty:
+                self._commit([(key, dict(row))])
+            return dict(row)
+        with self._lock:
+            if dirty or key not in self._data:
+                self._data[key] = dict(row)
+            if dirty:
+                self._dirty.add(key)
+            self._data.move_to_end(key)
+            cached = dict(self._data[key])
+            self._evict()
+            return cached
+
+    def create(self, key, row: dict) -> dict:
+        # A row the table does not have yet, written by the next flush; an entry cached
+        # meanwhile wins. Returns the cached row.
+        if self.write_through:
+            # another worker may have saved this row since it was read: don't overwrite it
+            self._commit([(key, dict(row))], replace=False)
+            return dict(row)
+        with self._lock:
+            if key not in self._data:
+                self._data[key] = dict(row)
+                self._dirty.add(key)
+            self._data.move_to_end(key)
+            cached = dict(self._data[key])
+            self._evict()
+            return cached
+
+    def update(self, key, values: dict) -> bool:
+        with self._lock:
+            row = None if self.write_through else self._data.get(key)
+            if row is None:
+                return False
+            row.update(values)
+            self._data.move_to_end(key)
+            self._dirty.add(key)
+            return True
+
+    def _evict(self):
+        while len(self._data) > self.maxsize:
+            for key in self._data:  # oldest first
+                if key not in self._dirty:
+                    del self._data[key]
+                    break
+            else:
+                return  # everything is dirty; wait for the next flush
+
+    @abstractmethod
+    def _write(self, cur, items: list[tuple], replace: bool = True):
+        """Write (key, row) items with `cur`, leaving existing rows alone unless `replace`;
+        the caller commits."""
+
+    def flush(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            items = [(key, dict(self._data[key])) for key in self._dirty]
+            self._dirty.clear()
+        try:
+            self._commit(items)
+        except Exception:
+            with self._lock:
+                self._dirty.update(key for key, _ in items)
+            raise
+        with self._lock:
+            self._evict()
+
+    def _commit(self, items: list[tuple], replace: bool = True):
+        with db_connection() as conn, conn.cursor() as cur:
+            self._write(cur, items, replace)
+            conn.commit()
+        with self._lock:
+            self.flushes += 1
+            self.rows_flushed += len(items)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "max": self.maxsize,
+                "dirty": len(self._dirty),
+                "hits": self.hits,
+                "misses": self.misses,
+                "flushes": self.flushes,
+                "rows_flushed": self.rows_flushed,
+            }
+
+
+class UserFilterStore(WriteBehindCache):
+    def _write(self, cur, items: list[tuple], replace: bool = True):
+        execute_values(
+            cur,
+            "INSERT INTO user_filters (user_id, board, year, exam, subject, topic, subtopic) VALUES %s "
+            + (
+                "ON CONFLICT (user_id) DO UPDATE SET " + ", ".join(f"{f} = EXCLUDED.{f}" for f in FILTER_FIELDS)
+                if replace
+                else "ON CONFLICT (user_id) DO NOTHING"
+            ),
+            [(uid, *(row.get(f) for f in FILTER_FIELDS)) for uid, row in items],
+        )
+
+
+user_filter_store = UserFilterStore(USER_FILTER_CACHE_SIZE, write_through=MULTI_WORKER)
+
+
+class QuizSessionStore(WriteBehindCache):
+    # key: (user_id, filter_key tuple); row: {"seed", "size", "position"}
+    def _write(self, cur, items: list[tuple], replace: bool = True):
+        execute_values(
+            cur,
+            "INSERT INTO quiz_sessions (user_id, scope, seed, size, position) VALUES %s "
+            + (
+                "ON CONFLICT (user_id, scope) DO UPDATE SET seed = EXCLUDED.seed, size = EXCLUDED.size, "
+                "position = EXCLUDED.position, updated_at = now()"
+                if replace
+                else "ON CONFLICT (user_id, scope) DO NOTHING"
+            ),
+            [
+                (user_id, session_scope(key), row["seed"], row["size"], row["position"])
+                for (user_id, key), row in items
+            ],
+        )
+
+
+def session_scope(key: tuple) -> str:
+    return json.dumps(list(key), ensure_ascii=False)
+
+
+quiz_session_store = QuizSessionStore(QUIZ_SESSION_CACHE_SIZE, write_through=MULTI_WORKER)
+write_behind_stores = (user_filter_store, quiz_session_store)
+
+
+BASE36 = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+class ValueIndex:
+    """Short, stable ids for filter values, so callback_data stays far below Telegram's 64 bytes.
+
+    Ids are a hash of (field, value), identical across restarts and processes; the reverse map
+    is filled as keyboards are built, and rebuilt from the facet values on a miss."""
+
+    def __init__(self):
+        self._ids: dict[tuple[str, str], str] = {}
+        self._values: dict[tuple[str, str], str] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _hash(field: str, value: str) -> str:
+        n = int.from_bytes(hashlib.blake2b(f"{field}\0{value}".encode(), digest_size=6).digest(), "big")
+        out = ""
+        while True:
+            n, r = divmod(n, 36)
+            out = BASE36[r] + out
+            if not n:
+                return out
+
+    def id_for(self, field: str, value: str) -> str:
+        vid = self._ids.get((field, value))
+        if vid is None:
+            vid = self._hash(field, value)
+            with self._lock:
+                self._ids[(field, value)] = vid
+                self._values[(field, vid)] = value
+        return vid
+
+    def value_for(self, field: str, vid: str) -> str | None:
+        return self._values.get((field, vid))
+
+    def resolve(self, field: str, vid: str) -> str | None:
+        # Slow path for buttons rendered by another process or before a restart
+        for value in get_distinct_values(field):
+            self.id_for(field, value)
+        return self.value_for(field, vid)
+
+
+value_index = ValueIndex()
+
+
+# Sorted question ids per filter combination; sampling picks from these instead of ORDER BY RANDOM()
+question_id_cache = LRUCache(QUESTION_ID_CACHE_SIZE, QUESTION_ID_CACHE_IDS, weigh=len)
+
+
+# Facet (value, question count) pairs per (field, active filters other than field)
+facet_cache = LRUCache(FACET_CACHE_SIZE)
+
+
+# Rendered value keyboards per (field, filters, cursor, direction)
+facet_page_cache = LRUCache(FACET_PAGE_CACHE_SIZE)
+
+
+class QuestionSync:
+    """Applies questions inserted by other processes (workers, `bot.py import`) to this process's caches.
+
+    Polls for ids above the newest one seen; the last `lookback` ids are re-checked so a row
+    whose transaction committed late is not skipped, and a periodic count check rebuilds the
+    caches if one slipped through anyway."""
+
+    def __init__(self, lookback: int, recount_interval: float):
+        self.lookback = lookback
+        self.recount_interval = recount_interval
+        self.watermark = 0
+        self.recent: set[int] = set()
+        self.synced = 0
+        self.rebuilds = 0
+        self._next_recount = 0.0
+        self._lock = threading.Lock()
+
+    def note(self, ids):
+        # Inserts made here note their ids before they commit, so sync() never sees such a row
+        # unnoted and applies it a second time
+        with self._lock:
+            self.recent.update(ids)
+            self.watermark = max(self.watermark, max(self.recent, default=0))
+
+    def reset(self, cur):
+        # on the snapshot load_question_caches() loaded from
         cur.execute(
-            "INSERT INTO user_filters (user_id, board, year, exam, subject, topic, subtopic) "
-            "VALUES (%s, NULL, NULL, NULL, NULL, NULL, NULL)",
-            (user_id,),
+            "SELECT id FROM questions WHERE id > (SELECT COALESCE(MAX(id), 0) FROM questions) - %s",
+            (self.lookback,),
         )
-        conn.commit()
-        return {
-            "user_id": user_id,
-            "board": None,
-            "year": None,
-            "exam": None,
-            "subject": None,
-            "topic": None,
-            "subtopic": None,
-        }
+        ids = [row[0] for row in cur.fetchall()]
+        with self._lock:
+            # keep ids noted by inserts that had not committed when the snapshot was taken
+            self.watermark = max(self.watermark, max(ids, default=0))
+            floor = self.watermark - self.lookback
+            self.recent = set(ids) | {i for i in self.recent if i > floor}
+            self._next_recount = time.monotonic() + self.recount_interval
+
+    def sync(self):
+        with db_connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute("SELECT id FROM questions WHERE id > %s", (self.watermark - self.lookback,))
+            new = [row["id"] for row in cur.fetchall() if row["id"] not in self.recent]
+            rows = []
+            if new:
+                cur.execute(
+                    f"SELECT q.id, {', '.join('q.' + f for f in FILTER_FIELDS)}, m.bands "
+                    "FROM questions q LEFT JOIN question_minhash m ON m.question_id = q.id "
+                    "WHERE q.id = ANY(%s) ORDER BY q.id",
+                    (new,),
+                )
+                rows = [dict(row) for row in cur.fetchall()]
+            conn.commit()
+        if rows:
+            on_questions_inserted(rows)
+            self.synced += len(rows)
+        with self._lock:
+            floor = self.watermark - self.lookback
+            self.recent = {i for i in self.recent if i > floor}
+        if time.monotonic() >= self._next_recount:
+            self.recount()
+
+    def recount(self):
+        with db_connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT COUNT(*) FROM questions")
+            count = cur.fetchone()[0]
+            conn.commit()
+        self._next_recount = time.monotonic() + self.recount_interval
+        cached = cached_question_count()
+        if count == cached:
+            return
+        logging.warning("Question caches out of step (%s cached, %s in db); rebuilding", cached, count)
+        load_question_caches()
+        for cache in (question_id_cache, facet_cache, facet_page_cache, main_menu_cache):
+            cache.clear()
+        self.rebuilds += 1
+
+
+question_sync = QuestionSync(QUESTION_SYNC_LOOKBACK, QUESTION_RECOUNT_INTERVAL)
+
+
+def on_questions_inserted(rows: list[dict]):
+    # Keep derived caches in step with new questions (rows must carry their new "id"). Id lists
+    # stay sorted whatever order inserts commit in: a quiz cursor position must keep naming the
+    # same question in every worker and after a reload (ORDER BY id)
+    rows = sorted(rows, key=lambda row: row["id"])
+    question_sync.note(row["id"] for row in rows)
+    for row in rows:
+        if row.get("bands"):
+            near_duplicates.add(row["id"], row["bands"])
+    if question_index.loaded:
+        question_index.add(rows)
+    else:
+        for row in rows:
+            taxonomy.add_question(row)
+    if len(rows) > BULK_INVALIDATE_ROWS:
+        question_id_cache.clear()
+        facet_cache.clear()
+        facet_page_cache.clear()
+        return
+    for key, ids in question_id_cache.items():
+        with question_id_cache.lock:
+            matching = [row["id"] for row in rows if row_matches_key(row, key)]
+            for qid in matching:
+                insort(ids, qid)
+            question_id_cache.grow(key, len(matching))
+    for cache in (facet_cache, facet_page_cache):
+        for cache_key, _ in cache.items():
+            key = cache_key[1]
+            if any(row_matches_key(row, key) for row in rows):
+                cache.pop(cache_key)
+
+
+def get_or_create_user_filters(user_id: int) -> dict:
+    cached = user_filter_store.get(user_id)
+    if cached is not None:
+        return cached
+
+    with db_connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("SELECT * FROM user_filters WHERE user_id = %s", (user_id,))
+        row = cur.fetchone()
+    if row:
+        return user_filter_store.put(user_id, dict(row))
+
+    # New user: the row is created by the next write-behind flush
+    return user_filter_store.create(user_id, {"user_id": user_id, **{f: None for f in FILTER_FIELDS}})
 
 
 def update_user_filter(user_id: int, field: str, value: str | None):
     if field not in {"board", "year", "exam", "subject", "topic", "subtopic"}:
         return
-    with closing(get_db_connection()) as conn, conn.cursor() as cur:
-        cur.execute(
-            f"UPDATE user_filters SET {field} = %s WHERE user_id = %s",
-            (value, user_id),
-        )
-        conn.commit()
+    if not user_filter_store.update(user_id, {field: value}):
+        row = get_or_create_user_filters(user_id)
+        row[field] = value
+        user_filter_store.put(user_id, row, dirty=True)
 
 
 def reset_user_filters(user_id: int):
-    with closing(get_db_connection()) as conn, conn.cursor() as cur:
-        cur.execute(
-            """
-            UPDATE user_filters
-            SET board = NULL, year = NULL, exam = NULL,
-                subject = NULL, topic = NULL, subtopic = NULL
-            WHERE user_id = %s
-            """,
-            (user_id,),
-        )
-        conn.commit()
+    user_filter_store.put(user_id, {"user_id": user_id, **{f: None for f in FILTER_FIELDS}}, dirty=True)
 
 
-def get_distinct_values(field: str, filters: dict | None = None) -> list[str]:
+async def run_user_filters(func, user_id: int, *args):
+    # Cached users are served straight from memory, without an executor hop
+    if user_id in user_filter_store:
+        return func(user_id, *args)
+    return await run_db(func, user_id, *args)
+
+
+def facet_sort_key(field: str, value: str):
+    # Years numerically; text by code point, which matches ORDER BY ... COLLATE "C"
+    if field == "year":
+        return (0, int(value)) if value.lstrip("-").isdigit() else (1, value)
+    return value
+
+
+def sort_facet_values(field: str, values):
+    return sorted(values, key=lambda v: facet_sort_key(field, v))
+
+
+def get_facet_counts(field: str, filters: dict | None = None) -> list[tuple[str, int]]:
     if field not in {"board", "year", "exam", "subject", "topic", "subtopic"}:
         return []
 
+    key = filter_key(filters, exclude=field)
+    cache_key = (field, key)
+    cached = facet_cache.get(cache_key)
+    if cached is not None:
+        return list(cached)
+
+    if question_index.loaded:
+        counts = question_index.facet_counts(field, key)
+    elif taxonomy.loaded:
+        counts = taxonomy.facet_counts(field, key)
+    else:
+        counts = _query_facet_counts(field, key)
+    facets = tuple((v, counts[v]) for v in sort_facet_values(field, counts))
+    facet_cache.set(cache_key, facets)
+    return list(facets)
+
+
+def _query_facet_counts(field: str, key: tuple) -> dict[str, int]:
     clauses = []
     params: list = []
 
-    if filters:
-        for f_name in ["board", "year", "exam", "subject", "topic", "subtopic"]:
-            if f_name in filters and filters[f_name] and f_name != field:
-                clauses.append(f"{f_name} = %s")
-                params.append(filters[f_name])
+    for f_name, val in zip(FILTER_FIELDS, key):
+        if val is not None:
+            clauses.append(f"{f_name} = %s")
+            params.append(val)
 
     # Always ignore NULL
     clauses.append(f"{field} IS NOT NULL")
@@ -149,41 +1433,127 @@ def get_distinct_values(field: str, filters: dict | None = None) -> list[str]:
 
     where_sql = "WHERE " + " AND ".join(clauses) if clauses else ""
 
-    with closing(get_db_connection()) as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+    with db_connection() as conn, conn.cursor() as cur:
         cur.execute(
-            f"SELECT DISTINCT {field} FROM questions {where_sql}",
+            f"SELECT {field}, COUNT(*) FROM questions {where_sql} GROUP BY {field}",
             params,
         )
         rows = cur.fetchall()
-        return [str(row[field]) for row in rows if row[field] is not None]
+    return {str(v): n for v, n in rows if v is not None}
 
 
-def get_questions_for_filters(filters: dict, limit: int = 10) -> list[dict]:
+def get_distinct_values(field: str, filters: dict | None = None) -> list[str]:
+    return [v for v, _ in get_facet_counts(field, filters)]
+
+
+def get_facet_page(
+    field: str,
+    filters: dict | None = None,
+    cursor: str | None = None,
+    direction: str = "n",
+    limit: int = FACET_PAGE_SIZE,
+) -> tuple[list[tuple[str, int]], bool, bool]:
+    """One page of facet values after ("n") or before ("p") the cursor value.
+
+    Returns (items, has_prev, has_next)."""
+    key = filter_key(filters, exclude=field)
+    if not (taxonomy.loaded or question_index.loaded) and facet_cache.get((field, key)) is None:
+        return _query_facet_page(field, key, cursor, direction, limit)
+
+    items = get_facet_counts(field, filters)
+    keys = [facet_sort_key(field, v) for v, _ in items]
+    if cursor is None:
+        start = 0
+        end = min(limit, len(items))
+    elif direction == "n":
+        start = bisect_right(keys, facet_sort_key(field, cursor))
+        end = min(start + limit, len(items))
+    else:
+        end = bisect_left(keys, facet_sort_key(field, cursor))
+        start = max(0, end - limit)
+    return items[start:end], start > 0, end < len(items)
+
+
+def _query_facet_page(field: str, key: tuple, cursor: str | None, direction: str, limit: int):
+    # Keyset pagination in SQL, used until the taxonomy tree is loaded
+    clauses = [f"{f_name} = %s" for f_name, val in zip(FILTER_FIELDS, key) if val is not None]
+    params: list = [val for val in key if val is not None]
+    clauses.append(f"{field} IS NOT NULL")
+    col = field
+    if field != "year":
+        clauses.append(f"{field} != ''")
+        col = f'{field} COLLATE "C"'
+    if cursor is not None:
+        clauses.append(f"{col} {'>' if direction == 'n' else '<'} %s")
+        params.append(int(cursor) if field == "year" else cursor)
+    order = "ASC" if direction == "n" else "DESC"
+
+    with db_connection() as conn, conn.cursor() as cur:
+        cur.execute(
+            f"SELECT {field}, COUNT(*) FROM questions WHERE {' AND '.join(clauses)} "
+            f"GROUP BY {field} ORDER BY {col} {order} LIMIT %s",
+            params + [limit + 1],
+        )
+        rows = cur.fetchall()
+    more = len(rows) > limit
+    items = [(str(v), n) for v, n in rows[:limit]]
+    if direction == "n":
+        return items, cursor is not None, more
+    return items[::-1], more, True
+
+
+def get_question_ids(filters: dict) -> array:
+    key = filter_key(filters)
+    ids = question_id_cache.get(key)
+    if ids is not None:
+        return ids
+
+    if question_index.loaded:
+        ids = array("l")
+        ids.frombytes(question_index.ids_for(key).astype(f"i{ids.itemsize}").tobytes())
+        question_id_cache.set(key, ids)
+        return ids
+
     clauses = []
     params: list = []
-
-    for field in ["board", "year", "exam", "subject", "topic", "subtopic"]:
-        val = filters.get(field)
-        if val:
+    for field, val in zip(FILTER_FIELDS, key):
+        if val is not None:
             clauses.append(f"{field} = %s")
             params.append(val)
-
     where_sql = "WHERE " + " AND ".join(clauses) if clauses else ""
-    sql = (
-        "SELECT * FROM questions "
-        f"{where_sql} "
-        "ORDER BY RANDOM() "
-        "LIMIT %s"
-    )
-    params.append(limit)
 
-    with closing(get_db_connection()) as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute(sql, params)
-        return cur.fetchall()
+    with db_connection() as conn, conn.cursor() as cur:
+        cur.execute(f"SELECT id FROM questions {where_sql} ORDER BY id", params)
+        ids = array("l", (row[0] for row in cur))
+    question_id_cache.set(key, ids)
+    return ids
+
+
+def get_questions_by_ids(ids: list[int], cur=None) -> list[dict]:
+    # cur: a RealDictCursor to run on, for callers already holding a connection
+    if not ids:
+        return []
+    if cur is None:
+        with db_connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+            return get_questions_by_ids(ids, cur)
+    cur.execute("SELECT * FROM questions WHERE id = ANY(%s)", (list(ids),))
+    by_id = {row["id"]: row for row in cur.fetchall()}
+    return [by_id[i] for i in ids if i in by_id]
+
+
+def get_questions_for_filters(filters: dict, limit: int = 10) -> list[dict]:
+    # Uniform sample over the matching ids, then a primary-key fetch of just the chosen rows
+    if question_index.loaded:
+        return get_questions_by_ids(question_index.sample(filter_key(filters), limit))
+    ids = get_question_ids(filters)
+    n = len(ids)
+    picked = [ids[i] for i in random.sample(range(n), min(limit, n))]
+    return get_questions_by_ids(picked)
 
 
 def insert_question(data: dict) -> int:
-    with closing(get_db_connection()) as conn, conn.cursor() as cur:
+    bands = minhash_bands(question_shingles(data))
+    with db_connection() as conn, conn.cursor() as cur:
         cur.execute(
             """
             INSERT INTO questions (
@@ -211,14 +1581,1001 @@ def insert_question(data: dict) -> int:
             ),
         )
         new_id = cur.fetchone()[0]
+        store_minhash(cur, [(new_id, bands)])
+        question_sync.note([new_id])
+        conn.commit()
+    on_questions_inserted([{**data, "id": new_id, "bands": bands}])
+    return new_id
+
+
+# ========================
+# NEAR-DUPLICATE INDEX
+# ========================
+
+# MinHash signatures of question text + options, cut into LSH bands: two questions whose shingle
+# sets have Jaccard similarity s share a band with probability 1 - (1 - s^ROWS)^BANDS (0.98 at
+# s=0.8, 0.06 at s=0.3). Stored band keys depend on all of these, so they are not settings.
+MINHASH_BANDS = 8
+MINHASH_ROWS = 4
+MINHASH_SHINGLE = 4  # characters
+_MERSENNE = (1 << 31) - 1
+_perm_rnd = random.Random(0x5EED)
+MINHASH_PERMS = [
+    (_perm_rnd.randrange(1, _MERSENNE), _perm_rnd.randrange(_MERSENNE))
+    for _ in range(MINHASH_BANDS * MINHASH_ROWS)
+]
+if np is not None:
+    _PERM_A = np.array([a for a, _ in MINHASH_PERMS], dtype=np.int64)[:, None]
+    _PERM_B = np.array([b for _, b in MINHASH_PERMS], dtype=np.int64)[:, None]
+
+
+class _Separators(dict):
+    # str.translate table: punctuation, symbols, separators and control characters -> space
+    def __missing__(self, c: int) -> str:
+        ch = chr(c)
+        self[c] = " " if unicodedata.category(ch)[0] in "PSZC" else ch
+        return self[c]
+
+
+_separators = _Separators()
+
+
+def normalize_question_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFKC", text).casefold().translate(_separators).split())
+
+
+def question_shingles(row: dict) -> set[int]:
+    # Options are sorted: the same question with its options shuffled is still a duplicate
+    options = sorted(normalize_question_text(str(row[f"option{i}"])) for i in range(1, 5))
+    text = " | ".join([normalize_question_text(str(row["question_text"])), *options])
+    n = MINHASH_SHINGLE
+    return {zlib.crc32(text[i:i + n].encode()) for i in range(max(1, len(text) - n + 1))}
+
+
+def minhash_bands(shingles: set[int]) -> list[int]:
+    # (a*x + b) mod 2^31-1 permutations; x is reduced first so the numpy products fit in int64
+    if np is not None:
+        xs = np.fromiter(shingles, dtype=np.int64, count=len(shingles)) % _MERSENNE
+        sig = ((_PERM_A * xs + _PERM_B) % _MERSENNE).min(axis=1).astype(np.uint32).tolist()
+    else:
+        xs = [x % _MERSENNE for x in shingles]
+        sig = [min((a * x + b) % _MERSENNE for x in xs) for a, b in MINHASH_PERMS]
+    return [
+        band << 32 | zlib.crc32(array("I", sig[band * MINHASH_ROWS:(band + 1) * MINHASH_ROWS]).tobytes())
+        for band in range(MINHASH_BANDS)
+    ]
+
+
+def jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+def store_minhash(cur, pairs: list[tuple[int, list[int]]]):
+    execute_values(
+        cur,
+        "INSERT INTO question_minhash (question_id, bands) VALUES %s ON CONFLICT (question_id) DO NOTHING",
+        pairs,
+        page_size=1000,
+    )
+
+
+def backfill_minhash(batch: int = 5000, stop: threading.Event | None = None) -> int:
+    """Compute signatures for questions that have none (loaded before migration 9, or inserted
+    by something other than the bot), until done or `stop` is set. Returns how many were added."""
+    added = 0
+    last_id = 0
+    # Own connection, not a pool slot: on a large bank this runs for minutes, and every other
+    # worker holds one while it waits for the lock
+    conn = psycopg2.connect(DB_URL, connection_factory=TimedConnection)
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute("SELECT pg_advisory_lock(%s)", (MINHASH_BACKFILL_LOCK_ID,))
+            try:
+                while stop is None or not stop.is_set():
+                    cur.execute(
+                        """
+                        SELECT q.id, q.question_text, q.option1, q.option2, q.option3, q.option4
+                        FROM questions q
+                        WHERE q.id > %s
+                          AND NOT EXISTS (SELECT 1 FROM question_minhash m WHERE m.question_id = q.id)
+                        ORDER BY q.id
+                        LIMIT %s
+                        """,
+                        (last_id, batch),
+                    )
+                    rows = cur.fetchall()
+                    if not rows:
+                        break
+                    store_minhash(cur, [(row["id"], minhash_bands(question_shingles(row))) for row in rows])
+                    conn.commit()
+                    added += len(rows)
+                    last_id = rows[-1]["id"]
+                    if added % (batch * 20) == 0:
+                        logging.info("Computed MinHash signatures for %s questions", added)
+            finally:
+                conn.rollback()
+                cur.execute("SELECT pg_advisory_unlock(%s)", (MINHASH_BACKFILL_LOCK_ID,))
+                conn.commit()
+    finally:
+        conn.close()
+    return added
+
+
+class NearDuplicateIndex:
+    """LSH buckets of question MinHash signatures: (band, band hash) -> question ids.
+
+    The bulk is one sorted (hash, id) array pair per band, loaded from question_minhash, so a
+    lookup is a binary search per band. Questions added since then sit in small per-band dicts
+    until there are `merge_rows` of them and prepare_near_duplicates reloads the arrays; adds
+    made while a load runs are kept on top of it."""
+
+    def __init__(self, merge_rows: int):
+        self.merge_rows = merge_rows
+        self._hashes = [array("I") for _ in range(MINHASH_BANDS)]
+        self._ids = [array("i") for _ in range(MINHASH_BANDS)]
+        self._recent: list[dict[int, list[int]]] = [{} for _ in range(MINHASH_BANDS)]
+        self._lock = threading.Lock()
+        self.size = 0
+        self.recent_rows = 0
+        self.lookups = 0
+        self.candidates_checked = 0
+        self.loaded = False
+        self._since_load: list | None = None  # (qid, bands) added while load() runs
+
+    def build(self, rows):
+        """Replace the contents with (question id, band keys) rows."""
+        hashes = [array("I") for _ in range(MINHASH_BANDS)]
+        ids = [array("i") for _ in range(MINHASH_BANDS)]
+        for qid, bands in rows:
+            for key in bands:
+                band = key >> 32
+                hashes[band].append(key & 0xFFFF_FFFF)
+                ids[band].append(qid)
+        for band in range(MINHASH_BANDS):
+            if np is not None:
+                order = np.argsort(np.frombuffer(hashes[band], dtype=np.uint32), kind="stable")
+                hashes[band] = array("I", np.frombuffer(hashes[band], dtype=np.uint32)[order].tobytes())
+                ids[band] = array("i", np.frombuffer(ids[band], dtype=np.int32)[order].tobytes())
+            else:
+                order = sorted(range(len(hashes[band])), key=hashes[band].__getitem__)
+                hashes[band] = array("I", [hashes[band][i] for i in order])
+                ids[band] = array("i", [ids[band][i] for i in order])
+        with self._lock:
+            self._hashes, self._ids = hashes, ids
+            self._recent = [{} for _ in range(MINHASH_BANDS)]
+            self.size = len(ids[0])
+            self.recent_rows = 0
+            # a row added during the load may also be in it; a repeated candidate is harmless
+            for qid, bands in self._since_load or ():
+                self._add_recent(qid, bands)
+            self._since_load = None
+            self.loaded = True
+
+    def load(self):
+        with self._lock:
+            self._since_load = []
+        try:
+            with db_connection() as conn:
+                with conn.cursor(name="minhash_load") as cur:
+                    cur.itersize = 100_000
+                    cur.execute("SELECT question_id, bands FROM question_minhash")
+                    self.build(cur)
+                conn.commit()
+        finally:
+            with self._lock:
+                self._since_load = None
+
+    def _add_recent(self, qid: int, bands: list[int]):
+        # call with the lock held
+        for key in bands:
+            self._recent[key >> 32].setdefault(key & 0xFFFF_FFFF, []).append(qid)
+        self.size += 1
+        self.recent_rows += 1
+
+    def add(self, qid: int, bands: list[int]):
+        with self._lock:
+            self._add_recent(qid, bands)
+            if self._since_load is not None:
+                self._since_load.append((qid, bands))
+
+    @property
+    def merge_due(self) -> bool:
+        return self.loaded and self.recent_rows >= self.merge_rows
+
+    def candidates(self, bands: list[int], limit: int) -> list[int]:
+        found: dict[int, None] = {}  # ordered set, bucket by bucket
+        for key in bands:
+            band, h = key >> 32, key & 0xFFFF_FFFF
+            hashes, ids = self._hashes[band], self._ids[band]
+            i = bisect_left(hashes, h)
+            while i < len(hashes) and hashes[i] == h and len(found) < limit:
+                found[ids[i]] = None
+                i += 1
+            for qid in self._recent[band].get(h, ()):
+                if len(found) >= limit:
+                    break
+                found[qid] = None
+        self.lookups += 1
+        self.candidates_checked += len(found)
+        return list(found)
+
+    def stats(self) -> dict:
+        return {
+            "loaded": int(self.loaded),
+            "questions": self.size,
+            "unmerged": self.recent_rows,
+            "lookups": self.lookups,
+            "candidates_per_lookup": self.candidates_checked / self.lookups if self.lookups else 0.0,
+        }
+
+
+near_duplicates = NearDuplicateIndex(DEDUP_MERGE_ROWS)
+near_duplicates_stop = threading.Event()
+
+
+async def prepare_near_duplicates():
+    """Backfill missing signatures and load the index once the worker is serving: on a large
+    bank that takes minutes, longer than a worker may take to start. Until the index is
+    loaded, near-duplicate checks find nothing. Then rebuild it whenever a merge is due."""
+    loop = asyncio.get_running_loop()
+    # default executor: the DB threads stay free for updates
+    try:
+        backfill = functools.partial(backfill_minhash, stop=near_duplicates_stop)
+        added = await loop.run_in_executor(None, backfill)
+        if added:
+            logging.info("Computed MinHash signatures for %s questions", added)
+        if not near_duplicates_stop.is_set():
+            await loop.run_in_executor(None, near_duplicates.load)
+    except Exception:
+        logging.exception("Preparing the near-duplicate index failed")
+    while not near_duplicates_stop.is_set():
+        await asyncio.sleep(DEDUP_MERGE_INTERVAL)
+        if not near_duplicates.loaded or near_duplicates.merge_due:
+            try:
+                await loop.run_in_executor(None, near_duplicates.load)
+            except Exception:
+                logging.exception("Rebuilding the near-duplicate index failed")
+
+
+def find_near_duplicates(
+    shingles: set[int], bands: list[int] | None = None, limit: int = 3, cur=None
+) -> list[tuple[float, dict]]:
+    """Stored questions at least DEDUP_THRESHOLD similar to these shingles, most similar first."""
+    if bands is None:
+        bands = minhash_bands(shingles)
+    ids = near_duplicates.candidates(bands, DEDUP_MAX_CANDIDATES)
+    matches = []
+    for q in get_questions_by_ids(ids, cur):
+        similarity = jaccard(shingles, question_shingles(q))
+        if similarity >= DEDUP_THRESHOLD:
+            matches.append((similarity, q))
+    matches.sort(key=lambda m: -m[0])
+    return matches[:limit]
+
+
+# ========================
+# QUIZ SESSIONS (NO REPEATS)
+# ========================
+
+# Each (user, filters) scope walks a keyed pseudo-random permutation of the scope's id list, so the
+# only state is (seed, size, position): the next N questions cost O(N) and none repeat until the
+# cycle ends. Ids are append-only, so index i keeps naming the same question; questions added
+# mid-cycle join the next cycle.
+
+_MASK64 = (1 << 64) - 1
+
+
+def _mix64(x: int) -> int:
+    # splitmix64 finaliser
+    x = (x ^ (x >> 30)) * 0xBF58476D1CE4E5B9 & _MASK64
+    x = (x ^ (x >> 27)) * 0x94D049BB133111EB & _MASK64
+    return x ^ (x >> 31)
+
+
+def permute_index(i: int, size: int, seed: int) -> int:
+    """Bijection on range(size): 4-round Feistel network over 2^bits, cycle-walked into range."""
+    bits = max(2, (size - 1).bit_length())
+    bits += bits % 2
+    half = bits // 2
+    mask = (1 << half) - 1
+    x = i
+    while True:
+        left, right = x >> half, x & mask
+        for r in range(4):
+            left, right = right, left ^ (_mix64(right ^ (seed + r * 0x9E3779B97F4A7C15) & _MASK64) & mask)
+        x = (left << half) | right
+        if x < size:
+            return x
+
+
+def _new_cycle(size: int) -> dict:
+    return {"seed": random.getrandbits(63), "size": size, "position": 0}
+
+
+def load_quiz_session(user_id: int, key: tuple) -> dict | None:
+    session = quiz_session_store.get((user_id, key))
+    if session is not None:
+        return session
+    with db_connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(
+            "SELECT seed, size, position FROM quiz_sessions WHERE user_id = %s AND scope = %s",
+            (user_id, session_scope(key)),
+        )
+        row = cur.fetchone()
+    if row is None:
+        return None
+    return quiz_session_store.put((user_id, key), dict(row))
+
+
+def plan_quiz(user_id: int, key: tuple, ids, limit: int) -> tuple[list[int], dict | None, dict, bool]:
+    """Advance a copy of the user's cursor by `limit` questions without saving it.
+
+    Returns (picked ids, session before, session after, restarted)."""
+    total = len(ids)
+    before = load_quiz_session(user_id, key)
+    restarted = False
+    if before is None or before["size"] > total:
+        session = _new_cycle(total)
+    else:
+        session = dict(before)
+    picked: list[int] = []
+    while len(picked) < min(limit, total):
+        if session["position"] >= session["size"]:
+            session = _new_cycle(total)
+            restarted = True
+        qid = ids[permute_index(session["position"], session["size"], session["seed"])]
+        session["position"] += 1
+        if qid not in picked:  # only possible right after a cycle restart
+            picked.append(qid)
+    return picked, before, session, restarted
+
+
+def next_quiz_questions(user_id: int, filters: dict, limit: int = 10) -> tuple[list[dict], bool]:
+    """Next `limit` questions this user has not seen for these filters.
+
+    Returns (questions, restarted); restarted is True when every question in scope had been
+    served and a new shuffled cycle began."""
+    key = filter_key(filters)
+    ids = get_question_ids(filters)
+    if not len(ids):
+        return [], False
+    picked, _, session, restarted = plan_quiz(user_id, key, ids, limit)
+    quiz_session_store.put((user_id, key), session, dirty=True)
+    return get_questions_by_ids(picked), restarted
+
+
+def quiz_poll(q: dict) -> dict:
+    # answer_poll() arguments for one question
+    return {
+        "question": q["question_text"],
+        "options": [q["option1"], q["option2"], q["option3"], q["option4"]],
+        "type": "quiz",
+        "correct_option_id": int(q["correct_option"]) - 1,  # convert 1-4 -> 0-3
+        "explanation": q["explanation"] or None,
+        "is_anonymous": False,
+    }
+
+
+# ========================
+# QUIZ PREFETCH
+# ========================
+
+class QuizPrefetcher:
+    """Next quizzes built ahead of time for users of the hottest filter combinations.
+
+    Taps are counted per filter tuple and every rank interval the top `hot_keys` tuples become
+    hot (counts halve each time, so heat follows current traffic). After a user is served a
+    quiz for a hot tuple, a background task plans their next one from their cursor, fetches
+    the rows and builds the polls into that tuple's bounded buffer. take() serves it only if
+    the cursor is still exactly where the plan started, which keeps the no-repeat guarantee."""
+
+    def __init__(self, hot_keys: int, per_key: int, workers: int, rank_interval: float):
+        self.hot_keys = hot_keys
+        self.per_key = per_key
+        self.workers = workers
+        self.rank_interval = rank_interval
+        self.taps: dict[tuple, int] = {}
+        self.hot: set[tuple] = set()
+        self.buffers: dict[tuple, OrderedDict] = {}
+        self._queue: asyncio.Queue | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.built = 0
+
+    def start(self):
+        if self.hot_keys <= 0 or self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.hot_keys * self.per_key)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._rank_loop()))
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+
+    def note(self, key: tuple):
+        self.taps[key] = self.taps.get(key, 0) + 1
+
+    def rank(self):
+        top = heapq.nlargest(self.hot_keys, self.taps.items(), key=lambda kv: kv[1])
+        self.taps = {k: v // 2 for k, v in self.taps.items() if v > 1}
+        with self._lock:
+            self.hot = {k for k, _ in top}
+            for key in [k for k in self.buffers if k not in self.hot]:
+                del self.buffers[key]
+
+    async def _rank_loop(self):
+        while True:
+            await asyncio.sleep(self.rank_interval)
+            self.rank()
+
+    def take(self, user_id: int, key: tuple) -> dict | None:
+        if key not in self.hot:
+            quiz_prefetch_results.inc("cold")
+            return None
+        with self._lock:
+            entry = self.buffers.get(key, {}).pop(user_id, None)
+        if entry is None:
+            self.misses += 1
+            quiz_prefetch_results.inc("miss")
+            return None
+        if quiz_session_store.get((user_id, key)) != entry["before"]:
+            self.stale += 1
+            quiz_prefetch_results.inc("stale")
+            return None
+        quiz_session_store.put((user_id, key), entry["after"], dirty=True)
+        self.hits += 1
+        quiz_prefetch_results.inc("hit")
+        return entry
+
+    def schedule(self, user_id: int, filters: dict):
+        if self._queue is not None and filter_key(filters) in self.hot and not self._queue.full():
+            self._queue.put_nowait((user_id, filters))
+
+    def build(self, user_id: int, filters: dict, limit: int = 10):
+        key = filter_key(filters)
+        ids = get_question_ids(filters)
+        if not len(ids):
+            return
+        picked, before, after, restarted = plan_quiz(user_id, key, ids, limit)
+        questions = get_questions_by_ids(picked)
+        entry = {
+            "before": before,
+            "after": after,
+            "restarted": restarted,
+            "questions": questions,
+            "polls": [quiz_poll(q) for q in questions],
+        }
+        with self._lock:
+            if key not in self.hot:
+                return
+            buffer = self.buffers.setdefault(key, OrderedDict())
+            buffer[user_id] = entry
+            buffer.move_to_end(user_id)
+            while len(buffer) > self.per_key:
+                buffer.popitem(last=False)
+        self.built += 1
+
+    async def _worker(self):
+        while True:
+            user_id, filters = await self._queue.get()
+            try:
+                await run_db(self.build, user_id, filters)
+            except Exception:
+                logging.exception("Prefetching a quiz for user %s failed", user_id)
+
+    def stats(self) -> dict:
+        served = self.hits + self.misses + self.stale
+        with self._lock:
+            buffered = sum(len(b) for b in self.buffers.values())
+        return {
+            "hot_keys": len(self.hot),
+            "buffered": buffered,
+            "built": self.built,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "hit_rate": self.hits / served if served else 0.0,
+        }
+
+
+# Sessions are read/written through the database with several workers, so a buffered plan
+# can't be checked against the cursor in memory; prefetch is single-process only
+quiz_prefetch = QuizPrefetcher(
+    0 if MULTI_WORKER else PREFETCH_HOT_KEYS, PREFETCH_PER_KEY, PREFETCH_WORKERS, PREFETCH_RANK_INTERVAL
+)
+
+
+# ========================
+# QUIZ ANSWERS
+# ========================
+
+def topic_key(row: dict) -> tuple[str, str, str, str]:
+    # (board, exam, subject, topic), '' for missing levels as in topic_stats
+    return tuple(str(row.get(f) or "") for f in ("board", "exam", "subject", "topic"))
+
+
+class PollRegistry:
+    """poll_id -> (question_id, correct option index, topic key) for quiz polls we sent,
+    expiring after ttl.
+
+    When shared, new polls are also published to quiz_polls by flush(), so an answer that
+    reaches another worker process can be resolved there with lookup()."""
+
+    def __init__(self, ttl: float, maxsize: int, shared: bool = False):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.shared = shared
+        self._polls: OrderedDict[str, tuple] = OrderedDict()
+        self._pending: list[tuple] = []
+        self._lock = threading.Lock()
+        self._next_prune = 0.0
+        self.unknown = 0
+        self.remote = 0
+
+    def add(self, poll_id: str, question_id: int, correct_option_id: int, topic: tuple):
+        self._polls[poll_id] = (question_id, correct_option_id, topic, time.monotonic() + self.ttl)
+        self._expire()
+        if self.shared:
+            with self._lock:
+                self._pending.append((poll_id, question_id, correct_option_id, *topic))
+
+    def get(self, poll_id: str) -> tuple | None:
+        entry = self._polls.get(poll_id)
+        if entry is None or entry[-1] < time.monotonic():
+            if not self.shared:
+                self.unknown += 1
+            return None
+        return entry[:-1]
+
+    def lookup(self, poll_id: str) -> tuple | None:
+        with db_connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                "SELECT question_id, correct_option, board, exam, subject, topic FROM quiz_polls "
+                "WHERE poll_id = %s AND created_at > now() - make_interval(secs => %s)",
+                (poll_id, self.ttl),
+            )
+            row = cur.fetchone()
+            conn.commit()
+        if row is None:
+            self.unknown += 1
+            return None
+        self.remote += 1
+        return row[0], row[1], tuple(row[2:])
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending and time.monotonic() < self._next_prune:
+            return
+        try:
+            with db_connection() as conn, conn.cursor() as cur:
+                if pending:
+                    execute_values(
+                        cur,
+                        "INSERT INTO quiz_polls (poll_id, question_id, correct_option, board, exam, subject, topic) "
+                        "VALUES %s ON CONFLICT (poll_id) DO NOTHING",
+                        pending,
+                    )
+                if time.monotonic() >= self._next_prune:
+                    cur.execute(
+                        "DELETE FROM quiz_polls WHERE created_at < now() - make_interval(secs => %s)", (self.ttl,)
+                    )
+                    self._next_prune = time.monotonic() + 3600
+                conn.commit()
+        except Exception:
+            with self._lock:
+                self._pending[:0] = pending
+            raise
+
+    def _expire(self):
+        # insertion order == expiry order, so expired entries are always at the front
+        now = time.monotonic()
+        while self._polls:
+            poll_id, entry = next(iter(self._polls.items()))
+            if entry[-1] >= now and len(self._polls) <= self.maxsize:
+                return
+            del self._polls[poll_id]
+
+    def __len__(self):
+        return len(self._polls)
+
+
+class AnswerBuffer:
+    """Buffers poll answers and score deltas; flush() COPYs the answers and applies the deltas
+    to user_scores/question_stats/topic_stats with one UPSERT each, all in one transaction."""
+
+    def __init__(self):
+        self._answers: list[tuple] = []
+        self._user_deltas: dict[int, list[int]] = {}
+        self._question_deltas: dict[int, list[int]] = {}
+        self._topic_deltas: dict[tuple, list[int]] = {}
+        self._lock = threading.Lock()
+        self.flushing = False
+        self.received = 0
+        self.written = 0
+        self.flushes = 0
+
+    def add(self, user_id: int, question_id: int, topic: tuple, poll_id: str, option_id: int, correct: bool):
+        with self._lock:
+            self._answers.append((user_id, question_id, poll_id, option_id, correct, time.time()))
+            for deltas, key in (
+                (self._user_deltas, user_id),
+                (self._question_deltas, question_id),
+                (self._topic_deltas, topic),
+            ):
+                d = deltas.setdefault(key, [0, 0])
+                d[0] += 1
+                d[1] += correct
+            self.received += 1
+
+    def __len__(self):
+        return len(self._answers)
+
+    def flush(self):
+        with self._lock:
+            if not self._answers:
+                return
+            answers, self._answers = self._answers, []
+            user_deltas, self._user_deltas = self._user_deltas, {}
+            question_deltas, self._question_deltas = self._question_deltas, {}
+            topic_deltas, self._topic_deltas = self._topic_deltas, {}
+        try:
+            with db_connection() as conn, conn.cursor() as cur:
+                buf = io.StringIO()
+                writer = csv.writer(buf)
+                for user_id, question_id, poll_id, option_id, correct, ts in answers:
+                    writer.writerow((user_id, question_id, poll_id, option_id, "t" if correct else "f",
+                                     time.strftime("%Y-%m-%d %H:%M:%S+00", time.gmtime(ts))))
+                buf.seek(0)
+                cur.copy_expert(
+                    "COPY quiz_answers (user_id, question_id, poll_id, option_id, is_correct, answered_at) "
+                    "FROM STDIN WITH (FORMAT csv)",
+                    buf,
+                )
+                for table, key_cols, deltas in (
+                    ("user_scores", "user_id", user_deltas),
+                    ("question_stats", "question_id", question_deltas),
+                    ("topic_stats", "board, exam, subject, topic", topic_deltas),
+                ):
+                    if not deltas:
+                        continue
+                    execute_values(
+                        cur,
+                        f"INSERT INTO {table} ({key_cols}, answered, correct) VALUES %s "
+                        f"ON CONFLICT ({key_cols}) DO UPDATE SET "
+                        f"answered = {table}.answered + EXCLUDED.answered, "
+                        f"correct = {table}.correct + EXCLUDED.correct, updated_at = now()",
+                        # fixed order avoids deadlocks between concurrent flushes
+                        sorted((*(k if isinstance(k, tuple) else (k,)), a, c) for k, (a, c) in deltas.items()),
+                    )
+                conn.commit()
+        except Exception:
+            with self._lock:
+                self._answers[:0] = answers
+                for pending, failed in (
+                    (self._user_deltas, user_deltas),
+                    (self._question_deltas, question_deltas),
+                    (self._topic_deltas, topic_deltas),
+                ):
+                    for k, (a, c) in failed.items():
+                        d = pending.setdefault(k, [0, 0])
+                        d[0] += a
+                        d[1] += c
+            raise
+        with self._lock:
+            self.written += len(answers)
+            self.flushes += 1
+
+    def pending_stats(self) -> tuple[dict, dict]:
+        with self._lock:
+            return (
+                {k: tuple(d) for k, d in self._question_deltas.items()},
+                {k: tuple(d) for k, d in self._topic_deltas.items()},
+            )
+
+    def pending_score(self, user_id: int) -> tuple[int, int]:
+        with self._lock:
+            answered, correct = self._user_deltas.get(user_id, (0, 0))
+            return answered, correct
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "received": self.received,
+                "written": self.written,
+                "buffered": len(self._answers),
+                "flushes": self.flushes,
+            }
+
+
+class AnswerStats:
+    """Running answered/correct counters per question and per (board, exam, subject, topic).
+
+    Loaded from the summary tables at startup and bumped in O(1) per answer; the AnswerBuffer
+    flush is what checkpoints the same increments to question_stats/topic_stats."""
+
+    def __init__(self):
+        self.questions: dict[int, list[int]] = {}
+        self.topics: dict[tuple, list[int]] = {}
+        self._lock = threading.Lock()
+
+    def load(self, pending=None):
+        """Replace the counters with the summary tables; pending() returns the (question, topic)
+        deltas not yet flushed, which are added back so answers recorded since don't drop out."""
+        with db_connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT question_id, answered, correct FROM question_stats")
+            questions = {qid: [a, c] for qid, a, c in cur.fetchall()}
+            cur.execute("SELECT board, exam, subject, topic, answered, correct FROM topic_stats")
+            topics = {tuple(row[:4]): [row[4], row[5]] for row in cur.fetchall()}
+        with self._lock:
+            if pending is not None:
+                for counters, deltas in zip((questions, topics), pending()):
+                    for key, (answered, correct) in deltas.items():
+                        d = counters.setdefault(key, [0, 0])
+                        d[0] += answered
+                        d[1] += correct
+            self.questions, self.topics = questions, topics
+
+    def record(self, question_id: int, topic: tuple, correct: bool):
+        with self._lock:
+            for counters, key in ((self.questions, question_id), (self.topics, topic)):
+                d = counters.get(key)
+                if d is None:
+                    d = counters[key] = [0, 0]
+                d[0] += 1
+                d[1] += correct
+
+    def _ranked(self, counters: dict, n: int, min_answers: int, hardest: bool) -> list[tuple]:
+        with self._lock:
+            eligible = [(k, a, c) for k, (a, c) in counters.items() if a >= min_answers]
+        rank = (lambda e: e[2] / e[1]) if hardest else (lambda e: -e[2] / e[1])
+        return heapq.nsmallest(n, eligible, key=rank)
+
+    def hardest_questions(self, n: int = 10, min_answers: int = STATS_MIN_ANSWERS) -> list[tuple]:
+        return self._ranked(self.questions, n, min_answers, hardest=True)
+
+    def topic_leaderboard(self, n: int = 10, min_answers: int = STATS_MIN_ANSWERS, hardest: bool = True):
+        return self._ranked(self.topics, n, min_answers, hardest)
+
+
+def refresh_answer_stats():
+    # multi-worker: pick up answers counted by the other processes
+    answer_buffer.flush()
+    answer_stats.load(pending=answer_buffer.pending_stats)
+
+
+poll_registry = PollRegistry(POLL_TTL, POLL_MAP_SIZE, shared=MULTI_WORKER)
+answer_buffer = AnswerBuffer()
+answer_stats = AnswerStats()
+
+
+def get_user_score(user_id: int) -> tuple[int, int]:
+    with db_connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT answered, correct FROM user_scores WHERE user_id = %s", (user_id,))
+        row = cur.fetchone() or (0, 0)
+    answered, correct = answer_buffer.pending_score(user_id)
+    return row[0] + answered, row[1] + correct
+
+
+# ========================
+# QUESTION VALIDATION & BULK IMPORT
+# ========================
+
+QUESTION_COLUMNS = (
+    "board", "year", "exam", "subject", "topic", "subtopic",
+    "question_text", "option1", "option2", "option3", "option4",
+    "correct_option", "explanation",
+)
+REQUIRED_TEXT_COLUMNS = ("question_text", "option1", "option2", "option3", "option4")
+IMPORT_BATCH_SIZE = 1000
+
+
+def parse_year(text: str) -> int:
+    # 0 means "not applicable", as in the AddQuestion flow
+    try:
+        year = int(str(text).strip())
+    except ValueError:
+        raise ValueError("year must be a number (e.g. 2023 or 0)") from None
+    if not -2**31 <= year < 2**31:  # questions.year is INTEGER
+        raise ValueError("year is out of range")
+    return year
+
+
+def parse_correct_option(text: str) -> int:
+    text = str(text).strip()
+    if text not in {"1", "2", "3", "4"}:
+        raise ValueError("correct_option must be a number between 1 and 4")
+    return int(text)
+
+
+def optional_text(text: str | None) -> str:
+    # '-' means "skip", as in the AddQuestion flow
+    text = (text or "").strip()
+    return "" if text == "-" else text
+
+
+def validate_question_row(raw: dict) -> dict:
+    missing = [c for c in REQUIRED_TEXT_COLUMNS if not str(raw.get(c) or "").strip()]
+    if missing:
+        raise ValueError("missing " + ", ".join(missing))
+    row = {c: str(raw.get(c) or "").strip() for c in ("board", "exam", "subject", "topic")}
+    row.update({c: str(raw[c]).strip() for c in REQUIRED_TEXT_COLUMNS})
+    row["year"] = parse_year(raw.get("year", ""))
+    row["subtopic"] = optional_text(raw.get("subtopic"))
+    row["correct_option"] = parse_correct_option(raw.get("correct_option", ""))
+    row["explanation"] = optional_text(raw.get("explanation"))
+    nul = [c for c, v in row.items() if isinstance(v, str) and "\x00" in v]
+    if nul:  # Postgres text cannot hold NUL
+        raise ValueError("NUL character in " + ", ".join(nul))
+    return row
+
+
+def iter_import_records(stream, fmt: str):
+    """Yield (line_no, record or None, error or None) from a CSV or JSONL text stream."""
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record, None
+    elif fmt == "jsonl":
+        for line_no, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield line_no, None, f"invalid JSON: {e.msg}"
+                continue
+            if not isinstance(record, dict):
+                yield line_no, None, "expected a JSON object"
+                continue
+            yield line_no, record, None
+    else:
+        raise ValueError(f"unknown import format {fmt!r}")
+
+
+def import_format_for(filename: str) -> str | None:
+    name = filename.lower()
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith((".jsonl", ".ndjson", ".json")):
+        return "jsonl"
+    return None
+
+
+def _insert_question_batch(cur, rows: list[dict]) -> list[dict]:
+    inserted = execute_values(
+        cur,
+        f"INSERT INTO questions ({', '.join(QUESTION_COLUMNS)}) VALUES %s "
+        f"RETURNING id, {', '.join(FILTER_FIELDS)}",
+        [tuple(row[c] for c in QUESTION_COLUMNS) for row in rows],
+        page_size=len(rows),
+        fetch=True,
+    )
+    # RETURNING rows come back in VALUES order
+    for new, row in zip(inserted, rows):
+        new["bands"] = row["bands"]
+    store_minhash(cur, [(new["id"], new["bands"]) for new in inserted])
+    question_sync.note(new["id"] for new in inserted)  # before the import commits
+    return inserted
+
+
+def import_duplicate(cur, shingles: set[int], bands: list[int], file_buckets: dict) -> str | None:
+    # file_buckets: band key -> [(line_no, shingles)] of this file's rows accepted so far. Stored
+    # candidates are read on the import's own cursor: a second pool connection per row could
+    # time out while the import holds one
+    matches = find_near_duplicates(shingles, bands, limit=1, cur=cur)
+    if matches:
+        similarity, q = matches[0]
+        return f"near-duplicate of question #{q['id']} ({similarity:.0%} similar)"
+    for key in bands:
+        for line_no, other in file_buckets.get(key, ()):
+            similarity = jaccard(shingles, other)
+            if similarity >= DEDUP_THRESHOLD:
+                return f"near-duplicate of line {line_no} ({similarity:.0%} similar)"
+    return None
+
+
+def import_questions(stream, fmt: str, batch_size: int = IMPORT_BATCH_SIZE, dedupe: bool = True) -> dict:
+    """Validate and load every row in one transaction; bad rows are reported, not loaded.
+
+    With dedupe, rows nearly identical to a stored question or an earlier row of the file are
+    skipped and reported as duplicates."""
+    started = time.monotonic()
+    errors: list[tuple[int, str]] = []
+    duplicates: list[tuple[int, str]] = []
+    file_buckets: dict[int, list[tuple[int, set[int]]]] = {}
+    inserted: list[dict] = []
+    batch: list[dict] = []
+    with db_connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        for line_no, record, error in iter_import_records(stream, fmt):
+            row = None
+            if error is None:
+                try:
+                    row = validate_question_row(record)
+                except ValueError as e:
+                    error = str(e)
+            if error is not None:
+                errors.append((line_no, error))
+            if row is not None:
+                shingles = question_shingles(row)
+                row["bands"] = minhash_bands(shingles)
+                duplicate = import_duplicate(cur, shingles, row["bands"], file_buckets) if dedupe else None
+                if duplicate is not None:
+                    duplicates.append((line_no, duplicate))
+                else:
+                    batch.append(row)
+                    if dedupe:
+                        for key in row["bands"]:
+                            file_buckets.setdefault(key, []).append((line_no, shingles))
+            if len(batch) >= batch_size:
+                inserted.extend(_insert_question_batch(cur, batch))
+                batch = []
+        if batch:
+            inserted.extend(_insert_question_batch(cur, batch))
         conn.commit()
-        return new_id
+    on_questions_inserted([dict(row) for row in inserted])
+    elapsed = time.monotonic() - started
+    return {
+        "inserted": len(inserted),
+        "errors": errors,
+        "duplicates": duplicates,
+        "seconds": elapsed,
+        "rows_per_second": len(inserted) / elapsed if elapsed else 0.0,
+    }
+
+
+def format_import_report(report: dict, max_errors: int = 20) -> str:
+    lines = [
+        f"Inserted {report['inserted']} questions in {report['seconds']:.2f}s "
+        f"({report['rows_per_second']:.0f} rows/s), {len(report['errors'])} rows rejected, "
+        f"{len(report['duplicates'])} near-duplicates skipped."
+    ]
+    for problems in (report["errors"], report["duplicates"]):
+        for line_no, problem in problems[:max_errors]:
+            lines.append(f"line {line_no}: {problem}")
+        if len(problems) > max_errors:
+            lines.append(f"... and {len(problems) - max_errors} more")
+    return "\n".join(lines)
+
+
+def import_cli(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(prog="bot.py import", description="Bulk-load questions from CSV or JSONL.")
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="default: from the file extension")
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+    parser.add_argument("--keep-duplicates", action="store_true", help="load near-duplicate rows too")
+    args = parser.parse_args(argv)
+
+    fmt = args.format or import_format_for(args.path)
+    if fmt is None:
+        parser.error("cannot tell the format from the file name; pass --format")
+    init_db_pool()
+    init_db()
+    if not args.keep_duplicates:
+        backfill_minhash()
+        near_duplicates.load()
+    with open(args.path, encoding="utf-8-sig", newline="") as f:
+        report = import_questions(f, fmt, args.batch_size, dedupe=not args.keep_duplicates)
+    close_db_pool()
+    print(format_import_report(report, max_errors=max(len(report["errors"]), len(report["duplicates"]))))
+    return 1 if report["errors"] else 0
 
 
 # ========================
 # FSM FOR ADMIN ADD QUESTION
 # ========================
 
+class ImportQuestions(StatesGroup):
+    waiting_file = State()
+
+
 class AddQuestion(StatesGroup):
     waiting_board = State()
     waiting_year = State()
@@ -236,12 +2593,176 @@ class AddQuestion(StatesGroup):
     waiting_confirm = State()
 
 
+# ========================
+# FSM STORAGE
+# ========================
+
+# Storage rows touched by the update being handled; see fsm_batch_middleware
+fsm_batch: contextvars.ContextVar[dict | None] = contextvars.ContextVar("fsm_batch", default=None)
+# Outbound sends held back until the update's FSM changes are stored; see fsm_commit
+fsm_held_sends: contextvars.ContextVar[list | None] = contextvars.ContextVar("fsm_held_sends", default=None)
+
+
+class PostgresStorage(BaseStorage):
+    """FSM state and data in one fsm_states row per key, shared by every worker process.
+
+    Within an update the row is read once (state and data together) and all writes are
+    coalesced into a single UPSERT, or DELETE once the state is cleared, after the handler."""
+
+    def __init__(self):
+        self.reads = 0
+        self.writes = 0
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        parts = (key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny)
+        return ":".join("" if p is None else str(p) for p in parts)
+
+    def _read(self, skey: str) -> list:
+        self.reads += 1
+        with db_connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT state, data FROM fsm_states WHERE key = %s", (skey,))
+            row = cur.fetchone()
+            conn.commit()
+        return [row[0], row[1]] if row else [None, {}]
+
+    def write(self, entries: list[tuple[str, str | None, dict]]):
+        self.writes += 1
+        upserts = [(k, st, json.dumps(d)) for k, st, d in entries if st is not None or d]
+        deletes = [k for k, st, d in entries if st is None and not d]
+        with db_connection() as conn, conn.cursor() as cur:
+            if upserts:
+                execute_values(
+                    cur,
+                    "INSERT INTO fsm_states (key, state, data) VALUES %s "
+                    "ON CONFLICT (key) DO UPDATE SET "
+                    "state = EXCLUDED.state, data = EXCLUDED.data, updated_at = now()",
+                    upserts,
+                    template="(%s, %s, %s::jsonb)",
+                )
+            if deletes:
+                cur.execute("DELETE FROM fsm_states WHERE key = ANY(%s)", (deletes,))
+            conn.commit()
+
+    async def _entry(self, key: StorageKey) -> list:
+        # [state, data, dirty]
+        skey = self._key(key)
+        batch = fsm_batch.get()
+        if batch is not None and skey in batch:
+            return batch[skey]
+        entry = await run_db(self._read, skey) + [False]
+        if batch is not None:
+            batch[skey] = entry
+        return entry
+
+    async def _changed(self, key: StorageKey, entry: list):
+        if fsm_batch.get() is None:
+            await run_db(self.write, [(self._key(key), entry[0], entry[1])])
+        else:
+            entry[2] = True
+            if fsm_held_sends.get() is None:
+                fsm_held_sends.set([])
+
+    async def set_state(self, key: StorageKey, state=None) -> None:
+        entry = await self._entry(key)
+        entry[0] = state.state if isinstance(state, State) else state
+        await self._changed(key, entry)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        return (await self._entry(key))[0]
+
+    async def set_data(self, key: StorageKey, data: dict) -> None:
+        entry = await self._entry(key)
+        entry[1] = dict(data)
+        await self._changed(key, entry)
+
+    async def get_data(self, key: StorageKey) -> dict:
+        return dict((await self._entry(key))[1])
+
+    async def update_data(self, key: StorageKey, data: dict) -> dict:
+        entry = await self._entry(key)
+        entry[1] = {**entry[1], **data}
+        await self._changed(key, entry)
+        return dict(entry[1])
+
+    async def flush(self, batch: dict):
+        dirty = [(skey, entry[0], entry[1]) for skey, entry in batch.items() if entry[2]]
+        if dirty:
+            await run_db(self.write, dirty)
+            for entry in batch.values():
+                entry[2] = False
+
+    async def close(self) -> None:
+        pass
+
+
+def make_fsm_storage() -> BaseStorage:
+    if FSM_STORAGE == "postgres":
+        return PostgresStorage()
+    if FSM_STORAGE == "redis":
+        from aiogram.fsm.storage.redis import RedisStorage  # needs the optional redis package
+
+        return RedisStorage.from_url(REDIS_URL)
+    if FSM_STORAGE == "memory":
+        return MemoryStorage()
+    raise ValueError(f"Unknown FSM_STORAGE {FSM_STORAGE!r}")
+
+
+async def fsm_commit():
+    """Store the update's FSM changes now, then release the replies held back until they were.
+
+    A reply that went out first could bring the user's next message before the new state is
+    stored, and that message would be routed with the old one. Called after every update;
+    handlers that keep working after changing state call it early."""
+    batch = fsm_batch.get()
+    if batch and isinstance(fsm_storage, PostgresStorage):
+        await fsm_storage.flush(batch)
+    held = fsm_held_sends.get()
+    if held:
+        fsm_held_sends.set(None)
+        for methods, kind, on_sent in held:
+            await outbound.send(*methods, kind=kind, on_sent=on_sent)
+
+
+async def fsm_batch_middleware(handler, event, data):
+    batch_token = fsm_batch.set({})
+    held_token = fsm_held_sends.set(None)
+    try:
+        return await handler(event, data)
+    finally:
+        try:
+            await fsm_commit()
+        finally:
+            fsm_held_sends.reset(held_token)
+            fsm_batch.reset(batch_token)
+
+
+async def fsm_context_middleware(handler, event, data):
+    # Only admins enter FSM flows, so other users and poll answers skip the state lookup (a
+    # storage read per update); their context still works if a handler touches it
+    user = data.get("event_from_user")
+    if event.poll_answer is None and user is not None and user.id in ADMIN_IDS:
+        return await dp.fsm(handler, event, data)
+    data["fsm_storage"] = fsm_storage
+    context = dp.fsm.resolve_event_context(data["bot"], data)
+    if context is not None:
+        data.update(state=context, raw_state=None)
+    return await handler(event, data)
+
+
 # ========================
 # KEYBOARDS
 # ========================
 
-def main_menu_kb(user_id: int) -> InlineKeyboardMarkup:
-    filters = get_or_create_user_filters(user_id)
+# Main menu keyboards per filter tuple; shared read-only between users with the same filters
+main_menu_cache = LRUCache(MAIN_MENU_CACHE_SIZE)
+
+
+def render_main_menu(key: tuple) -> InlineKeyboardMarkup:
+    kb = main_menu_cache.get(key)
+    if kb is not None:
+        return kb
+    filters = dict(zip(FILTER_FIELDS, key))
 
     def val_or_dash(v):
         return v if v else "All"
@@ -263,25 +2784,142 @@ def main_menu_kb(user_id: int) -> InlineKeyboardMarkup:
         [InlineKeyboardButton(text="🎯 Generate quiz", callback_data="generate_quiz")],
         [InlineKeyboardButton(text="♻️ Reset filters", callback_data="reset_filters")],
     ]
-    return InlineKeyboardMarkup(inline_keyboard=kb)
+    markup = InlineKeyboardMarkup(inline_keyboard=kb)
+    main_menu_cache.set(key, markup)
+    return markup
+
+
+async def main_menu_kb(user_id: int) -> InlineKeyboardMarkup:
+    filters = await run_user_filters(get_or_create_user_filters, user_id)
+    return render_main_menu(filter_key(filters))
+
 
-def values_list_kb(prefix: str, values: list[str]) -> InlineKeyboardMarkup:
+FIELD_LABELS = {
+    "board": "Board",
+    "year": "Year",
+    "exam": "Exam",
+    "subject": "Subject",
+    "topic": "Topic",
+    "subtopic": "Subtopic",
+}
+
+
+def values_list_kb(
+    field: str, values: list[tuple[str, int]], has_prev: bool = False, has_next: bool = False
+) -> InlineKeyboardMarkup:
     rows = []
-    for v in values:
+    for v, count in values:
         rows.append(
             [
                 InlineKeyboardButton(
-                    text=v,
-                    callback_data=f"{prefix}:{v}",
+                    text=f"{v} ({count})",
+                    callback_data=f"set_{field}:{value_index.id_for(field, v)}",
                 )
             ]
         )
+    nav = []
+    if has_prev:
+        first = value_index.id_for(field, values[0][0])
+        nav.append(InlineKeyboardButton(text="◀️ Prev", callback_data=f"page_{field}:p:{first}"))
+    if has_next:
+        last = value_index.id_for(field, values[-1][0])
+        nav.append(InlineKeyboardButton(text="Next ▶️", callback_data=f"page_{field}:n:{last}"))
+    if nav:
+        rows.append(nav)
     rows.append(
         [InlineKeyboardButton(text="🔙 Back", callback_data="back_to_main")]
     )
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
 
+def facet_page_kb(
+    field: str, filters: dict | None = None, cursor: str | None = None, direction: str = "n"
+) -> InlineKeyboardMarkup | None:
+    # None when there is nothing to choose from
+    cache_key = (field, filter_key(filters, exclude=field), cursor, direction)
+    kb = facet_page_cache.get(cache_key)
+    if kb is None:
+        values, has_prev, has_next = get_facet_page(field, filters, cursor, direction)
+        if not values:
+            return None
+        kb = values_list_kb(field, values, has_prev, has_next)
+        facet_page_cache.set(cache_key, kb)
+    return kb
+
+
+async def callback_value(cb: CallbackQuery, field: str) -> str | None:
+    # set_<field>:<value id> -> filter value; answers the callback itself when the id is unknown
+    vid = cb.data.split(":", 1)[1]
+    value = value_index.value_for(field, vid)
+    if value is None:
+        value = await run_db(value_index.resolve, field, vid)
+    if value is None:
+        await cb.answer("This menu is out of date. Please open it again.", show_alert=True)
+    return value
+
+
+# ========================
+# DUPLICATE UPDATES
+# ========================
+
+class RecentUpdates:
+    """update_ids seen in the last `ttl` seconds (at most maxsize), to drop webhook retries."""
+
+    def __init__(self, ttl: float, maxsize: int):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._seen: OrderedDict[int, float] = OrderedDict()
+        self.duplicates = 0
+
+    def check(self, update_id: int) -> bool:
+        """True the first time an update_id is seen, False for a repeat."""
+        now = time.monotonic()
+        expires = self._seen.get(update_id)
+        if expires is not None and expires >= now:
+            self.duplicates += 1
+            return False
+        self._seen[update_id] = now + self.ttl
+        self._seen.move_to_end(update_id)
+        # insertion order == expiry order
+        while self._seen:
+            oldest, expires = next(iter(self._seen.items()))
+            if expires >= now and len(self._seen) <= self.maxsize:
+                break
+            del self._seen[oldest]
+        return True
+
+
+class InFlight:
+    """(user_id, action) pairs being processed, so a double tap doesn't run an expensive action twice."""
+
+    def __init__(self):
+        self._keys: set = set()
+        self.suppressed = 0
+
+    def acquire(self, key) -> bool:
+        if key in self._keys:
+            self.suppressed += 1
+            return False
+        self._keys.add(key)
+        return True
+
+    def release(self, key):
+        self._keys.discard(key)
+
+
+recent_updates = RecentUpdates(UPDATE_DEDUP_TTL, UPDATE_DEDUP_SIZE)
+in_flight = InFlight()
+
+
+async def dedup_middleware(handler, event, data):
+    # Telegram re-delivers an update when the webhook call failed or timed out; the retry
+    # gets its 200 like any other update but is not handled again
+    if not recent_updates.check(event.update_id):
+        updates_suppressed.inc("duplicate_update")
+        return None
+    return await handler(event, data)
+
+
 # ========================
 # BOT & DISPATCHER
 # ========================
@@ -291,9 +2929,566 @@ from aiogram.client.default import DefaultBotProperties
 
 bot = Bot(
     token=BOT_TOKEN,
-    default=DefaultBotProperties(parse_mode=ParseMode.HTML)
+    default=DefaultBotProperties(parse_mode=ParseMode.HTML),
+    session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None,
 )
-dp = Dispatcher()
+fsm_storage = make_fsm_storage()
+dp = Dispatcher(storage=fsm_storage, disable_fsm=True)
+dp.update.outer_middleware(dedup_middleware)
+# registered ourselves so the batch wraps the state lookup done by the FSM middleware too
+dp.update.outer_middleware(fsm_batch_middleware)
+dp.update.outer_middleware(fsm_context_middleware)
+
+
+async def handler_metrics_middleware(handler, event, data):
+    name = data["handler"].callback.__name__
+    started = time.perf_counter()
+    try:
+        return await handler(event, data)
+    except Exception as e:
+        handler_errors.inc(name, type(e).__name__)
+        raise
+    finally:
+        handler_seconds.observe(time.perf_counter() - started, name)
+
+
+for observer in (dp.message, dp.callback_query, dp.poll_answer):
+    observer.middleware(handler_metrics_middleware)
+
+
+async def telegram_metrics_middleware(make_request, bot, method):
+    name = method.__api_method__
+    started = time.perf_counter()
+    try:
+        return await make_request(bot, method)
+    except Exception as e:
+        telegram_errors.inc(name, type(e).__name__)
+        raise
+    finally:
+        telegram_seconds.observe(time.perf_counter() - started, name)
+
+
+bot.session.middleware(telegram_metrics_middleware)
+
+
+# ========================
+# TELEGRAM DELIVERY
+# ========================
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    @property
+    def full(self) -> bool:
+        return self.tokens + (time.monotonic() - self.updated) * self.rate >= self.capacity
+
+
+class RateLimiter:
+    """Global bucket plus one bucket per chat; idle chat buckets are dropped LRU-first.
+
+    Only a bucket that has refilled is dropped, since a fresh one behaves the same; a chat still
+    paying off recent sends (a broadcast recipient, say) keeps its bucket past max_chats."""
+
+    def __init__(self, global_rate: float, chat_rate: float, chat_burst: int, max_chats: int = 10000):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_chats = max_chats
+        self._chats: OrderedDict[int, TokenBucket] = OrderedDict()
+
+    async def acquire(self, chat_id: int):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+            while len(self._chats) > self.max_chats and next(iter(self._chats.values())).full:
+                self._chats.popitem(last=False)
+        self._chats.move_to_end(chat_id)
+        await bucket.acquire()
+        await self.global_bucket.acquire()
+
+
+rate_limiter = RateLimiter(TG_GLOBAL_RATE, TG_CHAT_RATE, TG_CHAT_BURST)
+send_stats = {"sent": 0, "retries": 0, "failed": 0}
+
+
+async def send_limited(chat_id: int, method):
+    # method: an unawaited aiogram call such as message.answer_poll(...); safe to await again on retry
+    for attempt in range(TG_MAX_RETRIES + 1):
+        await rate_limiter.acquire(chat_id)
+        try:
+            result = await bot(method)
+        except TelegramRetryAfter as e:
+            if attempt == TG_MAX_RETRIES:
+                send_stats["failed"] += 1
+                raise
+            send_stats["retries"] += 1
+            logging.warning("Flood limit for chat %s, retrying in %ss", chat_id, e.retry_after)
+            await asyncio.sleep(e.retry_after)
+            continue
+        except TelegramAPIError:
+            send_stats["failed"] += 1
+            raise
+        send_stats["sent"] += 1
+        return result
+
+
+class OutboundQueue:
+    """Outgoing messages, sent by a pool of worker tasks after the webhook handler has returned.
+
+    Handlers enqueue unawaited aiogram calls with send(); calls enqueued together form a batch
+    that is sent in order. Batches for one chat keep their order, different chats are served
+    in parallel, and send() waits once max_pending batches are queued (backpressure)."""
+
+    def __init__(self, workers: int, max_pending: int, latency_window: int = 1000):
+        self.workers = workers
+        self._slots = asyncio.Semaphore(max_pending)
+        self._chats: dict[int, deque] = {}
+        self._ready: asyncio.Queue[int] = asyncio.Queue()
+        self._tasks: list[asyncio.Task] = []
+        self._closed = False
+        self.max_pending = max_pending
+        self.pending = 0
+        self.sent_batches = 0
+        self.failed_batches = 0
+        self.wait_times: deque[float] = deque(maxlen=latency_window)
+        self.latencies: dict[str, deque[float]] = {}
+
+    def start(self):
+        self._closed = False
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def send(self, *methods, kind: str = "message", on_sent=None):
+        # on_sent(index, result) is called after each method in the batch succeeds
+        if not methods:
+            return
+        if self._closed:
+            raise RuntimeError("outbound queue is closed")
+        held = fsm_held_sends.get()
+        if held is not None:
+            held.append((methods, kind, on_sent))
+            return
+        await self._slots.acquire()
+        chat_id = methods[0].chat_id
+        self.pending += 1
+        batch = (time.monotonic(), kind, methods, on_sent)
+        if chat_id in self._chats:
+            self._chats[chat_id].append(batch)  # a worker already owns this chat
+        else:
+            self._chats[chat_id] = deque([batch])
+            self._ready.put_nowait(chat_id)
+
+    async def _worker(self):
+        while True:
+            chat_id = await self._ready.get()
+            batches = self._chats[chat_id]
+            enqueued, kind, methods, on_sent = batches.popleft()
+            started = time.monotonic()
+            try:
+                for i, method in enumerate(methods):
+                    result = await send_limited(chat_id, method)
+                    if on_sent is not None:
+                        on_sent(i, result)
+            except TelegramAPIError:
+                self.failed_batches += 1
+                logging.exception("Sending %s to chat %s failed", kind, chat_id)
+            except Exception:
+                self.failed_batches += 1
+                logging.exception("Unexpected error sending %s to chat %s", kind, chat_id)
+            else:
+                self.sent_batches += 1
+                self.wait_times.append(started - enqueued)
+                self.latencies.setdefault(kind, deque(maxlen=self.wait_times.maxlen)).append(
+                    time.monotonic() - enqueued
+                )
+            finally:
+                self.pending -= 1
+                self._slots.release()
+                if batches:
+                    self._ready.put_nowait(chat_id)  # back of the line, after other chats
+                else:
+                    del self._chats[chat_id]
+
+    async def close(self, timeout: float):
+        self._closed = True
+        deadline = time.monotonic() + timeout
+        while self.pending and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self.pending:
+            logging.warning("Dropping %s unsent outbound batches", self.pending)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    @staticmethod
+    def _percentile(values, p: float) -> float:
+        values = sorted(values)
+        return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+    def stats(self) -> dict:
+        st = {
+            "depth": self.pending,
+            "max_pending": self.max_pending,
+            "active_chats": len(self._chats),
+            "sent_batches": self.sent_batches,
+            "failed_batches": self.failed_batches,
+            "wait_p50_s": self._percentile(self.wait_times, 0.5),
+            "wait_p99_s": self._percentile(self.wait_times, 0.99),
+        }
+        for kind, values in self.latencies.items():
+            st[f"{kind}_latency_p50_s"] = self._percentile(values, 0.5)
+            st[f"{kind}_latency_p99_s"] = self._percentile(values, 0.99)
+        return st
+
+
+outbound = OutboundQueue(OUTBOUND_WORKERS, OUTBOUND_MAX_PENDING)
+
+
+# ========================
+# BROADCAST
+# ========================
+
+def create_broadcast(admin_id: int) -> dict | None:
+    # None while another broadcast is running or paused
+    with db_connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(
+            "INSERT INTO broadcasts (created_by) VALUES (%s) ON CONFLICT DO NOTHING RETURNING *",
+            (admin_id,),
+        )
+        row = cur.fetchone()
+        conn.commit()
+    return row
+
+
+def claim_broadcast(statuses: tuple[str, ...]) -> dict | None:
+    # Take over the active broadcast unless another process holds an unexpired lease on it
+    with db_connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(
+            """
+            UPDATE broadcasts
+            SET status = 'running', lease_until = now() + make_interval(secs => %s), updated_at = now()
+            WHERE status = ANY(%s) AND (lease_until IS NULL OR lease_until < now())
+            RETURNING *
+            """,
+            (BROADCAST_LEASE, list(statuses)),
+        )
+        row = cur.fetchone()
+        conn.commit()
+    return row
+
+
+def renew_broadcast(broadcast_id: int, lease_until: datetime) -> datetime | None:
+    # The lease_until this process last set doubles as its fencing token: None once another
+    # process has claimed the broadcast
+    with db_connection() as conn, conn.cursor() as cur:
+        cur.execute(
+            "UPDATE broadcasts SET lease_until = now() + make_interval(secs => %s) "
+            "WHERE id = %s AND lease_until = %s RETURNING lease_until",
+            (BROADCAST_LEASE, broadcast_id, lease_until),
+        )
+        row = cur.fetchone()
+        conn.commit()
+    return row[0] if row else None
+
+
+def checkpoint_broadcast(
+    broadcast_id: int,
+    lease_until: datetime,
+    last_user_id: int,
+    counts: dict,
+    new_picks: dict[tuple, dict | None],
+    done: bool,
+) -> tuple[str, datetime | None] | None:
+    # Record a delivered chunk and renew the lease; returns (status, lease_until), the status being
+    # one /broadcast stop may have changed, or None if the lease was lost
+    picks = {json.dumps(key): q["id"] if q else None for key, q in new_picks.items()}
+    with db_connection() as conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            UPDATE broadcasts SET
+                last_user_id = %s,
+                picks = picks || %s::jsonb,
+                sent = sent + %s,
+                failed = failed + %s,
+                skipped = skipped + %s,
+                status = CASE WHEN %s AND status = 'running' THEN 'done' ELSE status END,
+                finished_at = CASE WHEN %s AND status = 'running' THEN now() ELSE finished_at END,
+                lease_until = CASE
+                    WHEN status = 'running' AND NOT %s THEN now() + make_interval(secs => %s)
+                END,
+                updated_at = now()
+            WHERE id = %s AND lease_until = %s
+            RETURNING status, lease_until
+            """,
+            (
+                last_user_id, json.dumps(picks), counts["sent"], counts["failed"], counts["skipped"],
+                done, done, done, BROADCAST_LEASE, broadcast_id, lease_until,
+            ),
+        )
+        row = cur.fetchone()
+        conn.commit()
+    return tuple(row) if row else None
+
+
+def release_broadcast(broadcast_id: int, lease_until: datetime):
+    with db_connection() as conn, conn.cursor() as cur:
+        cur.execute(
+            "UPDATE broadcasts SET lease_until = NULL WHERE id = %s AND lease_until = %s",
+            (broadcast_id, lease_until),
+        )
+        conn.commit()
+
+
+def pause_broadcast() -> dict | None:
+    with db_connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(
+            "UPDATE broadcasts SET status = 'paused', updated_at = now() WHERE status = 'running' RETURNING *"
+        )
+        row = cur.fetchone()
+        conn.commit()
+    return row
+
+
+def latest_broadcast() -> dict | None:
+    with db_connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("SELECT * FROM broadcasts ORDER BY id DESC LIMIT 1")
+        return cur.fetchone()
+
+
+def open_recipient_cursor(after_user_id: int):
+    # Own connection, not a pool slot: it lives as long as the broadcast. WITH HOLD materialises
+    # the result at commit, so no transaction (or snapshot) stays open while messages go out.
+    conn = psycopg2.connect(DB_URL, connection_factory=TimedConnection)
+    cur = conn.cursor(name="broadcast_recipients", withhold=True)
+    cur.execute(
+        "SELECT user_id, board, year, exam, subject, topic, subtopic FROM user_filters "
+        "WHERE user_id > %s ORDER BY user_id",
+        (after_user_id,),
+    )
+    conn.commit()
+    return conn, cur
+
+
+def fetch_recipients(cur, n: int) -> list[tuple]:
+    return cur.fetchmany(n)
+
+
+def close_recipient_cursor(conn, cur):
+    try:
+        cur.close()
+    finally:
+        conn.close()
+
+
+def load_broadcast_picks(stored: dict) -> dict[tuple, dict | None]:
+    # Questions chosen before a pause or restart, so every group keeps its question of the day
+    rows = {q["id"]: q for q in get_questions_by_ids([qid for qid in stored.values() if qid])}
+    return {tuple(json.loads(key)): rows.get(qid) for key, qid in stored.items()}
+
+
+def pick_broadcast_questions(keys: list[tuple]) -> dict[tuple, dict | None]:
+    # One sampled question per filter tuple; None when nothing matches
+    picks = {}
+    for key in keys:
+        rows = get_questions_for_filters(dict(zip(FILTER_FIELDS, key)), 1)
+        picks[key] = rows[0] if rows else None
+    return picks
+
+
+class Broadcaster:
+    """Question of the day for everyone in user_filters.
+
+    One broadcast is active at a time and one process runs it, holding a lease that a heartbeat
+    renews while it runs; the watcher in each process takes over a running broadcast whose lease
+    has expired, and a run that finds its lease taken stops. Recipients stream from a server-side
+    cursor in user_id order, `chunk` at a time.
+    Users with identical filters share one sampled question for the whole broadcast. A chunk is
+    spread over shard tasks by user_id, paced by the broadcast bucket on top of the global and
+    per-chat limits, and checkpointed once delivered, so a restart re-sends at most one chunk."""
+
+    def __init__(self, rate: float, shards: int, chunk: int, lease: float):
+        self.bucket = TokenBucket(rate, rate)
+        self.shards = shards
+        self.chunk = chunk
+        self.lease = lease
+        self.current: dict | None = None
+        self._lease_until: datetime | None = None
+        self._lease_lock = asyncio.Lock()
+        self._queues: list[asyncio.Queue] = []
+        self._task: asyncio.Task | None = None
+        self._watcher: asyncio.Task | None = None
+        self.started_at = 0.0
+        # this process's part of the current broadcast
+        self.sent = 0
+        self.failed = 0
+        self.skipped = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        self._watcher = asyncio.create_task(self._watch())
+
+    async def close(self):
+        tasks = [t for t in (self._watcher, self._task) if t is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._watcher = self._task = None
+        if self.current is not None and self._lease_until is not None:
+            try:
+                # let a restart resume right away
+                await run_db(release_broadcast, self.current["id"], self._lease_until)
+            except Exception:
+                logging.exception("Releasing broadcast %s failed", self.current["id"])
+
+    async def claim(self, statuses: tuple[str, ...]) -> dict | None:
+        if self.running:
+            return None
+        row = await run_db(claim_broadcast, statuses)
+        if row is not None:
+            self.current = row
+            self._lease_until = row["lease_until"]
+            self.sent = self.failed = self.skipped = 0
+            self.started_at = time.monotonic()
+            self._task = asyncio.create_task(self._run(row))
+        return row
+
+    async def _watch(self):
+        while True:
+            try:
+                row = await self.claim(("running",))
+                if row is not None:
+                    logging.info("Resuming broadcast %s after user %s", row["id"], row["last_user_id"])
+            except Exception:
+                logging.exception("Checking for an abandoned broadcast failed")
+            await asyncio.sleep(self.lease / 2)
+
+    async def _heartbeat(self, row: dict):
+        # a chunk paced by the buckets, or stalled by RetryAfter, can outlast the lease
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            async with self._lease_lock:
+                if self._lease_until is None:
+                    return
+                try:
+                    self._lease_until = await run_db(renew_broadcast, row["id"], self._lease_until)
+                except Exception:
+                    logging.exception("Renewing the lease on broadcast %s failed", row["id"])
+                    continue
+            if self._lease_until is None:
+                logging.warning("Broadcast %s was taken over by another process, stopping", row["id"])
+                self._task.cancel()
+                return
+
+    async def _run(self, row: dict):
+        self._queues = [asyncio.Queue(maxsize=self.chunk) for _ in range(self.shards)]
+        shards = [asyncio.create_task(self._shard(q)) for q in self._queues]
+        heartbeat = asyncio.create_task(self._heartbeat(row))
+        last_user_id = row["last_user_id"]
+        conn = cur = None
+        try:
+            picks = await run_db(load_broadcast_picks, row["picks"])
+            conn, cur = await run_db(open_recipient_cursor, last_user_id)
+            while True:
+                recipients = await run_db(fetch_recipients, cur, self.chunk)
+                groups: dict[tuple, list[int]] = {}
+                for user_id, *values in recipients:
+                    groups.setdefault(filter_key(dict(zip(FILTER_FIELDS, values))), []).append(user_id)
+                new_keys = [key for key in groups if key not in picks]
+                new_picks = await run_db(pick_broadcast_questions, new_keys) if new_keys else {}
+                picks.update(new_picks)
+
+                counts = {"sent": 0, "failed": 0, "skipped": 0}
+                for key, user_ids in groups.items():
+                    q = picks[key]
+                    if q is None:
+                        counts["skipped"] += len(user_ids)
+                        self.skipped += len(user_ids)
+                        broadcast_messages.inc("skipped", amount=len(user_ids))
+                        continue
+                    poll = quiz_poll(q)
+                    for user_id in user_ids:
+                        await self._queues[user_id % self.shards].put((user_id, q, poll, counts))
+                for queue in self._queues:
+                    await queue.join()
+
+                if recipients:
+                    last_user_id = recipients[-1][0]
+                done = len(recipients) < self.chunk
+                async with self._lease_lock:
+                    result = await run_db(
+                        checkpoint_broadcast, row["id"], self._lease_until, last_user_id, counts, new_picks, done
+                    )
+                    if result is None:
+                        self._lease_until = None
+                        logging.warning("Broadcast %s was taken over by another process, stopping", row["id"])
+                        break
+                    status, self._lease_until = result
+                if done or status != "running":
+                    logging.info("Broadcast %s %s after user %s", row["id"], status, last_user_id)
+                    break
+        except Exception:
+            # the lease runs out and a watcher resumes from the last checkpoint
+            logging.exception("Broadcast %s stopped after user %s", row["id"], last_user_id)
+        finally:
+            for task in (heartbeat, *shards):
+                task.cancel()
+            await asyncio.gather(heartbeat, *shards, return_exceptions=True)
+            if conn is not None:
+                await run_db(close_recipient_cursor, conn, cur)
+
+    async def _shard(self, queue: asyncio.Queue):
+        while True:
+            user_id, q, poll, counts = await queue.get()
+            try:
+                await self.bucket.acquire()
+                sent = await send_limited(user_id, SendPoll(chat_id=user_id, **poll))
+            except Exception as e:
+                counts["failed"] += 1
+                self.failed += 1
+                broadcast_messages.inc("failed")
+                broadcast_failures.inc(type(e).__name__)
+                if not isinstance(e, TelegramAPIError):  # blocked bot, deleted account, ...: expected
+                    logging.exception("Broadcast to %s failed", user_id)
+            else:
+                counts["sent"] += 1
+                self.sent += 1
+                broadcast_messages.inc("sent")
+                if sent.poll:
+                    poll_registry.add(sent.poll.id, q["id"], poll["correct_option_id"], topic_key(q))
+            finally:
+                queue.task_done()
+
+    def stats(self) -> dict:
+        elapsed = time.monotonic() - self.started_at if self.current else 0.0
+        return {
+            "running": int(self.running),
+            "broadcast_id": self.current["id"] if self.current else 0,
+            "sent": self.sent,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "queued": sum(q.qsize() for q in self._queues),
+            "rate_per_s": self.sent / elapsed if elapsed else 0.0,
+        }
+
+
+broadcaster = Broadcaster(BROADCAST_RATE, BROADCAST_SHARDS, BROADCAST_CHUNK, BROADCAST_LEASE)
 
 
 # ========================
@@ -302,24 +3497,189 @@ dp = Dispatcher()
 
 @dp.message(CommandStart())
 async def cmd_start(message: Message):
-    get_or_create_user_filters(message.from_user.id)
-    await message.answer(
+    await outbound.send(message.answer(
         "👋 Welcome!\n"
         "Use the buttons below to set filters and generate PYQ quizzes.",
-        reply_markup=main_menu_kb(message.from_user.id),
-    )
+        reply_markup=await main_menu_kb(message.from_user.id),
+    ))
 
 
 @dp.message(Command("admin"))
 async def cmd_admin(message: Message):
     if message.from_user.id not in ADMIN_IDS:
-        await message.answer("❌ You are not an admin.")
+        await outbound.send(message.answer("❌ You are not an admin."))
         return
-    await message.answer(
+    await outbound.send(message.answer(
         "👑 Admin panel:\n"
         "/addquestion – add new PYQ\n"
+        "/import – bulk-load questions from CSV/JSONL\n"
+        "/stats – runtime stats\n"
+        "/hardest – questions with the lowest correct rate\n"
+        "/topics – topic accuracy leaderboard\n"
+        "/broadcast – question of the day to every user (status | stop | resume)\n"
         "(you can extend with more commands later)"
+    ))
+
+
+def format_stats() -> str:
+    lines = [f"<b>Worker</b> pid {os.getpid()} ({WEB_WORKERS} worker processes)"]
+    lines.append(f"questions synced: {question_sync.synced}, rebuilds: {question_sync.rebuilds}")
+    if MULTI_WORKER:
+        lines.append(f"answers to other workers' polls: {poll_registry.remote}")
+    lines.append("\n<b>Telegram</b>")
+    lines.append(", ".join(f"{k}: {v}" for k, v in send_stats.items()))
+    for k, v in outbound.stats().items():
+        lines.append(f"{k}: {v:.2f}" if isinstance(v, float) else f"{k}: {v}")
+    st = answer_buffer.stats()
+    lines.append(
+        f"poll answers: {st['received']} received, {st['written']} written, {st['buffered']} buffered, "
+        f"{len(poll_registry)} open polls, {poll_registry.unknown} unknown"
     )
+    st = quiz_prefetch.stats()
+    lines.append(
+        f"quiz prefetch: {st['hits']} hits, {st['misses']} misses, {st['stale']} stale "
+        f"({st['hit_rate']:.0%}), {st['buffered']} buffered for {st['hot_keys']} hot filter sets"
+    )
+    if broadcaster.current is not None:
+        st = broadcaster.stats()
+        lines.append(
+            f"broadcast #{st['broadcast_id']}{' (running here)' if st['running'] else ''}: {st['sent']} sent, "
+            f"{st['failed']} failed, {st['skipped']} skipped, {st['rate_per_s']:.1f} msg/s"
+        )
+    lines.append(
+        f"suppressed: {recent_updates.duplicates} duplicate updates, {in_flight.suppressed} repeated quiz taps"
+    )
+    lines.append("\n<b>DB pool</b>")
+    if db_pool is not None:
+        for k, v in db_pool.stats().items():
+            lines.append(f"{k}: {v:.2f}" if isinstance(v, float) else f"{k}: {v}")
+    else:
+        lines.append("(not initialised)")
+    st = near_duplicates.stats()
+    lines.append(
+        f"near-duplicate index: {st['questions']} questions ({st['unmerged']} unmerged), "
+        f"{st['lookups']} lookups, {st['candidates_per_lookup']:.1f} candidates each"
+    )
+    if isinstance(fsm_storage, PostgresStorage):
+        lines.append(f"fsm: {fsm_storage.reads} reads, {fsm_storage.writes} writes")
+    lines.append("\n<b>Caches</b>")
+    for name, store in (("user filters", user_filter_store), ("quiz sessions", quiz_session_store)):
+        st = store.stats()
+        lines.append(
+            f"{name}: {st['size']}/{st['max']} entries, {st['dirty']} dirty, {st['hits']} hits, "
+            f"{st['misses']} misses, {st['rows_flushed']} rows in {st['flushes']} flushes"
+        )
+    for name, cache in (
+        ("question ids", question_id_cache),
+        ("facets", facet_cache),
+        ("menu pages", facet_page_cache),
+        ("main menus", main_menu_cache),
+    ):
+        st = cache.stats()
+        lines.append(f"{name}: {st['size']}/{st['max']} entries, {st['hits']} hits, {st['misses']} misses")
+    return "\n".join(lines)
+
+
+@dp.message(Command("stats"))
+async def cmd_stats(message: Message):
+    if message.from_user.id not in ADMIN_IDS:
+        await outbound.send(message.answer("❌ You are not an admin."))
+        return
+    await outbound.send(message.answer(format_stats()))
+
+
+def format_hardest_questions(n: int = 10) -> str:
+    ranked = answer_stats.hardest_questions(n)
+    if not ranked:
+        return f"No question has {STATS_MIN_ANSWERS}+ answers yet."
+    texts = {q["id"]: q["question_text"] for q in get_questions_by_ids([qid for qid, _, _ in ranked])}
+    lines = ["<b>Hardest questions</b> (correct rate, answers)"]
+    for qid, answered, correct in ranked:
+        text = html.escape(texts.get(qid, "(deleted)"))
+        if len(text) > 80:
+            text = text[:77] + "..."
+        lines.append(f"#{qid} — {correct / answered:.0%} of {answered}: {text}")
+    return "\n".join(lines)
+
+
+def format_topic_leaderboard(n: int = 10) -> str:
+    lines = []
+    for title, hardest in (("Hardest topics", True), ("Easiest topics", False)):
+        ranked = answer_stats.topic_leaderboard(n, hardest=hardest)
+        lines.append(f"<b>{title}</b> (correct rate, answers)")
+        if not ranked:
+            lines.append(f"No topic has {STATS_MIN_ANSWERS}+ answers yet.")
+        for key, answered, correct in ranked:
+            path = " › ".join(html.escape(v) for v in key if v) or "(untagged)"
+            lines.append(f"{correct / answered:.0%} of {answered}: {path}")
+        lines.append("")
+    return "\n".join(lines).strip()
+
+
+@dp.message(Command("hardest"))
+async def cmd_hardest(message: Message):
+    if message.from_user.id not in ADMIN_IDS:
+        await outbound.send(message.answer("❌ You are not an admin."))
+        return
+    await outbound.send(message.answer(await run_db(format_hardest_questions)))
+
+
+@dp.message(Command("topics"))
+async def cmd_topics(message: Message):
+    if message.from_user.id not in ADMIN_IDS:
+        await outbound.send(message.answer("❌ You are not an admin."))
+        return
+    await outbound.send(message.answer(format_topic_leaderboard()))
+
+
+def format_broadcast(row: dict | None) -> str:
+    if row is None:
+        return "No broadcast has been sent yet. /broadcast starts one."
+    lines = [
+        f"📣 Broadcast #{row['id']}: <b>{row['status']}</b>",
+        f"sent {row['sent']}, failed {row['failed']}, skipped {row['skipped']} (no questions for their filters)",
+        f"checkpoint: users up to id {row['last_user_id']}",
+    ]
+    if broadcaster.running and broadcaster.current["id"] == row["id"]:
+        st = broadcaster.stats()
+        lines.append(f"this worker: {st['sent']} sent at {st['rate_per_s']:.1f} msg/s, {st['queued']} queued")
+    return "\n".join(lines)
+
+
+@dp.message(Command("broadcast"))
+async def cmd_broadcast(message: Message):
+    if message.from_user.id not in ADMIN_IDS:
+        await outbound.send(message.answer("❌ You are not an admin."))
+        return
+    parts = (message.text or "").split(maxsplit=1)
+    action = parts[1].strip().lower() if len(parts) > 1 else "start"
+
+    if action == "start":
+        row = await run_db(create_broadcast, message.from_user.id)
+        if row is None:
+            text = "A broadcast is already active: /broadcast status, /broadcast stop or /broadcast resume."
+        else:
+            await broadcaster.claim(("running",))
+            text = f"📣 Broadcast #{row['id']} started. /broadcast status shows progress."
+    elif action == "stop":
+        row = await run_db(pause_broadcast)
+        text = (
+            f"⏸ Broadcast #{row['id']} pauses after the current chunk; /broadcast resume continues it."
+            if row else "No broadcast is running."
+        )
+    elif action == "resume":
+        row = await broadcaster.claim(("paused", "running"))
+        if row is not None:
+            text = f"▶️ Broadcast #{row['id']} resumed after user {row['last_user_id']}."
+        elif broadcaster.running:
+            text = "The broadcast is already running."
+        else:
+            text = "Nothing to resume (or another worker is still sending it)."
+    elif action == "status":
+        text = format_broadcast(await run_db(latest_broadcast))
+    else:
+        text = "Usage: /broadcast [status | stop | resume]"
+    await outbound.send(message.answer(text))
 
 
 # ========================
@@ -329,117 +3689,111 @@ async def cmd_admin(message: Message):
 @dp.message(Command("addquestion"))
 async def cmd_addquestion(message: Message, state: FSMContext):
     if message.from_user.id not in ADMIN_IDS:
-        await message.answer("❌ You are not an admin.")
+        await outbound.send(message.answer("❌ You are not an admin."))
         return
 
     await state.clear()
     await state.set_state(AddQuestion.waiting_board)
-    await message.answer("📝 Adding new question.\n\nSend <b>Board</b> (e.g. GSEB, CBSE):")
+    await outbound.send(message.answer("📝 Adding new question.\n\nSend <b>Board</b> (e.g. GSEB, CBSE):"))
 
 
 @dp.message(AddQuestion.waiting_board)
 async def addq_board(message: Message, state: FSMContext):
     await state.update_data(board=message.text.strip())
     await state.set_state(AddQuestion.waiting_year)
-    await message.answer("Send <b>Year</b> (e.g. 2023). If not applicable, send 0:")
+    await outbound.send(message.answer("Send <b>Year</b> (e.g. 2023). If not applicable, send 0:"))
 
 
 @dp.message(AddQuestion.waiting_year)
 async def addq_year(message: Message, state: FSMContext):
-    text = message.text.strip()
     try:
-        year = int(text)
+        year = parse_year(message.text)
     except ValueError:
-        await message.answer("❌ Please send a valid number for year (e.g. 2023 or 0).")
+        await outbound.send(message.answer("❌ Please send a valid number for year (e.g. 2023 or 0)."))
         return
     await state.update_data(year=year)
     await state.set_state(AddQuestion.waiting_exam)
-    await message.answer("Send <b>Exam name</b> (e.g. Talati, DYSO):")
+    await outbound.send(message.answer("Send <b>Exam name</b> (e.g. Talati, DYSO):"))
 
 
 @dp.message(AddQuestion.waiting_exam)
 async def addq_exam(message: Message, state: FSMContext):
     await state.update_data(exam=message.text.strip())
     await state.set_state(AddQuestion.waiting_subject)
-    await message.answer("Send <b>Subject</b> (e.g. Polity, Science):")
+    await outbound.send(message.answer("Send <b>Subject</b> (e.g. Polity, Science):"))
 
 
 @dp.message(AddQuestion.waiting_subject)
 async def addq_subject(message: Message, state: FSMContext):
     await state.update_data(subject=message.text.strip())
     await state.set_state(AddQuestion.waiting_topic)
-    await message.answer("Send <b>Topic</b>:")
+    await outbound.send(message.answer("Send <b>Topic</b>:"))
 
 
 @dp.message(AddQuestion.waiting_topic)
 async def addq_topic(message: Message, state: FSMContext):
     await state.update_data(topic=message.text.strip())
     await state.set_state(AddQuestion.waiting_subtopic)
-    await message.answer("Send <b>Subtopic</b> (or '-' if not used):")
+    await outbound.send(message.answer("Send <b>Subtopic</b> (or '-' if not used):"))
 
 
 @dp.message(AddQuestion.waiting_subtopic)
 async def addq_subtopic(message: Message, state: FSMContext):
-    subtopic = message.text.strip()
-    if subtopic == "-":
-        subtopic = ""
-    await state.update_data(subtopic=subtopic)
+    await state.update_data(subtopic=optional_text(message.text))
     await state.set_state(AddQuestion.waiting_question_text)
-    await message.answer("Send the <b>Question text</b>:")
+    await outbound.send(message.answer("Send the <b>Question text</b>:"))
 
 
 @dp.message(AddQuestion.waiting_question_text)
 async def addq_question_text(message: Message, state: FSMContext):
     await state.update_data(question_text=message.text.strip())
     await state.set_state(AddQuestion.waiting_option1)
-    await message.answer("Send <b>Option 1</b>:")
+    await outbound.send(message.answer("Send <b>Option 1</b>:"))
 
 
 @dp.message(AddQuestion.waiting_option1)
 async def addq_option1(message: Message, state: FSMContext):
     await state.update_data(option1=message.text.strip())
     await state.set_state(AddQuestion.waiting_option2)
-    await message.answer("Send <b>Option 2</b>:")
+    await outbound.send(message.answer("Send <b>Option 2</b>:"))
 
 
 @dp.message(AddQuestion.waiting_option2)
 async def addq_option2(message: Message, state: FSMContext):
     await state.update_data(option2=message.text.strip())
     await state.set_state(AddQuestion.waiting_option3)
-    await message.answer("Send <b>Option 3</b>:")
+    await outbound.send(message.answer("Send <b>Option 3</b>:"))
 
 
 @dp.message(AddQuestion.waiting_option3)
 async def addq_option3(message: Message, state: FSMContext):
     await state.update_data(option3=message.text.strip())
     await state.set_state(AddQuestion.waiting_option4)
-    await message.answer("Send <b>Option 4</b>:")
+    await outbound.send(message.answer("Send <b>Option 4</b>:"))
 
 
 @dp.message(AddQuestion.waiting_option4)
 async def addq_option4(message: Message, state: FSMContext):
     await state.update_data(option4=message.text.strip())
     await state.set_state(AddQuestion.waiting_correct_option)
-    await message.answer("Send <b>correct option number</b> (1–4):")
+    await outbound.send(message.answer("Send <b>correct option number</b> (1–4):"))
 
 
 @dp.message(AddQuestion.waiting_correct_option)
 async def addq_correct_option(message: Message, state: FSMContext):
-    text = message.text.strip()
-    if text not in {"1", "2", "3", "4"}:
-        await message.answer("❌ Please send a number between 1 and 4.")
+    try:
+        correct_option = parse_correct_option(message.text)
+    except ValueError:
+        await outbound.send(message.answer("❌ Please send a number between 1 and 4."))
         return
-    await state.update_data(correct_option=int(text))
+    await state.update_data(correct_option=correct_option)
     await state.set_state(AddQuestion.waiting_explanation)
-    await message.answer("Send <b>Explanation</b> (or '-' to skip):")
+    await outbound.send(message.answer("Send <b>Explanation</b> (or '-' to skip):"))
 
 
 @dp.message(AddQuestion.waiting_explanation)
 async def addq_explanation(message: Message, state: FSMContext):
-    expl = message.text.strip()
-    if expl == "-":
-        expl = ""
-    await state.update_data(explanation=expl)
+    await state.update_data(explanation=optional_text(message.text))
 
     data = await state.get_data()
     preview = (
@@ -458,6 +3812,15 @@ async def addq_explanation(message: Message, state: FSMContext):
         f"✅ Correct: {data.get('correct_option')}\n\n"
         f"Explanation: {data.get('explanation') or '(none)'}"
     )
+    matches = await run_db(find_near_duplicates, question_shingles(data))
+    if matches:
+        preview += "\n\n⚠️ <b>Possible duplicates:</b>"
+        for similarity, q in matches:
+            text = q["question_text"] if len(q["question_text"]) <= 80 else q["question_text"][:77] + "..."
+            preview += (
+                f"\n#{q['id']} ({similarity:.0%} similar; {html.escape(str(q['board']))} {q['year']}, "
+                f"{html.escape(str(q['exam']))}): {html.escape(text)}"
+            )
 
     kb = InlineKeyboardMarkup(
         inline_keyboard=[
@@ -469,179 +3832,280 @@ async def addq_explanation(message: Message, state: FSMContext):
     )
 
     await state.set_state(AddQuestion.waiting_confirm)
-    await message.answer(preview, reply_markup=kb)
+    await outbound.send(message.answer(preview, reply_markup=kb))
 
 
 @dp.callback_query(AddQuestion.waiting_confirm, F.data == "addq_cancel")
 async def addq_cancel(cb: CallbackQuery, state: FSMContext):
     await state.clear()
-    await cb.message.edit_text("❌ Question creation cancelled.")
+    await outbound.send(cb.message.edit_text("❌ Question creation cancelled."))
     await cb.answer()
 
 
 @dp.callback_query(AddQuestion.waiting_confirm, F.data == "addq_save")
 async def addq_save(cb: CallbackQuery, state: FSMContext):
     data = await state.get_data()
-    qid = insert_question(data)
+    qid = await run_db(insert_question, data)
     await state.clear()
-    await cb.message.edit_text(f"✅ Question saved with ID <b>{qid}</b>.")
+    await outbound.send(cb.message.edit_text(f"✅ Question saved with ID <b>{qid}</b>."))
     await cb.answer()
 
 
+# ========================
+# ADMIN – BULK IMPORT
+# ========================
+
+@dp.message(Command("import"))
+async def cmd_import(message: Message, state: FSMContext):
+    if message.from_user.id not in ADMIN_IDS:
+        await outbound.send(message.answer("❌ You are not an admin."))
+        return
+
+    await state.clear()
+    await state.set_state(ImportQuestions.waiting_file)
+    await outbound.send(message.answer(
+        "📥 Send a <b>.csv</b> or <b>.jsonl</b> file with columns:\n"
+        f"<code>{', '.join(QUESTION_COLUMNS)}</code>\n\n"
+        "Rules are the same as /addquestion: year is a number (0 if not applicable), "
+        "correct_option is 1–4, '-' skips subtopic/explanation.\n"
+        "Rows nearly identical to a stored question or an earlier row are skipped.\n"
+        "Send /cancel to stop."
+    ))
+
+
+@dp.message(ImportQuestions.waiting_file, Command("cancel"))
+async def import_cancel(message: Message, state: FSMContext):
+    await state.clear()
+    await outbound.send(message.answer("❌ Import cancelled."))
+
+
+@dp.message(ImportQuestions.waiting_file, F.document)
+async def import_file(message: Message, state: FSMContext):
+    fmt = import_format_for(message.document.file_name or "")
+    if fmt is None:
+        await outbound.send(message.answer("❌ Please send a file ending in .csv or .jsonl."))
+        return
+
+    await state.clear()
+    await outbound.send(message.answer("⏳ Importing..."))
+    await fsm_commit()
+    buf = io.BytesIO()
+    await bot.download(message.document, destination=buf)
+    buf.seek(0)
+    stream = io.TextIOWrapper(buf, encoding="utf-8-sig", newline="")
+    try:
+        report = await run_db(import_questions, stream, fmt)
+    except UnicodeDecodeError:
+        await outbound.send(message.answer("❌ The file is not valid UTF-8."))
+        return
+    except csv.Error as e:
+        await outbound.send(message.answer(f"❌ Could not parse the CSV: {html.escape(str(e))}"))
+        return
+    except psycopg2.Error as e:
+        logging.exception("Import of %s failed", message.document.file_name)
+        await outbound.send(message.answer(
+            f"❌ The database rejected the import; nothing was loaded: {html.escape(str(e).strip())}"
+        ))
+        return
+    await outbound.send(message.answer("✅ " + html.escape(format_import_report(report))))
+
+
+@dp.message(ImportQuestions.waiting_file)
+async def import_waiting(message: Message):
+    await outbound.send(message.answer("Please send the file as a document, or /cancel."))
+
+
 # ========================
 # USER FILTERS HANDLERS
 # ========================
 
 @dp.callback_query(F.data == "back_to_main")
 async def back_to_main(cb: CallbackQuery):
-    await cb.message.edit_text(
+    await outbound.send(cb.message.edit_text(
         "Use the buttons below to set filters and generate PYQ quizzes:",
-        reply_markup=main_menu_kb(cb.from_user.id),
-    )
+        reply_markup=await main_menu_kb(cb.from_user.id),
+    ))
     await cb.answer()
 
 
 @dp.callback_query(F.data == "reset_filters")
 async def cb_reset_filters(cb: CallbackQuery):
-    reset_user_filters(cb.from_user.id)
-    await cb.message.edit_text(
+    await run_user_filters(reset_user_filters, cb.from_user.id)
+    await outbound.send(cb.message.edit_text(
         "♻️ Filters reset.\n\nUse buttons to set filters:",
-        reply_markup=main_menu_kb(cb.from_user.id),
-    )
+        reply_markup=await main_menu_kb(cb.from_user.id),
+    ))
     await cb.answer("Filters cleared.")
 
 
 @dp.callback_query(F.data == "choose_board")
 async def cb_choose_board(cb: CallbackQuery):
-    values = get_distinct_values("board")
-    if not values:
+    kb = await run_db(facet_page_kb, "board")
+    if kb is None:
         await cb.answer("No boards in database yet.", show_alert=True)
         return
-    await cb.message.edit_text(
-        "Select <b>Board</b>:", reply_markup=values_list_kb("set_board", values)
-    )
+    await outbound.send(cb.message.edit_text(
+        "Select <b>Board</b>:", reply_markup=kb
+    ))
     await cb.answer()
 
 @dp.callback_query(F.data == "choose_year")
 async def cb_choose_year(cb: CallbackQuery):
-    filters = get_or_create_user_filters(cb.from_user.id)
-    values = get_distinct_values("year", filters)
-    if not values:
+    filters = await run_user_filters(get_or_create_user_filters, cb.from_user.id)
+    kb = await run_db(facet_page_kb, "year", filters)
+    if kb is None:
         await cb.answer("No years for current filters.", show_alert=True)
         return
-    await cb.message.edit_text(
-        "Select <b>Year</b>:", reply_markup=values_list_kb("set_year", values)
-    )
+    await outbound.send(cb.message.edit_text(
+        "Select <b>Year</b>:", reply_markup=kb
+    ))
     await cb.answer()
 
 
 @dp.callback_query(F.data == "choose_exam")
 async def cb_choose_exam(cb: CallbackQuery):
-    filters = get_or_create_user_filters(cb.from_user.id)
-    values = get_distinct_values("exam", filters)
-    if not values:
+    filters = await run_user_filters(get_or_create_user_filters, cb.from_user.id)
+    kb = await run_db(facet_page_kb, "exam", filters)
+    if kb is None:
         await cb.answer("No exams for current filters.", show_alert=True)
         return
-    await cb.message.edit_text(
-        "Select <b>Exam</b>:", reply_markup=values_list_kb("set_exam", values)
-    )
+    await outbound.send(cb.message.edit_text(
+        "Select <b>Exam</b>:", reply_markup=kb
+    ))
     await cb.answer()
 
 
 @dp.callback_query(F.data == "choose_subject")
 async def cb_choose_subject(cb: CallbackQuery):
-    filters = get_or_create_user_filters(cb.from_user.id)
-    values = get_distinct_values("subject", filters)
-    if not values:
+    filters = await run_user_filters(get_or_create_user_filters, cb.from_user.id)
+    kb = await run_db(facet_page_kb, "subject", filters)
+    if kb is None:
         await cb.answer("No subjects for current filters.", show_alert=True)
         return
-    await cb.message.edit_text(
-        "Select <b>Subject</b>:", reply_markup=values_list_kb("set_subject", values)
-    )
+    await outbound.send(cb.message.edit_text(
+        "Select <b>Subject</b>:", reply_markup=kb
+    ))
     await cb.answer()
 
 
 @dp.callback_query(F.data == "choose_topic")
 async def cb_choose_topic(cb: CallbackQuery):
-    filters = get_or_create_user_filters(cb.from_user.id)
-    values = get_distinct_values("topic", filters)
-    if not values:
+    filters = await run_user_filters(get_or_create_user_filters, cb.from_user.id)
+    kb = await run_db(facet_page_kb, "topic", filters)
+    if kb is None:
         await cb.answer("No topics for current filters.", show_alert=True)
         return
-    await cb.message.edit_text(
-        "Select <b>Topic</b>:", reply_markup=values_list_kb("set_topic", values)
-    )
+    await outbound.send(cb.message.edit_text(
+        "Select <b>Topic</b>:", reply_markup=kb
+    ))
     await cb.answer()
 
 @dp.callback_query(F.data == "choose_subtopic")
 async def cb_choose_subtopic(cb: CallbackQuery):
-    filters = get_or_create_user_filters(cb.from_user.id)
-    values = get_distinct_values("subtopic", filters)
-    if not values:
+    filters = await run_user_filters(get_or_create_user_filters, cb.from_user.id)
+    kb = await run_db(facet_page_kb, "subtopic", filters)
+    if kb is None:
         await cb.answer("No subtopics for current filters.", show_alert=True)
         return
-    await cb.message.edit_text(
-        "Select <b>Subtopic</b>:", reply_markup=values_list_kb("set_subtopic", values)
-    )
+    await outbound.send(cb.message.edit_text(
+        "Select <b>Subtopic</b>:", reply_markup=kb
+    ))
+    await cb.answer()
+
+
+@dp.callback_query(F.data.startswith("page_"))
+async def cb_facet_page(cb: CallbackQuery):
+    head, direction, vid = cb.data.split(":", 2)
+    field = head[len("page_"):]
+    if field not in FIELD_LABELS or direction not in {"n", "p"}:
+        await cb.answer()
+        return
+    cursor = value_index.value_for(field, vid) or await run_db(value_index.resolve, field, vid)
+    if cursor is None:
+        await cb.answer("This menu is out of date. Please open it again.", show_alert=True)
+        return
+    # The board menu is never narrowed by other filters (see cb_choose_board)
+    filters = None
+    if field != "board":
+        filters = await run_user_filters(get_or_create_user_filters, cb.from_user.id)
+    kb = await run_db(facet_page_kb, field, filters, cursor, direction)
+    if kb is None:
+        await cb.answer("No more values.", show_alert=True)
+        return
+    await outbound.send(cb.message.edit_text(
+        f"Select <b>{FIELD_LABELS[field]}</b>:", reply_markup=kb
+    ))
     await cb.answer()
 
 
 @dp.callback_query(F.data.startswith("set_board:"))
 async def cb_set_board(cb: CallbackQuery):
-    value = cb.data.split("set_board:", 1)[1]
-    update_user_filter(cb.from_user.id, "board", value)
+    value = await callback_value(cb, "board")
+    if value is None:
+        return
+    await run_user_filters(update_user_filter, cb.from_user.id, "board", value)
     await cb.answer("Board set.")
-    await cb.message.edit_text(
-        "Filters updated:", reply_markup=main_menu_kb(cb.from_user.id)
-    )
+    await outbound.send(cb.message.edit_text(
+        "Filters updated:", reply_markup=await main_menu_kb(cb.from_user.id)
+    ))
 
 @dp.callback_query(F.data.startswith("set_year:"))
 async def cb_set_year(cb: CallbackQuery):
-    value = cb.data.split("set_year:", 1)[1]
-    update_user_filter(cb.from_user.id, "year", value)
+    value = await callback_value(cb, "year")
+    if value is None:
+        return
+    await run_user_filters(update_user_filter, cb.from_user.id, "year", value)
     await cb.answer("Year set.")
-    await cb.message.edit_text(
-        "Filters updated:", reply_markup=main_menu_kb(cb.from_user.id)
-    )
+    await outbound.send(cb.message.edit_text(
+        "Filters updated:", reply_markup=await main_menu_kb(cb.from_user.id)
+    ))
 
 
 @dp.callback_query(F.data.startswith("set_exam:"))
 async def cb_set_exam(cb: CallbackQuery):
-    value = cb.data.split("set_exam:", 1)[1]
-    update_user_filter(cb.from_user.id, "exam", value)
+    value = await callback_value(cb, "exam")
+    if value is None:
+        return
+    await run_user_filters(update_user_filter, cb.from_user.id, "exam", value)
     await cb.answer("Exam set.")
-    await cb.message.edit_text(
-        "Filters updated:", reply_markup=main_menu_kb(cb.from_user.id)
-    )
+    await outbound.send(cb.message.edit_text(
+        "Filters updated:", reply_markup=await main_menu_kb(cb.from_user.id)
+    ))
 
 
 @dp.callback_query(F.data.startswith("set_subject:"))
 async def cb_set_subject(cb: CallbackQuery):
-    value = cb.data.split("set_subject:", 1)[1]
-    update_user_filter(cb.from_user.id, "subject", value)
+    value = await callback_value(cb, "subject")
+    if value is None:
+        return
+    await run_user_filters(update_user_filter, cb.from_user.id, "subject", value)
     await cb.answer("Subject set.")
-    await cb.message.edit_text(
-        "Filters updated:", reply_markup=main_menu_kb(cb.from_user.id)
-    )
+    await outbound.send(cb.message.edit_text(
+        "Filters updated:", reply_markup=await main_menu_kb(cb.from_user.id)
+    ))
 
 
 @dp.callback_query(F.data.startswith("set_topic:"))
 async def cb_set_topic(cb: CallbackQuery):
-    value = cb.data.split("set_topic:", 1)[1]
-    update_user_filter(cb.from_user.id, "topic", value)
+    value = await callback_value(cb, "topic")
+    if value is None:
+        return
+    await run_user_filters(update_user_filter, cb.from_user.id, "topic", value)
     await cb.answer("Topic set.")
-    await cb.message.edit_text(
-        "Filters updated:", reply_markup=main_menu_kb(cb.from_user.id)
-    )
+    await outbound.send(cb.message.edit_text(
+        "Filters updated:", reply_markup=await main_menu_kb(cb.from_user.id)
+    ))
 
 @dp.callback_query(F.data.startswith("set_subtopic:"))
 async def cb_set_subtopic(cb: CallbackQuery):
-    value = cb.data.split("set_subtopic:", 1)[1]
-    update_user_filter(cb.from_user.id, "subtopic", value)
+    value = await callback_value(cb, "subtopic")
+    if value is None:
+        return
+    await run_user_filters(update_user_filter, cb.from_user.id, "subtopic", value)
     await cb.answer("Subtopic set.")
-    await cb.message.edit_text(
-        "Filters updated:", reply_markup=main_menu_kb(cb.from_user.id)
-    )
+    await outbound.send(cb.message.edit_text(
+        "Filters updated:", reply_markup=await main_menu_kb(cb.from_user.id)
+    ))
 
 
 # ========================
@@ -650,60 +4114,339 @@ async def cb_set_subtopic(cb: CallbackQuery):
 
 @dp.callback_query(F.data == "generate_quiz")
 async def cb_generate_quiz(cb: CallbackQuery):
-    filters = get_or_create_user_filters(cb.from_user.id)
-    questions = get_questions_for_filters(filters, limit=10)
+    key = (cb.from_user.id, "generate_quiz")
+    if not in_flight.acquire(key):
+        updates_suppressed.inc("quiz_in_flight")
+        await cb.answer("Your quiz is already being prepared.")
+        return
+    try:
+        await send_quiz(cb)
+    finally:
+        in_flight.release(key)
+
+
+async def send_quiz(cb: CallbackQuery):
+    filters = await run_user_filters(get_or_create_user_filters, cb.from_user.id)
+    key = filter_key(filters)
+    quiz_prefetch.note(key)
+    prefetched = quiz_prefetch.take(cb.from_user.id, key)
+    if prefetched is not None:
+        questions, restarted, polls = prefetched["questions"], prefetched["restarted"], prefetched["polls"]
+    else:
+        questions, restarted = await run_db(next_quiz_questions, cb.from_user.id, filters, 10)
+        polls = [quiz_poll(q) for q in questions]
 
     if not questions:
         await cb.answer("No questions for these filters.", show_alert=True)
         return
 
     await cb.answer("Sending questions...")
-    await cb.message.answer(
-        f"🎯 Found <b>{len(questions)}</b> questions. Sending as quiz polls..."
-    )
-
-    for q in questions:
-        options = [q["option1"], q["option2"], q["option3"], q["option4"]]
-        correct_idx = int(q["correct_option"]) - 1  # convert 1-4 -> 0-3
-
-        await cb.message.answer_poll(
-            question=q["question_text"],
-            options=options,
-            type="quiz",
-            correct_option_id=correct_idx,
-            explanation=q["explanation"] or None,
-            is_anonymous=False,
-        )
+    intro = f"🎯 Found <b>{len(questions)}</b> questions. Sending as quiz polls..."
+    if restarted:
+        intro = "🔁 You have seen every question for these filters, starting a new round.\n" + intro
+    methods = [cb.message.answer(intro)]
+    methods += [cb.message.answer_poll(**poll) for poll in polls]
+
+    def remember_poll(i: int, sent: Message):
+        if i and sent.poll:  # methods[0] is the intro message
+            q = questions[i - 1]
+            poll_registry.add(sent.poll.id, q["id"], int(q["correct_option"]) - 1, topic_key(q))
+
+    await outbound.send(*methods, kind="quiz", on_sent=remember_poll)
+    quiz_prefetch.schedule(cb.from_user.id, filters)
+
+
+@dp.poll_answer()
+async def on_poll_answer(poll_answer: PollAnswer):
+    entry = poll_registry.get(poll_answer.poll_id)
+    if entry is None and poll_registry.shared:
+        entry = await run_db(poll_registry.lookup, poll_answer.poll_id)
+    if entry is None or not poll_answer.option_ids or poll_answer.user is None:
+        return
+    question_id, correct_option_id, topic = entry
+    option_id = poll_answer.option_ids[0]
+    correct = option_id == correct_option_id
+    answer_stats.record(question_id, topic, correct)
+    answer_buffer.add(poll_answer.user.id, question_id, topic, poll_answer.poll_id, option_id, correct)
+    if len(answer_buffer) >= ANSWER_FLUSH_BATCH and not answer_buffer.flushing:
+        answer_buffer.flushing = True
+        try:
+            await run_db(answer_buffer.flush)
+        finally:
+            answer_buffer.flushing = False
+
+
+@dp.message(Command("score"))
+async def cmd_score(message: Message):
+    answered, correct = await run_db(get_user_score, message.from_user.id)
+    if not answered:
+        await outbound.send(message.answer("You have not answered any quiz questions yet."))
+        return
+    await outbound.send(message.answer(
+        f"📊 You answered <b>{answered}</b> questions, <b>{correct}</b> correctly "
+        f"({correct / answered:.0%})."
+    ))
 
 
 # ========================
 # MAIN
 # ========================
 
+background_tasks: list[asyncio.Task] = []
+
+
+async def run_periodically(interval: float, func):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_db(func)
+        except Exception:
+            logging.exception("Periodic task %s failed", func.__qualname__)
+
+
+async def on_startup():
+    outbound.start()
+    quiz_prefetch.start()
+    broadcaster.start()
+    near_duplicates_stop.clear()
+    background_tasks.append(asyncio.create_task(prepare_near_duplicates()))
+    for store in write_behind_stores:
+        background_tasks.append(
+            asyncio.create_task(run_periodically(WRITE_BEHIND_FLUSH_INTERVAL, store.flush))
+        )
+    background_tasks.append(
+        asyncio.create_task(run_periodically(ANSWER_FLUSH_INTERVAL, answer_buffer.flush))
+    )
+    # CLI imports reach a single worker this way too
+    background_tasks.append(asyncio.create_task(run_periodically(QUESTION_SYNC_INTERVAL, question_sync.sync)))
+    if MULTI_WORKER:
+        for interval, func in (
+            (POLL_SYNC_INTERVAL, poll_registry.flush),
+            (STATS_RELOAD_INTERVAL, refresh_answer_stats),
+        ):
+            background_tasks.append(asyncio.create_task(run_periodically(interval, func)))
+
+
+async def on_shutdown():
+    near_duplicates_stop.set()
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+    await quiz_prefetch.close()
+    await broadcaster.close()
+    await outbound.close(timeout=10)
+    for store in (*write_behind_stores, answer_buffer, poll_registry):
+        try:
+            store.flush()
+        except Exception:
+            logging.exception("Final flush of %s failed", type(store).__name__)
+    close_db_executor()
+    close_db_pool()
+
+
+def gauge_lines(name: str, help_text: str, labels: tuple, samples) -> list[str]:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+    lines.extend(f"{name}{format_labels(labels, values)} {v}" for values, v in samples)
+    return lines
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in metrics_registry:
+        lines.extend(metric.render())
+    # point-in-time numbers the components already keep
+    stats = {
+        "bot_outbound": outbound.stats(),
+        "bot_sends": send_stats,
+        "bot_quiz_prefetch": quiz_prefetch.stats(),
+        "bot_broadcast": broadcaster.stats(),
+        "bot_near_duplicates": near_duplicates.stats(),
+    }
+    if db_pool is not None:
+        stats["bot_db_pool"] = db_pool.stats()
+    for name, values in stats.items():
+        lines += gauge_lines(name, "Component state", ("stat",), [((k,), v) for k, v in values.items()])
+    caches = {
+        "question_ids": question_id_cache,
+        "facets": facet_cache,
+        "menu_pages": facet_page_cache,
+        "main_menus": main_menu_cache,
+        "user_filters": user_filter_store,
+        "quiz_sessions": quiz_session_store,
+    }
+    samples = [((name, k), v) for name, cache in caches.items() for k, v in cache.stats().items()]
+    lines += gauge_lines("bot_cache", "Cache entries, hits and misses", ("cache", "stat"), samples)
+    # workers share one port, so tell scrapers which process answered
+    lines += gauge_lines("bot_worker", "Worker process that served this scrape", ("pid",), [((os.getpid(),), 1)])
+    return "\n".join(lines) + "\n"
+
+
+async def metrics_view(request: web.Request) -> web.Response:
+    if not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {METRICS_TOKEN}"):
+        raise web.HTTPUnauthorized()
+    return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8")
+
+
 async def main():
     logging.basicConfig(level=logging.INFO)
 
     # Initialize database
+    init_db_pool()
+    init_db_executor()
     init_db()
+    load_question_caches()
+    answer_stats.load()
+    if MULTI_WORKER:
+        if FSM_STORAGE == "memory":
+            logging.warning("FSM_STORAGE=memory with %s workers: admin flows will lose their state", WEB_WORKERS)
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
 
     # Create aiohttp web app
     app = web.Application()
 
-    # Register Telegram webhook handler on path /webhook
+    # Let aiogram attach its startup/shutdown handlers; first, so on_shutdown drains the
+    # outbound queue before the webhook handler's hook closes the bot session
+    setup_application(app, dp, bot=bot)
+
+    # Register Telegram webhook handler on path /webhook; updates are processed after the
+    # 200 is sent and replies go through the outbound queue
     SimpleRequestHandler(
         dispatcher=dp,
         bot=bot,
+        handle_in_background=True,
     ).register(app, path="/webhook")
-
-    # Let aiogram attach its startup/shutdown handlers
-    setup_application(app, dp, bot=bot)
+    if METRICS_TOKEN:
+        app.router.add_get("/metrics", metrics_view)
 
     return app
 
 
+async def serve_worker(host: str, port: int, ready=None):
+    """Serve the webhook until SIGTERM/SIGINT; as one of several workers the port is shared via
+    SO_REUSEPORT, each worker with its own pool, executor and caches."""
+    app = await main()
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port, reuse_port=MULTI_WORKER).start()
+    logging.info("Worker %s listening on %s:%s", os.getpid(), host, port)
+    if ready is not None:
+        ready.set()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+    # stops accepting, lets in-flight requests finish, then runs on_shutdown (drain and flush)
+    await runner.cleanup()
+
+
+def run_worker(host: str, port: int, ready):
+    asyncio.run(serve_worker(host, port, ready))
+
+
+class Supervisor:
+    """Pre-fork supervisor for WEB_WORKERS worker processes on one port.
+
+    Workers are started as fresh interpreters, so a rolling restart (SIGHUP) picks up new code:
+    each worker is replaced only once its successor is listening. Workers that die are
+    restarted; SIGTERM/SIGINT stops them all gracefully."""
+
+    def __init__(self, workers: int, host: str, port: int):
+        self.workers = workers
+        self.host = host
+        self.port = port
+        self.ctx = multiprocessing.get_context("spawn")
+        self.procs: list = []
+        self.stopping = False
+        self.reload = False
+
+    def spawn(self):
+        ready = self.ctx.Event()
+        proc = self.ctx.Process(target=run_worker, args=(self.host, self.port, ready), daemon=False)
+        proc.start()
+        deadline = time.monotonic() + WORKER_START_TIMEOUT
+        while not ready.wait(0.5):
+            if not proc.is_alive() or time.monotonic() > deadline or self.stopping:
+                logging.error("Worker %s failed to start", proc.pid)
+                self.stop(proc)
+                return None
+        return proc
+
+    @staticmethod
+    def stop(proc):
+        if proc.is_alive():
+            proc.terminate()
+        proc.join(WORKER_STOP_TIMEOUT)
+        if proc.is_alive():
+            logging.warning("Worker %s did not stop in %ss, killing it", proc.pid, WORKER_STOP_TIMEOUT)
+            proc.kill()
+            proc.join()
+
+    def rolling_restart(self):
+        logging.info("Rolling restart of %s workers", len(self.procs))
+        for i, old in enumerate(list(self.procs)):
+            new = self.spawn()
+            if new is None:
+                logging.error("Rolling restart aborted, keeping the remaining workers")
+                return
+            self.procs[i] = new
+            if old is not None:
+                self.stop(old)
+
+    def _signal(self, signum, frame):
+        if signum == signal.SIGHUP:
+            self.reload = True
+        else:
+            self.stopping = True
+
+    def run(self) -> int:
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(sig, self._signal)
+        # the workers read this to switch to their multi-process behaviour
+        os.environ["WEB_WORKERS"] = str(self.workers)
+        for _ in range(self.workers):
+            proc = self.spawn()
+            if proc is None:
+                self.stopping = True
+                break
+            self.procs.append(proc)
+        while not self.stopping:
+            if self.reload:
+                self.reload = False
+                self.rolling_restart()
+            for i, proc in enumerate(self.procs):
+                if self.stopping or self.reload:
+                    break
+                if proc is None or not proc.is_alive():
+                    if proc is not None:
+                        logging.warning("Worker %s exited with %s, restarting", proc.pid, proc.exitcode)
+                    self.procs[i] = self.spawn()
+            time.sleep(1)
+        for proc in self.procs:
+            if proc is not None and proc.is_alive():
+                proc.terminate()
+        for proc in self.procs:
+            if proc is not None:
+                self.stop(proc)
+        return 0
+
+
+def serve_cli(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(description="Serve the Telegram webhook.")
+    parser.add_argument("--workers", type=int, default=WEB_WORKERS, help="worker processes sharing the port")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8080")))
+    args = parser.parse_args(argv)
+    if args.workers <= 1:
+        asyncio.run(serve_worker(args.host, args.port))
+        return 0
+    logging.basicConfig(level=logging.INFO)
+    return Supervisor(args.workers, args.host, args.port).run()
+
+
 if __name__ == "__main__":
-    web.run_app(
-        main(),
-        host="0.0.0.0",
-        port=int(os.getenv("PORT", "8080")),
-    )
+    if sys.argv[1:2] == ["import"]:
+        sys.exit(import_cli(sys.argv[2:]))
+    sys.exit(serve_cli(sys.argv[1:]))